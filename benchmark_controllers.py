@@ -0,0 +1,95 @@
+# Run every signal controller headless on the same seeded demand and compare them.
+#
+#   python benchmark_controllers.py --seconds 600 --seed 1
+#   python benchmark_controllers.py --record logs         # write logs/<controller>.tlog
+#   python benchmark_controllers.py --replay logs/knn.tlog  # every controller on that traffic
+import argparse
+import os
+from controllers import (FixedRotationController, KNNTrafficController, DecisionTreeTrafficController,
+                         DensityKNNController, FormulaController)
+from event_log import EventLog, EventLogWriter, ReplayDemand
+from simulation_headless import HeadlessSimulation, Demand, TICK_MS
+
+# Controller factories, keyed by the name used on the command line
+CONTROLLERS = {
+    'fixed': FixedRotationController,  # simulation_Dy2.py
+    'knn': lambda: KNNTrafficController(verbose=False),  # simulation_knn.py
+    'tree': lambda: DecisionTreeTrafficController(verbose=False),  # simulation_decision.py
+    'density_knn': lambda: DensityKNNController(verbose=False),  # simulation_Dy3.py
+    'formula': FormulaController,  # setTime() in simulation.py
+}
+
+COLUMNS = [
+    ('controller', 'Controller', 18, ''),
+    ('throughput', 'Veh/min', 9, '.1f'),
+    ('mean_wait', 'Mean wait s', 12, '.1f'),
+    ('p95_wait', 'P95 wait s', 11, '.1f'),
+    ('decision_ms', 'Decision ms', 12, '.3f'),
+    ('steps_per_second', 'Steps/s', 10, '.0f'),
+]
+
+
+def run_controller(controller, seconds, seed, interval_ms=750, record=None, replay=None):
+    """Simulate one controller headless and return its summary
+
+    record is a path to write the run's event log to; replay is an EventLog
+    whose spawns replace the seeded demand.
+    """
+    demand = ReplayDemand(replay) if replay is not None else Demand(seed, interval_ms)
+    recorder = None
+    if record:
+        recorder = EventLogWriter(record, source='headless', controller=controller.name, seed=seed,
+                                  interval_ms=interval_ms, seconds=seconds, tick_ms=TICK_MS)
+    try:
+        result = HeadlessSimulation(controller, demand=demand, recorder=recorder).run(seconds)
+    finally:
+        if recorder is not None:
+            recorder.close()
+    result['controller'] = controller.name
+    if hasattr(controller, 'prediction_cache'):
+        result['prediction_cache'] = controller.prediction_cache.stats()
+    if hasattr(controller, 'retrain_scheduler'):
+        result['retrains'] = len(controller.retrain_scheduler.retrains)
+    return result
+
+
+def format_table(results, columns=COLUMNS):
+    """Render result dicts as a fixed-width text table"""
+    header = ' '.join(f"{title:<{width}}" if not spec else f"{title:>{width}}" for _, title, width, spec in columns)
+    lines = [header, '-' * len(header)]
+    for result in results:
+        lines.append(' '.join(f"{result[key]:<{width}}" if not spec else f"{result[key]:>{width}{spec}}"
+                             for key, _, width, spec in columns))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare signal controllers on identical seeded demand")
+    parser.add_argument('--seconds', type=float, default=600, help="simulated seconds per controller")
+    parser.add_argument('--seed', type=int, default=0, help="demand seed shared by every controller")
+    parser.add_argument('--interval', type=float, default=750, help="milliseconds between generated vehicles")
+    parser.add_argument('--controllers', nargs='+', choices=list(CONTROLLERS), default=list(CONTROLLERS))
+    parser.add_argument('--record', metavar='DIR', help="write an event log per controller to this directory")
+    parser.add_argument('--replay', metavar='LOG', help="drive every controller with the spawns of this event log")
+    args = parser.parse_args()
+
+    replay = EventLog(args.replay) if args.replay else None
+    if args.record:
+        os.makedirs(args.record, exist_ok=True)
+    results = []
+    for name in args.controllers:
+        record = os.path.join(args.record, f"{name}.tlog") if args.record else None
+        results.append(run_controller(CONTROLLERS[name](), args.seconds, args.seed, args.interval, record, replay))
+    source = f"traffic from {args.replay}" if replay is not None else f"seed {args.seed}"
+    print(f"{args.seconds:.0f} simulated seconds per controller, {source}")
+    print(format_table(results))
+    for result in results:
+        if 'prediction_cache' in result:
+            cache = result['prediction_cache']
+            print(f"{result['controller']} prediction cache: {cache['hits']} hits of "
+                  f"{cache['hits'] + cache['misses']} lookups ({cache['hit_rate']:.0%}), "
+                  f"{cache['invalidations']} invalidations, {result['retrains']} retrains in {result['cycles']} cycles")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+# Cost of snapshotting and forking the headless simulation, and a what-if rollout.
+#
+#   python benchmark_fork.py --vehicles 100 1000
+#   python benchmark_fork.py --what-if 1 --greens 5 8 12 --horizon 30   # EAST for 5, 8 or 12 s next?
+#
+# A state with the requested number of vehicles is built by running a seeded
+# demand that arrives faster than the junction clears it; past what the road
+# holds, the extra vehicles wait to enter. snapshot(), restore() and fork() are
+# timed on that state against copy.deepcopy() and against one simulation step,
+# and the fork is checked to continue exactly like the original.
+import argparse
+import copy
+import time
+import numpy as np
+from benchmark_controllers import format_table
+from controllers import FixedRotationController, FirstDecision, next_in_sequence, DIRECTION_NAMES
+from simulation_headless import HeadlessSimulation, Demand, TICK_MS
+
+COLUMNS = [
+    ('vehicles', 'Vehicles', 9, 'd'),
+    ('on_road', 'On road', 8, 'd'),
+    ('snapshot_us', 'Snapshot us', 12, '.1f'),
+    ('restore_us', 'Restore us', 11, '.1f'),
+    ('fork_us', 'Fork us', 9, '.1f'),
+    ('deepcopy_us', 'Deepcopy us', 12, '.1f'),
+    ('step_us', 'Step us', 9, '.1f'),
+    ('fork_steps', 'Fork/step', 10, '.2f'),
+    ('identical', 'Identical', 10, ''),
+]
+
+WHAT_IF_COLUMNS = [
+    ('decision', 'Next green', 16, ''),
+    ('crossed', 'Crossed', 8, 'd'),
+    ('waited', 'Waited veh-s', 13, '.1f'),
+    ('queued', 'Queued at end', 14, 'd'),
+]
+
+
+def build_state(vehicles, seed=0, interval_ms=60):
+    """Simulation holding at least `vehicles` vehicles, on the road or waiting to enter"""
+    simulation = HeadlessSimulation(FixedRotationController(), demand=Demand(seed, interval_ms))
+    while len(simulation.pos) + sum(len(queue) for queue in simulation.pending) < vehicles:
+        simulation.step()
+    return simulation
+
+
+def per_call_us(function, repeat):
+    """Median wall time of one call, in microseconds"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times)) * 1e6
+
+
+def continues_identically(simulation, steps=600):
+    """Whether a fork and the original stay in step over the next `steps` steps"""
+    forked = simulation.fork(FixedRotationController())
+    for _ in range(steps):
+        simulation.step()
+        forked.step()
+    return (np.array_equal(simulation.pos, forked.pos) and np.array_equal(simulation.total_wait, forked.total_wait)
+            and simulation.waits.squares == forked.waits.squares
+            and np.array_equal(simulation.waits.histogram, forked.waits.histogram))
+
+
+def measure(vehicles, seed, repeat):
+    simulation = build_state(vehicles, seed)
+    snapshot = simulation.snapshot()
+    scratch = simulation.fork(FixedRotationController())
+    stepper = simulation.fork(FixedRotationController())
+    fork_us = per_call_us(lambda: simulation.fork(FixedRotationController(), snapshot), repeat)
+    step_us = per_call_us(stepper.step, repeat)
+    return {
+        'vehicles': snapshot.vehicles,
+        'on_road': len(simulation.pos),
+        'snapshot_us': per_call_us(simulation.snapshot, repeat),
+        'restore_us': per_call_us(lambda: scratch.restore(snapshot), repeat),
+        'fork_us': fork_us,
+        'deepcopy_us': per_call_us(lambda: copy.deepcopy(simulation), max(1, repeat // 10)),
+        'step_us': step_us,
+        'fork_steps': fork_us / step_us,
+        'identical': 'yes' if continues_identically(simulation) else 'NO',
+    }
+
+
+def advance_to_decision(simulation):
+    """Step until the controller is about to be asked for the next phase"""
+    simulation.step()
+    while not simulation.switch_due(simulation.time_ms):
+        simulation.step()
+
+
+def what_if(simulation, next_green, greens, horizon):
+    """At a decision point, fork once per candidate green time for `next_green` and roll each out"""
+    snapshot = simulation.snapshot()
+    waited_before = simulation.waits.total
+    crossed = int(simulation.crossed_counts.sum())
+    queued_before = simulation.queued_wait()
+    rows = []
+    for green in greens:
+        rollout = simulation.fork(FirstDecision(next_green, green * 1000), snapshot)
+        rollout.run(horizon)
+        waited = rollout.waits.total - waited_before + rollout.queued_wait() - queued_before
+        rows.append({'decision': f"{DIRECTION_NAMES[next_green]} {green:g} s",
+                     'crossed': int(rollout.crossed_counts.sum()) - crossed,
+                     'waited': waited * TICK_MS / 1000,
+                     'queued': int((~rollout.crossed).sum()) + sum(len(queue) for queue in rollout.pending)})
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark snapshot and fork of the headless simulation")
+    parser.add_argument('--vehicles', type=int, nargs='+', default=[100, 1000])
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--what-if', type=int, choices=range(4), metavar='DIRECTION',
+                        help="roll out candidate green times for this direction (0-3) instead")
+    parser.add_argument('--greens', type=float, nargs='+', default=[5, 8, 12], help="candidate green times (s)")
+    parser.add_argument('--horizon', type=float, default=30, help="seconds to roll each candidate out")
+    parser.add_argument('--warmup', type=float, default=120, help="seconds simulated before the what-if")
+    args = parser.parse_args()
+
+    if args.what_if is not None:
+        simulation = HeadlessSimulation(FixedRotationController(), demand=Demand(args.seed))
+        simulation.run(args.warmup)
+        # Let the rotation run up to the decision about the direction asked for
+        advance_to_decision(simulation)
+        while next_in_sequence(simulation.current_green) != args.what_if:
+            advance_to_decision(simulation)
+        rows = what_if(simulation, args.what_if, args.greens, args.horizon)
+        print(f"At {simulation.time_ms / 1000:.1f} s, next green {DIRECTION_NAMES[args.what_if]}, "
+              f"each candidate rolled out {args.horizon:g} s")
+        print(format_table(rows, WHAT_IF_COLUMNS))
+        return
+
+    print(format_table([measure(vehicles, args.seed, args.repeat) for vehicles in args.vehicles], COLUMNS))
+
+
+if __name__ == "__main__":
+    main()
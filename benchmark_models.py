@@ -0,0 +1,147 @@
+# Offline model zoo: cross-validate candidate regressors on recorded controller datasets.
+#
+#   python simulation_knn.py --dataset knn_rows.csv          # record a dataset
+#   python benchmark_models.py knn_rows.csv tree_rows.csv
+#   python benchmark_models.py --generate 4 --save rows.csv  # no recording at hand
+#
+# Every (model, fold) pair is fitted in its own worker process. For each model
+# the table gives the cross-validated error, fit time, single-row latency (the
+# NumPy path the controllers use for KNN and the tree, sklearn for the rest),
+# per-row batch latency and pickled size. Latencies are measured while the
+# other workers run; use --workers 1 for quieter timings.
+import argparse
+import json
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from sklearn.ensemble import HistGradientBoostingRegressor, RandomForestRegressor
+from sklearn.impute import SimpleImputer
+from sklearn.linear_model import LinearRegression, Ridge
+from sklearn.model_selection import KFold
+from sklearn.neighbors import KNeighborsRegressor
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+from sklearn.tree import DecisionTreeRegressor
+from controllers import TrafficDataCollector
+from fast_predict import FastKNNRegressor, FastTreeRegressor
+from benchmark_controllers import format_table
+
+# Model factories, keyed by the name used on the command line
+MODELS = {
+    'knn': lambda: make_pipeline(SimpleImputer(strategy='mean'), KNeighborsRegressor(n_neighbors=3)),
+    'tree': lambda: DecisionTreeRegressor(max_depth=5, random_state=0),
+    'linear': lambda: make_pipeline(SimpleImputer(strategy='mean'), LinearRegression()),
+    'ridge': lambda: make_pipeline(SimpleImputer(strategy='mean'), StandardScaler(), Ridge()),
+    'boosted': lambda: HistGradientBoostingRegressor(max_iter=100, random_state=0),
+    'forest': lambda: RandomForestRegressor(n_estimators=50, max_depth=8, random_state=0),
+}
+
+# Single-row predictors the controllers would actually call
+FAST_EXPORTS = {
+    'knn': lambda model: FastKNNRegressor.from_sklearn(model[-1], model[0]).predict_one,
+    'tree': lambda model: FastTreeRegressor.from_sklearn(model).predict_one,
+}
+
+COLUMNS = [
+    ('model', 'Model', 8, ''),
+    ('mae', 'MAE', 8, '.2f'),
+    ('mae_std', '+/-', 6, '.2f'),
+    ('rmse', 'RMSE', 8, '.2f'),
+    ('fit_ms', 'Fit ms', 8, '.2f'),
+    ('single_us', 'Row us', 8, '.1f'),
+    ('batch_us', 'Batch us', 9, '.2f'),
+    ('size_kb', 'Size KB', 8, '.1f'),
+]
+
+
+def evaluate_fold(name, X_train, y_train, X_test, y_test, single_rows=200):
+    """Fit one model on one fold and time it"""
+    model = MODELS[name]()
+    start = time.perf_counter()
+    model.fit(X_train, y_train)
+    fit_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    predictions = model.predict(X_test)
+    batch_us = (time.perf_counter() - start) / len(X_test) * 1e6
+
+    predict_one = FAST_EXPORTS[name](model) if name in FAST_EXPORTS else (lambda row: model.predict([row])[0])
+    rows = X_test[:single_rows].tolist()
+    start = time.perf_counter()
+    for row in rows:
+        predict_one(row)
+    single_us = (time.perf_counter() - start) / len(rows) * 1e6
+
+    errors = predictions - y_test
+    return {
+        'model': name,
+        'mae': float(np.abs(errors).mean()),
+        'rmse': float(np.sqrt((errors ** 2).mean())),
+        'fit_ms': fit_ms,
+        'single_us': single_us,
+        'batch_us': batch_us,
+        'size_kb': len(pickle.dumps(model)) / 1024,
+    }
+
+
+def cross_validate(X, y, models, folds=5, workers=None, seed=0):
+    """Mean fold results per model, best MAE first"""
+    splits = list(KFold(folds, shuffle=True, random_state=seed).split(X))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(evaluate_fold, name, X[train], y[train], X[test], y[test])
+                   for name in models for train, test in splits]
+        fold_results = [future.result() for future in futures]
+
+    results = []
+    for name in models:
+        runs = [r for r in fold_results if r['model'] == name]
+        result = {key: float(np.mean([r[key] for r in runs])) for key, *_ in COLUMNS[1:] if key != 'mae_std'}
+        result['model'] = name
+        result['mae_std'] = float(np.std([r['mae'] for r in runs]))
+        results.append(result)
+    return sorted(results, key=lambda r: r['mae'])
+
+
+def load_datasets(paths):
+    """Concatenate datasets written by TrafficDataCollector.save_csv()"""
+    parts = [TrafficDataCollector.load_csv(path) for path in paths]
+    return np.vstack([X for X, _ in parts]), np.concatenate([y for _, y in parts])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cross-validate candidate controller models on recorded datasets")
+    parser.add_argument('datasets', nargs='*', help="CSV files written with --dataset / save_csv()")
+    parser.add_argument('--generate', type=float, metavar='HOURS',
+                        help="simulate this many hours headless instead of loading datasets")
+    parser.add_argument('--save', metavar='CSV', help="save the generated dataset")
+    parser.add_argument('--models', nargs='+', choices=list(MODELS), default=list(MODELS))
+    parser.add_argument('--folds', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', metavar='PATH', help="also write the results as JSON")
+    args = parser.parse_args()
+
+    if args.datasets:
+        X, y = load_datasets(args.datasets)
+        source = ', '.join(args.datasets)
+    else:
+        from benchmark_retention import collect_stream
+        hours = args.generate or 2
+        X, y = collect_stream(hours, args.seed)
+        source = f"{hours:g} simulated hours"
+        if args.save:
+            collector = TrafficDataCollector()
+            collector.features, collector.labels = X.tolist(), y.tolist()
+            collector.save_csv(args.save)
+
+    results = cross_validate(X, y, args.models, args.folds, args.workers, args.seed)
+    print(f"{len(X)} rows from {source}, {args.folds}-fold cross-validation")
+    print(format_table(results, COLUMNS))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'rows': len(X), 'source': source, 'folds': args.folds, 'results': results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# Prediction quality against training-set size for the sample-retention policies.
+#
+#   python benchmark_retention.py --hours 6 --sizes 100 250 500 1000
+#
+# A headless run with a rush-hour demand profile produces a long stream of
+# (state, outcome) rows. Each policy is fed the first part of the stream at
+# several capacities, the KNN and tree models are fitted on what it kept, and
+# their error is measured on the rows that follow.
+import argparse
+import random
+import time
+import numpy as np
+from sklearn.neighbors import KNeighborsRegressor
+from sklearn.tree import DecisionTreeRegressor
+from sklearn.impute import SimpleImputer
+from controllers import TrafficDataCollector, FixedRotationController, DIRECTION_NAMES
+from retention import make_retention, RETENTION_POLICIES
+from simulation_headless import HeadlessSimulation, Demand
+from benchmark_controllers import format_table
+
+# Milliseconds between generated vehicles in consecutive profile segments:
+# quiet night, morning peak, midday, evening peak
+RUSH_PROFILE = [2000, 1500, 600, 400, 500, 1000, 1200, 1000, 500, 400, 600, 1500]
+SEGMENT_MINUTES = 15
+
+# Keys of the state dict, in state_features() order
+FEATURE_KEYS = ([f"{name}_count" for name in DIRECTION_NAMES] + [f"{name}_wait" for name in DIRECTION_NAMES]
+                + ['current_light'])
+
+COLUMNS = [
+    ('policy', 'Policy', 10, ''),
+    ('capacity', 'Capacity', 9, 'd'),
+    ('kept', 'Kept', 6, 'd'),
+    ('knn_mae', 'KNN MAE', 9, '.2f'),
+    ('tree_mae', 'Tree MAE', 9, '.2f'),
+    ('fit_ms', 'Fit ms', 8, '.2f'),
+]
+
+
+class RecordingController(FixedRotationController):
+    """Rotation with random green times that logs every cycle's outcome"""
+    name = "Recording"
+
+    def __init__(self, seed=0):
+        super().__init__()
+        self.rng = random.Random(seed)
+        self.data_collector = TrafficDataCollector()
+
+    def record_outcome(self, state, vehicles_cleared, avg_wait_time, density_efficiency):
+        self.data_collector.record_state(
+            [state[f"{name}_count"] for name in DIRECTION_NAMES],
+            [state[f"{name}_wait"] for name in DIRECTION_NAMES],
+            state['current_light'])
+        self.data_collector.record_outcome(vehicles_cleared, avg_wait_time, density_efficiency)
+
+    def decide(self, state):
+        next_green, _ = super().decide(state)
+        return next_green, self.rng.uniform(3000, 10000)
+
+
+def collect_stream(hours, seed=0):
+    """Feature rows and outcomes from a headless run following RUSH_PROFILE"""
+    controller = RecordingController(seed)
+    demand = Demand(seed)
+    simulation = HeadlessSimulation(controller, demand=demand)
+    segments = int(hours * 60 / SEGMENT_MINUTES)
+    for segment in range(segments):
+        demand.interval_ms = RUSH_PROFILE[segment % len(RUSH_PROFILE)]
+        simulation.run(SEGMENT_MINUTES * 60)
+    collector = controller.data_collector
+    return np.array(collector.features, dtype=np.float64), np.array(collector.labels, dtype=np.float64)
+
+
+def retained(policy, X, y):
+    """Replay rows through a retention policy and return the training set it keeps"""
+    collector = TrafficDataCollector(policy)
+    for row, label in zip(X.tolist(), y.tolist()):
+        collector.add_sample(dict(zip(FEATURE_KEYS, row), outcome=label))
+    return np.array(collector.features), np.array(collector.labels)
+
+
+def evaluate(X_train, y_train, X_test, y_test):
+    """Mean absolute error of the KNN and tree models, and their combined fit time"""
+    start = time.perf_counter()
+    imputer = SimpleImputer(strategy='mean')
+    knn = KNeighborsRegressor(n_neighbors=3).fit(imputer.fit_transform(X_train), y_train)
+    tree = DecisionTreeRegressor(max_depth=5, random_state=0).fit(X_train, y_train)
+    fit_ms = (time.perf_counter() - start) * 1000
+    knn_mae = float(np.abs(knn.predict(imputer.transform(X_test)) - y_test).mean())
+    tree_mae = float(np.abs(tree.predict(X_test) - y_test).mean())
+    return knn_mae, tree_mae, fit_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare sample-retention policies by model error and size")
+    parser.add_argument('--hours', type=float, default=6, help="simulated hours of traffic to collect")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 250, 500, 1000])
+    parser.add_argument('--policies', nargs='+', choices=list(RETENTION_POLICIES), default=list(RETENTION_POLICIES))
+    parser.add_argument('--test-fraction', type=float, default=0.2, help="latest share of the stream held out")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    X, y = collect_stream(args.hours, args.seed)
+    split = int(len(X) * (1 - args.test_fraction))
+    print(f"{len(X)} cycles over {args.hours:g} simulated hours, training on the first {split}")
+
+    results = []
+    for name in args.policies:
+        for capacity in ([split] if name == 'all' else args.sizes):
+            X_train, y_train = retained(make_retention(name, capacity, args.seed), X[:split], y[:split])
+            knn_mae, tree_mae, fit_ms = evaluate(X_train, y_train, X[split:], y[split:])
+            results.append({'policy': name, 'capacity': capacity, 'kept': len(X_train),
+                            'knn_mae': knn_mae, 'tree_mae': tree_mae, 'fit_ms': fit_ms})
+    print(format_table(results, COLUMNS))
+
+
+if __name__ == "__main__":
+    main()
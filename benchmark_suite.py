@@ -0,0 +1,346 @@
+# Micro- and macro-benchmarks for the simulation hot paths.
+#
+#   python benchmark_suite.py --json baseline.json
+#   python benchmark_suite.py --compare baseline.json          # flag slowdowns, exit 1 if any
+#   python benchmark_suite.py --only move models --repeat 3
+#
+# move        Vehicle.move() throughput of each pygame variant, and the headless
+#             engine's move_vehicles(), at 10 to 10,000 vehicles
+# update      TrafficLightSystem.update() per call between phase switches
+# models      KNN and decision-tree training and single-row prediction as the
+#             training history grows
+# settime     setTime() of simulation.py with long lane lists
+# end_to_end  simulated seconds per wall second of each variant in turbo mode
+#             without drawing, and of the headless engine per controller
+#
+# Micro-benchmarks report the fastest of --repeat runs. Everything runs with
+# SDL's dummy video driver, so no window opens.
+import argparse
+import ast
+import contextlib
+import importlib
+import io
+import json
+import math
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+from types import SimpleNamespace
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+os.environ.setdefault('MPLBACKEND', 'Agg')
+
+import numpy as np
+from controllers import KNNTrafficController, DecisionTreeTrafficController, FixedRotationController
+from simulation_headless import HeadlessSimulation, TICK_MS, noOfLanes
+import simulation_headless
+from benchmark_controllers import CONTROLLERS, run_controller, format_table
+
+# pygame variants, keyed like benchmark_controllers.CONTROLLERS. Imported only
+# when needed: importing one opens its (dummy) display.
+VARIANTS = {
+    'fixed': 'simulation_Dy2',
+    'knn': 'simulation_knn',
+    'tree': 'simulation_decision',
+    'density_knn': 'simulation_Dy3',
+}
+# simulation_Dy2.py runs on pygame's wall clock, so it has no turbo mode to time end to end
+END_TO_END_VARIANTS = ['knn', 'tree', 'density_knn']
+
+BENCHMARKS = ['move', 'update', 'models', 'settime', 'end_to_end']
+MOVE_SIZES = [10, 100, 1000, 10000]
+UPDATE_SIZES = [100, 1000]
+HISTORY_SIZES = [100, 1000, 5000, 20000]
+LANE_LENGTHS = [100, 1000, 10000]
+
+MOVE_STEPS = 120  # physics steps per timed move run, short enough that no vehicle leaves the road
+MOVES_PER_RUN = 200000  # vehicle moves per timed run; small fleets are timed as several copies
+PREDICT_ROWS = 1000
+
+COLUMNS = [
+    ('benchmark', 'Benchmark', 10, ''),
+    ('case', 'Case', 20, ''),
+    ('value', 'Value', 12, '.4g'),
+    ('unit', 'Unit', 16, ''),
+]
+
+COMPARE_COLUMNS = [
+    ('benchmark', 'Benchmark', 10, ''),
+    ('case', 'Case', 20, ''),
+    ('baseline', 'Baseline', 12, '.4g'),
+    ('value', 'Current', 12, '.4g'),
+    ('unit', 'Unit', 16, ''),
+    ('slowdown', 'Slowdown', 9, '.1%'),
+    ('flag', '', 6, ''),
+]
+
+
+def result(benchmark, case, value, unit, higher_is_better):
+    return {'benchmark': benchmark, 'case': case, 'value': value, 'unit': unit,
+            'higher_is_better': higher_is_better}
+
+
+def best_time(run, setup=lambda: None, repeat=5):
+    """Fastest of `repeat` runs in seconds; setup() builds fresh inputs outside the timing"""
+    best = math.inf
+    for _ in range(repeat):
+        arg = setup()
+        start = time.perf_counter()
+        run(arg)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def load_variant(name):
+    return importlib.import_module(VARIANTS[name])
+
+
+def entry_point(module, direction, rng):
+    """Screen position where a vehicle of the given direction enters a pygame variant"""
+    if direction in (module.NORTH, module.SOUTH):
+        x = rng.randint(module.INTERSECTION_LEFT + 30, module.INTERSECTION_RIGHT - 30)
+        return x, module.HEIGHT + 30 if direction == module.NORTH else -30
+    y = rng.randint(module.INTERSECTION_TOP + 30, module.INTERSECTION_BOTTOM - 30)
+    return -30 if direction == module.EAST else module.WIDTH + 30, y
+
+
+def make_vehicles(module, count, seed=0):
+    """`count` vehicles spread evenly over the four approaches"""
+    random.seed(seed)  # the variants draw vehicle speeds from the random module
+    rng = random.Random(seed)
+    module.intersection_occupancy[:] = [0] * 4
+    return [module.Vehicle(*entry_point(module, i % 4, rng), i % 4) for i in range(count)]
+
+
+def bench_move(repeat):
+    for name in VARIANTS:
+        module = load_variant(name)
+        # North-south green, east-west red: half the fleet drives, half queues
+        states = [module.GREEN, module.RED, module.GREEN, module.RED]
+        yellow = [False] * 4
+        for size in MOVE_SIZES:
+            copies = max(1, MOVES_PER_RUN // (size * MOVE_STEPS))
+
+            def run(fleets):
+                for vehicles in fleets:
+                    for _ in range(MOVE_STEPS):
+                        for vehicle in vehicles:
+                            vehicle.move(states, yellow)
+
+            seconds = best_time(run, lambda: [make_vehicles(module, size) for _ in range(copies)], repeat)
+            yield result('move', f"{name}/{size}", size * MOVE_STEPS * copies / seconds, 'vehicle moves/s', True)
+
+    for size in MOVE_SIZES:
+        copies = max(1, MOVES_PER_RUN // (size * MOVE_STEPS))
+
+        def run(simulations):
+            for simulation in simulations:
+                for _ in range(MOVE_STEPS):
+                    simulation.move_vehicles()
+
+        seconds = best_time(run, lambda: [headless_fleet(size) for _ in range(copies)], repeat)
+        yield result('move', f"headless/{size}", size * MOVE_STEPS * copies / seconds, 'vehicle moves/s', True)
+
+
+def headless_fleet(size):
+    """Headless engine holding `size` vehicles queued back from the entry of every lane"""
+    simulation = HeadlessSimulation(FixedRotationController())
+    lanes = simulation_headless.noOfSignals * noOfLanes
+    simulation.add_vehicles([(i, i % 4, (i // 4) % noOfLanes, (i // lanes) % 5, 0, 0) for i in range(size)])
+    simulation.pos = -(np.arange(size) // lanes) * 50.0
+    simulation.states = [simulation_headless.GREEN, simulation_headless.RED] * 2
+    return simulation
+
+
+def bench_update(repeat):
+    for name in VARIANTS:
+        module = load_variant(name)
+        system = module.TrafficLightSystem()
+        system.update([])  # the first call starts the first phase
+        for size in UPDATE_SIZES:
+            vehicles = make_vehicles(module, size)
+            calls = max(10, 20000 // size)
+
+            def run(_):
+                for _ in range(calls):
+                    system.update(vehicles)
+
+            seconds = best_time(run, repeat=repeat)
+            yield result('update', f"{name}/{size}", seconds / calls * 1e6, 'us per call', False)
+
+
+def synthetic_history(size, seed=0):
+    """Feature rows shaped like state_features() with outcomes loosely tied to them"""
+    rng = np.random.default_rng(seed)
+    counts = rng.poisson(6, (size, 4)).astype(np.float64)
+    waits = rng.exponential(90, (size, 4))
+    light = rng.integers(0, 4, (size, 1)).astype(np.float64)
+    X = np.hstack([counts, waits, light])
+    y = counts.sum(axis=1) * 10 - waits.mean(axis=1) + rng.normal(0, 5, size)
+    return X, y
+
+
+def bench_models(repeat):
+    X_test, _ = synthetic_history(PREDICT_ROWS, seed=1)
+    rows = X_test.tolist()
+    for name, factory in (('knn', KNNTrafficController), ('tree', DecisionTreeTrafficController)):
+        for size in HISTORY_SIZES:
+            X, y = synthetic_history(size)
+            features, labels = X.tolist(), y.tolist()
+            controller = factory(verbose=False)
+            seconds = best_time(lambda _: controller.train(features, labels), repeat=repeat)
+            yield result('models', f"{name}/train/{size}", seconds * 1000, 'ms per fit', False)
+
+            predict_one = controller.fast_model.predict_one
+
+            def run(_):
+                for row in rows:
+                    predict_one(row)
+
+            seconds = best_time(run, repeat=repeat)
+            yield result('models', f"{name}/predict/{size}", seconds / len(rows) * 1e6, 'us per row', False)
+
+
+def load_set_time(path=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'simulation.py')):
+    """setTime() from simulation.py with the module constants it reads
+
+    simulation.py starts its threads and window on import, so the function is
+    compiled from the source instead. Its text-to-speech call and print are
+    replaced with no-ops so only the counting and formula are timed.
+    """
+    with open(path) as f:
+        tree = ast.parse(f.read())
+    namespace = {'math': math, 'os': SimpleNamespace(system=lambda command: 0), 'print': lambda *args: None}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and isinstance(node.value, (ast.Constant, ast.Dict, ast.List, ast.BinOp)):
+            try:
+                exec(compile(ast.Module([node], []), path, 'exec'), namespace)
+            except NameError:
+                pass  # initialised from pygame or other runtime state
+        elif isinstance(node, ast.FunctionDef) and node.name == 'setTime':
+            exec(compile(ast.Module([node], []), path, 'exec'), namespace)
+    namespace['signals'] = [SimpleNamespace(green=namespace['defaultGreen']) for _ in range(namespace['noOfSignals'])]
+    return namespace
+
+
+def bench_settime(repeat):
+    namespace = load_set_time()
+    classes = list(namespace['vehicleTypes'].values())
+    rng = random.Random(0)
+    for length in LANE_LENGTHS:
+        vehicles = {}
+        for direction in namespace['directionNumbers'].values():
+            vehicles[direction] = {'crossed': 0}
+            for lane in range(3):
+                vehicles[direction][lane] = [SimpleNamespace(crossed=int(rng.random() < 0.2),
+                                                             vehicleClass=rng.choice(classes))
+                                             for _ in range(length)]
+        namespace['vehicles'] = vehicles
+        calls = max(10, 100000 // length)
+
+        def run(_):
+            for _ in range(calls):
+                namespace['setTime']()
+
+        seconds = best_time(run, repeat=repeat)
+        yield result('settime', f"{length} per lane", seconds / calls * 1e6, 'us per call', False)
+
+
+def run_variant(name, seconds, seed):
+    """Worker: run a pygame variant's main loop for `seconds` simulated seconds, turbo, without drawing"""
+    module = load_variant(name)
+    sys.argv = [module.__file__, '--turbo', '--render-hz', '0', '--duration', str(seconds), '--seed', str(seed)]
+    with tempfile.TemporaryDirectory() as workdir, open(os.devnull, 'w') as devnull:
+        os.chdir(workdir)  # the efficiency CSVs written on exit land here
+        with contextlib.redirect_stdout(devnull):
+            start = time.perf_counter()
+            module.main()
+            wall = time.perf_counter() - start
+    return module.sim_clock.now() / 1000 / wall
+
+
+def bench_end_to_end(seconds, seed):
+    # One fresh process per variant: each main() owns pygame and its module globals
+    for name in END_TO_END_VARIANTS:
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+            speed = pool.submit(run_variant, name, seconds, seed).result()
+        yield result('end_to_end', name, speed, 'sim s per wall s', True)
+
+    for name, factory in CONTROLLERS.items():
+        with contextlib.redirect_stdout(io.StringIO()):
+            summary = run_controller(factory(), seconds, seed)
+        speed = summary['steps_per_second'] * TICK_MS / 1000
+        yield result('end_to_end', f"headless/{name}", speed, 'sim s per wall s', True)
+
+
+def compare(results, baseline, tolerance):
+    """Pair results with the baseline and mark those slower by more than `tolerance`"""
+    previous = {(r['benchmark'], r['case']): r for r in baseline['results']}
+    rows = []
+    for current in results:
+        old = previous.get((current['benchmark'], current['case']))
+        if old is None:
+            continue
+        if current['higher_is_better']:
+            slowdown = old['value'] / current['value'] - 1
+        else:
+            slowdown = current['value'] / old['value'] - 1
+        rows.append(dict(current, baseline=old['value'], slowdown=slowdown,
+                         flag='SLOWER' if slowdown > tolerance else ''))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the simulation hot paths")
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS, default=BENCHMARKS)
+    parser.add_argument('--repeat', type=int, default=5, help="timed runs per micro-benchmark (the fastest counts)")
+    parser.add_argument('--seconds', type=float, default=120, help="simulated seconds per end-to-end run")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', metavar='PATH', help="write the results to this file")
+    parser.add_argument('--compare', metavar='BASELINE', help="results file from an earlier --json run")
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help="slowdown against the baseline that is flagged (0.15 = 15%%)")
+    args = parser.parse_args()
+
+    runners = {
+        'move': lambda: bench_move(args.repeat),
+        'update': lambda: bench_update(args.repeat),
+        'models': lambda: bench_models(args.repeat),
+        'settime': lambda: bench_settime(args.repeat),
+        'end_to_end': lambda: bench_end_to_end(args.seconds, args.seed),
+    }
+    results = []
+    for name in args.only:
+        print(f"running {name}...")
+        results.extend(runners[name]())
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'created': datetime.now().isoformat(timespec='seconds'),
+                       'python': platform.python_version(), 'machine': platform.machine(),
+                       'processor': platform.processor(), 'results': results}, f, indent=2)
+
+    if not args.compare:
+        print()
+        print(format_table(results, COLUMNS))
+        return
+    with open(args.compare) as f:
+        rows = compare(results, json.load(f), args.tolerance)
+    print()
+    print(format_table(rows, COMPARE_COLUMNS))
+    slower = [row for row in rows if row['flag']]
+    if slower:
+        print(f"{len(slower)} of {len(rows)} benchmarks slower than the baseline by more than {args.tolerance:.0%}")
+        sys.exit(1)
+    print(f"no slowdowns beyond {args.tolerance:.0%} in {len(rows)} benchmarks")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+# Signal controller as a separate service, with a bridge for the headless engine.
+#
+#   python controller_service.py serve --controller knn                  # listens on 127.0.0.1:9871
+#   python controller_service.py bridge --intersections 16 --seconds 300 # 16 junctions against it
+#   python controller_service.py bridge --intersections 4 --compare-local
+#
+# The service owns the controllers, one per intersection of each connected
+# simulator, and the simulator only sends state snapshots and applies the phase
+# commands it gets back, like a cabinet controller and its detector rack. Being
+# its own process, a slow model never holds up a simulator's drawing, and one
+# service can drive many junctions.
+#
+# Messages are length-prefixed little-endian structs (see event_log.py for the
+# same approach on disk). On connecting, the service sends a hello with its
+# controller's name and whether it wants a snapshot every step. A request then
+# batches the snapshots of every intersection for one simulation step: the
+# signal state, queue counts, mean waits, class counts and, on a phase switch,
+# the outcome of the cycle that just ended. A reply carries one decision for
+# each snapshot marked DECIDE plus the service time, and batches without one
+# get no reply. The bridge measures the round trip of every batch it waits on
+# and the service the time from a batch's arrival to its reply, so the
+# difference is the time spent on the socket and in the queue.
+import argparse
+import asyncio
+import socket
+import struct
+import time
+from collections import deque
+import numpy as np
+from simulation_headless import HeadlessSimulation, Demand, TICK_MS, vehicleTypes, noOfSignals
+
+DEFAULT_PORT = 9871
+PROTOCOL_VERSION = 1
+
+LENGTH = struct.Struct('<I')
+HELLO = struct.Struct('<BB?24s')  # version, reserved, observe every step, controller name
+REQUEST = struct.Struct('<IH')  # batch sequence, snapshots
+# intersection, flags, current light (-1 none), time ms, counts, waits, class counts, cleared, mean wait, density eff.
+SNAPSHOT = struct.Struct(f'<HBbd{noOfSignals}H{noOfSignals}d{noOfSignals * len(vehicleTypes)}HHdd')
+REPLY = struct.Struct('<IHI')  # batch sequence, decisions, service time in microseconds
+DECISION = struct.Struct('<Hbd')  # intersection, next green, green duration ms
+
+# Snapshot flags
+DECIDE = 1
+OUTCOME = 2
+
+
+def pack_snapshot(intersection, state, outcome=None, decide=False):
+    """Encode an observe() state, and the cycle outcome at a switch, as one SNAPSHOT record"""
+    flags = (DECIDE if decide else 0) | (OUTCOME if outcome is not None else 0)
+    cleared, avg_wait, efficiency = outcome if outcome is not None else (0, 0.0, 0.0)
+    current = state['current_light']
+    class_counts = [state['class_counts'][d][vehicleTypes[c]] for d in range(noOfSignals) for c in vehicleTypes]
+    return SNAPSHOT.pack(intersection, flags, -1 if current is None else current, state['time'], *state['density'],
+                         state['north_wait'], state['east_wait'], state['south_wait'], state['west_wait'],
+                         *class_counts, cleared, avg_wait, efficiency)
+
+
+def unpack_snapshot(buffer, offset=0):
+    """Inverse of pack_snapshot(): (intersection, flags, state, outcome or None)"""
+    values = SNAPSHOT.unpack_from(buffer, offset)
+    intersection, flags, current, time_ms = values[:4]
+    counts = list(values[4:4 + noOfSignals])
+    waits = values[4 + noOfSignals:4 + 2 * noOfSignals]
+    classes = values[4 + 2 * noOfSignals:-3]
+    state = {
+        'north_count': counts[0],
+        'east_count': counts[1],
+        'south_count': counts[2],
+        'west_count': counts[3],
+        'north_wait': waits[0],
+        'east_wait': waits[1],
+        'south_wait': waits[2],
+        'west_wait': waits[3],
+        'current_light': None if current < 0 else current,
+        'density': counts,
+        'class_counts': [{vehicleTypes[c]: classes[d * len(vehicleTypes) + c] for c in vehicleTypes}
+                         for d in range(noOfSignals)],
+        'time': time_ms,
+    }
+    return intersection, flags, state, values[-3:] if flags & OUTCOME else None
+
+
+def percentiles_ms(seconds):
+    """p50 and p95 of a list of durations in seconds, in ms"""
+    if not len(seconds):
+        return 0.0, 0.0
+    values = np.asarray(seconds, dtype=np.float64) * 1000
+    return float(np.percentile(values, 50)), float(np.percentile(values, 95))
+
+
+class ControllerService:
+    def __init__(self, factory, host='127.0.0.1', port=DEFAULT_PORT):
+        self.factory = factory  # builds one controller per intersection
+        self.host = host
+        self.port = port
+        probe = factory()
+        self.name = probe.name
+        self.observe_every_step = probe.observe_every_step
+
+    async def serve(self):
+        server = await asyncio.start_server(self.handle, self.host, self.port)
+        print(f"{self.name} controller service on {self.host}:{self.port}")
+        async with server:
+            await server.serve_forever()
+
+    def process(self, controllers, payload):
+        """Apply one request batch and return its decisions as packed DECISION records"""
+        _, count = REQUEST.unpack_from(payload)
+        decisions = []
+        for i in range(count):
+            intersection, flags, state, outcome = unpack_snapshot(payload, REQUEST.size + i * SNAPSHOT.size)
+            controller = controllers.get(intersection)
+            if controller is None:
+                controller = controllers[intersection] = self.factory()
+            if controller.observe_every_step:
+                controller.observe(state)
+            if outcome is not None:
+                controller.record_outcome(state, *outcome)
+            if flags & DECIDE:
+                next_green, green_duration = controller.decide(state)
+                decisions.append(DECISION.pack(intersection, int(next_green), green_duration))
+        return decisions
+
+    async def handle(self, reader, writer):
+        writer.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        peer = writer.get_extra_info('peername')
+        writer.write(HELLO.pack(PROTOCOL_VERSION, 0, self.observe_every_step, self.name.encode()[:24]))
+        controllers = {}
+        service_times = deque(maxlen=100000)
+        batches = 0
+        try:
+            while True:
+                length, = LENGTH.unpack(await reader.readexactly(LENGTH.size))
+                payload = await reader.readexactly(length)
+                start = time.perf_counter()
+                decisions = self.process(controllers, payload)
+                batches += 1
+                if decisions:
+                    sequence, _ = REQUEST.unpack_from(payload)
+                    elapsed = time.perf_counter() - start
+                    service_times.append(elapsed)
+                    body = REPLY.pack(sequence, len(decisions), int(elapsed * 1e6)) + b''.join(decisions)
+                    writer.write(LENGTH.pack(len(body)) + body)
+                    await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+        p50, p95 = percentiles_ms(service_times)
+        print(f"{peer}: {batches} batches for {len(controllers)} intersections, "
+              f"{len(service_times)} answered in p50 {p50:.3f} ms, p95 {p95:.3f} ms")
+
+
+class ControllerClient:
+    """Blocking connection from a simulator to a ControllerService"""
+
+    def __init__(self, host='127.0.0.1', port=DEFAULT_PORT):
+        self.sock = socket.create_connection((host, port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        version, _, self.observe_every_step, name = HELLO.unpack(self.recv_exactly(HELLO.size))
+        if version != PROTOCOL_VERSION:
+            raise ValueError(f"controller service speaks protocol {version}, not {PROTOCOL_VERSION}")
+        self.name = name.rstrip(b'\0').decode()
+        self.sequence = 0
+        self.bytes_sent = 0
+        self.round_trips = []  # seconds per batch that was answered
+        self.service_times = []  # seconds the service reported for those batches
+
+    def recv_exactly(self, size):
+        data = bytearray()
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("controller service closed the connection")
+            data += chunk
+        return bytes(data)
+
+    def request(self, snapshots, expect_reply):
+        """Send packed snapshots as one batch; returns {intersection: (next_green, green_ms)} when expect_reply"""
+        self.sequence += 1
+        payload = REQUEST.pack(self.sequence, len(snapshots)) + b''.join(snapshots)
+        start = time.perf_counter()
+        self.sock.sendall(LENGTH.pack(len(payload)) + payload)
+        self.bytes_sent += LENGTH.size + len(payload)
+        if not expect_reply:
+            return {}
+        length, = LENGTH.unpack(self.recv_exactly(LENGTH.size))
+        body = self.recv_exactly(length)
+        self.round_trips.append(time.perf_counter() - start)
+        sequence, count, service_us = REPLY.unpack_from(body)
+        if sequence != self.sequence:
+            raise ValueError(f"reply to batch {sequence} while waiting for {self.sequence}")
+        self.service_times.append(service_us / 1e6)
+        decisions = {}
+        for i in range(count):
+            intersection, next_green, green_duration = DECISION.unpack_from(body, REPLY.size + i * DECISION.size)
+            decisions[intersection] = (next_green, green_duration)
+        return decisions
+
+    def close(self):
+        self.sock.close()
+
+
+def bridge_step(client, simulations):
+    """Advance every simulation one step, asking the service for all due phase switches in one batch"""
+    snapshots = []
+    due = []
+    for i, simulation in enumerate(simulations):
+        simulation.spawn_vehicles()
+        switch = simulation.switch_due(simulation.time_ms)
+        if switch or client.observe_every_step:
+            state = simulation.observe()
+            snapshots.append(pack_snapshot(i, state, simulation.cycle_outcome(state) if switch else None, switch))
+            if switch:
+                due.append(i)
+    if snapshots:
+        decisions = client.request(snapshots, expect_reply=bool(due))
+        for i in due:
+            simulations[i].apply_decision(simulations[i].time_ms, *decisions[i], client.round_trips[-1])
+    for simulation in simulations:
+        simulation.update_signals()
+        simulation.move_vehicles()
+        simulation.tick += 1
+
+
+def run_bridge(client, intersections, seconds, seed=0, interval_ms=750):
+    """Run `intersections` headless junctions, seeds seed, seed+1, ..., on the service's decisions"""
+    simulations = [HeadlessSimulation(None, demand=Demand(seed + i, interval_ms)) for i in range(intersections)]
+    steps = int(round(seconds * 1000 / TICK_MS))
+    start = time.perf_counter()
+    for _ in range(steps):
+        bridge_step(client, simulations)
+    wall = time.perf_counter() - start
+    for simulation in simulations:
+        simulation.wall_time = wall
+    return [simulation.summary() for simulation in simulations]
+
+
+def main():
+    from benchmark_controllers import CONTROLLERS, run_controller
+    parser = argparse.ArgumentParser(description="Run a signal controller as a service, or drive junctions from one")
+    commands = parser.add_subparsers(dest='command', required=True)
+    server = commands.add_parser('serve', help="answer phase requests from simulators")
+    server.add_argument('--controller', choices=list(CONTROLLERS), default='knn')
+    server.add_argument('--host', default='127.0.0.1')
+    server.add_argument('--port', type=int, default=DEFAULT_PORT)
+    bridge = commands.add_parser('bridge', help="run headless junctions on a service's decisions")
+    bridge.add_argument('--host', default='127.0.0.1')
+    bridge.add_argument('--port', type=int, default=DEFAULT_PORT)
+    bridge.add_argument('--intersections', type=int, default=4)
+    bridge.add_argument('--seconds', type=float, default=300, help="simulated seconds")
+    bridge.add_argument('--seed', type=int, default=0, help="demand seed of the first junction")
+    bridge.add_argument('--interval', type=float, default=750, help="milliseconds between generated vehicles")
+    bridge.add_argument('--compare-local', metavar='CONTROLLER', nargs='?', const='', default=None,
+                        help="also run the junctions with an in-process controller (default: the service's) "
+                             "and check the results match")
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        try:
+            asyncio.run(ControllerService(CONTROLLERS[args.controller], args.host, args.port).serve())
+        except KeyboardInterrupt:
+            pass
+        return
+
+    client = ControllerClient(args.host, args.port)
+    try:
+        results = run_bridge(client, args.intersections, args.seconds, args.seed, args.interval)
+    finally:
+        client.close()
+    steps_per_second = results[0]['steps_per_second']
+    wall = results[0]['sim_seconds'] * 1000 / TICK_MS / steps_per_second if steps_per_second else 0.0
+    rtt_p50, rtt_p95 = percentiles_ms(client.round_trips)
+    service_p50, service_p95 = percentiles_ms(client.service_times)
+    overhead = np.array(client.round_trips) - np.array(client.service_times)
+    overhead_p50, overhead_p95 = percentiles_ms(overhead)
+    print(f"{args.intersections} intersections on the {client.name} service: {args.seconds:.0f} simulated s "
+          f"in {wall:.1f} s, {sum(r['crossed'] for r in results)} vehicles crossed, "
+          f"{sum(r['cycles'] for r in results)} phases")
+    print(f"  {client.sequence} batches, {client.bytes_sent / 1024:.0f} KB sent, {SNAPSHOT.size} bytes per snapshot")
+    print(f"  round trip p50 {rtt_p50:.3f} ms, p95 {rtt_p95:.3f} ms; service p50 {service_p50:.3f} ms, "
+          f"p95 {service_p95:.3f} ms; socket and queue p50 {overhead_p50:.3f} ms, p95 {overhead_p95:.3f} ms")
+
+    if args.compare_local is not None:
+        name = args.compare_local or next(key for key, factory in CONTROLLERS.items()
+                                          if factory().name == client.name)
+        mismatches = 0
+        for i, remote in enumerate(results):
+            local = run_controller(CONTROLLERS[name](), args.seconds, args.seed + i, args.interval)
+            same = (local['lane_crossed'] == remote['lane_crossed'] and local['cycles'] == remote['cycles']
+                    and abs(local['mean_wait'] - remote['mean_wait']) < 1e-9)
+            mismatches += not same
+            print(f"  junction {i}: remote {remote['crossed']} crossed, {remote['cycles']} phases, "
+                  f"mean wait {remote['mean_wait']:.2f} s; local {local['crossed']}, {local['cycles']}, "
+                  f"{local['mean_wait']:.2f} s{'' if same else '  MISMATCH'}")
+        print(f"  {'all junctions match' if not mismatches else f'{mismatches} junctions differ'} "
+              f"the in-process {name} controller")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,483 @@
+# Signal controllers shared by the pygame variants and the headless harness.
+#
+# Every controller implements the same small protocol (SignalController): it is
+# shown the traffic state at each phase switch and answers with the next green
+# direction and its duration in milliseconds. The learning controllers also get
+# feedback about the cycle that just ended through record_outcome().
+import csv
+import math
+from collections import deque, OrderedDict
+import numpy as np
+from sklearn.neighbors import KNeighborsRegressor, KNeighborsClassifier
+from sklearn.tree import DecisionTreeRegressor
+from sklearn.impute import SimpleImputer
+from fast_predict import FastKNNRegressor, FastTreeRegressor
+from retention import KeepAll, DROP
+from retraining import RetrainScheduler
+
+# Directions
+NORTH = 0
+EAST = 1
+SOUTH = 2
+WEST = 3
+DIRECTION_NAMES = ['north', 'east', 'south', 'west']
+
+# Average times for vehicles to pass the intersection (seconds, from simulation.py)
+VEHICLE_CROSS_TIMES = {'car': 2, 'bike': 1, 'rickshaw': 2.25, 'bus': 2.5, 'truck': 2.5}
+
+
+# Columns of state_features()
+FEATURE_NAMES = [f"{name}_count" for name in DIRECTION_NAMES] + [f"{name}_wait" for name in DIRECTION_NAMES] + [
+    'current_light']
+
+
+def state_features(state):
+    """Return the 9-value feature row the learning controllers train on"""
+    return [
+        state['north_count'],
+        state['east_count'],
+        state['south_count'],
+        state['west_count'],
+        state['north_wait'],
+        state['east_wait'],
+        state['south_wait'],
+        state['west_wait'],
+        state['current_light']
+    ]
+
+
+def next_in_sequence(current_green):
+    """Fixed NORTH -> EAST -> SOUTH -> WEST rotation"""
+    return NORTH if current_green is None else (current_green + 1) % 4
+
+
+def density_efficiency(vehicle_counts, current_green):
+    """Calculate efficiency based on how well we're serving the highest density direction"""
+    if current_green is None:
+        return 0
+
+    max_direction = max([NORTH, EAST, SOUTH, WEST], key=lambda d: vehicle_counts[d])
+    max_count = vehicle_counts[max_direction]
+    current_count = vehicle_counts[current_green]
+
+    if max_count == 0:
+        return 0
+
+    if current_green == max_direction:
+        return 100 * (current_count / max_count)
+    return -50 * (1 - (current_count / max_count))
+
+
+class SignalController:
+    """Base class: observe the traffic state, answer with (next_green, green_duration_ms)"""
+    name = "Controller"
+    # Set to True to have observe() called on every simulation step, not just at switches
+    observe_every_step = False
+
+    def observe(self, state):
+        """Per-step hook for controllers that sample traffic continuously"""
+
+    def record_outcome(self, state, vehicles_cleared, avg_wait_time, density_efficiency):
+        """Feedback about the cycle that just ended; state is the snapshot taken at its end"""
+
+    def prepare(self, state):
+        """Called when the green turns yellow, so a slow controller can start on its next decision early"""
+
+    def decide(self, state):
+        """Return the next green direction and its duration in milliseconds"""
+        raise NotImplementedError
+
+
+class TrafficDataCollector:
+    def __init__(self, retention=None):
+        self.history = []
+        self.current_state = {}
+        self.features = []
+        self.labels = []
+        self.retention = retention if retention is not None else KeepAll()  # see retention.py
+        self.samples_seen = 0
+
+    def record_state(self, vehicle_counts, wait_times, current_light):
+        self.current_state = {
+            'north_count': vehicle_counts[NORTH],
+            'east_count': vehicle_counts[EAST],
+            'south_count': vehicle_counts[SOUTH],
+            'west_count': vehicle_counts[WEST],
+            'north_wait': wait_times[NORTH],
+            'east_wait': wait_times[EAST],
+            'south_wait': wait_times[SOUTH],
+            'west_wait': wait_times[WEST],
+            'current_light': current_light
+        }
+
+    def record_outcome(self, vehicles_cleared, avg_wait_time, density_efficiency):
+        self.current_state['outcome'] = vehicles_cleared * 10 - avg_wait_time + density_efficiency
+        self.add_sample(self.current_state)
+
+    def add_sample(self, state):
+        """Store a state carrying its 'outcome', subject to the retention policy"""
+        self.samples_seen += 1
+        row = state_features(state)
+        slot = self.retention.place(row, len(self.features))
+        if slot is None:
+            self.history.append(state)
+            self.features.append(row)
+            self.labels.append(state['outcome'])
+        elif slot != DROP:
+            self.history[slot] = state
+            self.features[slot] = row
+            self.labels[slot] = state['outcome']
+
+    def save_csv(self, path):
+        """Write the training rows (FEATURE_NAMES plus outcome) for offline benchmarks"""
+        with open(path, 'w', newline='') as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(FEATURE_NAMES + ['outcome'])
+            for row, label in zip(self.features, self.labels):
+                writer.writerow(list(row) + [label])
+
+    @staticmethod
+    def load_csv(path):
+        """Read a file written by save_csv() as (features, labels) arrays"""
+        data = np.genfromtxt(path, delimiter=',', skip_header=1, ndmin=2)
+        return data[:, :len(FEATURE_NAMES)], data[:, len(FEATURE_NAMES)]
+
+
+class FixedRotationController(SignalController):
+    """Fixed-time rotation, as in simulation_Dy2.py"""
+    name = "Fixed rotation"
+
+    def __init__(self, green_duration=5000):
+        self.green_duration = green_duration
+
+    def decide(self, state):
+        return next_in_sequence(state['current_light']), self.green_duration
+
+
+class FirstDecision(FixedRotationController):
+    """Plays one given decision, then rotates with a fixed green"""
+    name = "First decision"
+
+    def __init__(self, next_green, green_duration, then_duration=5000):
+        super().__init__(then_duration)
+        self.first = (next_green, green_duration)
+
+    def decide(self, state):
+        if self.first is not None:
+            decision, self.first = self.first, None
+            return decision
+        return super().decide(state)
+
+
+class TimingPlanController(SignalController):
+    """Fixed-time rotation with its own green time per direction"""
+    name = "Timing plan"
+
+    def __init__(self, green_durations=(5000, 5000, 5000, 5000)):
+        self.green_durations = list(green_durations)
+
+    def decide(self, state):
+        next_green = next_in_sequence(state['current_light'])
+        return next_green, self.green_durations[next_green]
+
+
+class PredictionCache:
+    """Bounded LRU cache of model predictions keyed on a quantised feature row
+
+    Counts and the current light are small integers already; the mean waits
+    are rounded to multiples of wait_quantum frames for the key only, and the
+    model is always evaluated on the exact row. With the default quantum of 0
+    keys are exact, so a cached value is what a fresh prediction would return
+    until the model is retrained. A positive quantum lets rows whose waits
+    round alike share a prediction, an approximation to opt into.
+
+    Even with retraining only on drift or new data (retraining.py), a single
+    junction asks about each state once: over a simulated hour of the default
+    headless demand the KNN and tree controllers made about 700 lookups with
+    no hits, with or without a quantum of 1 frame, and 17 to 18 retrains.
+    The cache only pays for callers that predict the same rows repeatedly.
+    """
+
+    def __init__(self, max_size=1024, wait_quantum=0.0):
+        self.entries = OrderedDict()
+        self.max_size = max_size  # 0 disables caching
+        self.wait_quantum = wait_quantum
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def key(self, features):
+        """Cache key of a feature row, None while caching is off"""
+        if not self.max_size:
+            return None
+        if not self.wait_quantum:
+            return tuple(features)
+        waits = tuple(round(w / self.wait_quantum) * self.wait_quantum for w in features[4:8])
+        return tuple(features[:4]) + waits + tuple(features[8:])
+
+    def get(self, key):
+        if key is None:
+            return None
+        prediction = self.entries.get(key)
+        if prediction is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return prediction
+
+    def put(self, key, prediction):
+        if key is None:
+            return
+        self.entries[key] = prediction
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self):
+        """Drop every entry; called whenever the model is retrained"""
+        self.entries.clear()
+        self.invalidations += 1
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hit_rate,
+                'size': len(self.entries), 'evictions': self.evictions, 'invalidations': self.invalidations}
+
+
+class LearningController(SignalController):
+    """Rotation with a regression model choosing each green duration"""
+    model_name = "Model"
+
+    def __init__(self, min_samples=10, min_duration=3000, max_duration=10000, verbose=True,
+                 cache_size=1024, wait_quantum=0.0, retention=None, retrain_scheduler=None):
+        self.is_trained = False
+        self.fast_model = None
+        self.min_samples = min_samples  # train once more samples than this have been collected
+        self.min_duration = min_duration
+        self.max_duration = max_duration
+        self.verbose = verbose
+        self.data_collector = TrafficDataCollector(retention)
+        self.prediction_cache = PredictionCache(cache_size, wait_quantum)
+        if retrain_scheduler is None:
+            retrain_scheduler = RetrainScheduler(feature_names=FEATURE_NAMES, verbose=verbose)
+        self.retrain_scheduler = retrain_scheduler  # see retraining.py
+
+    def train(self, features, labels):
+        raise NotImplementedError
+
+    def default_duration(self, current_state):
+        """Duration used until the model is trained, based on the highest density"""
+        max_direction = max([NORTH, EAST, SOUTH, WEST],
+                            key=lambda d: current_state[f"{DIRECTION_NAMES[d]}_count"])
+        base_duration = 5000
+        density_factor = current_state[f"{DIRECTION_NAMES[max_direction]}_count"] * 100
+        return min(self.max_duration, max(self.min_duration, base_duration + density_factor))
+
+    def duration_from_prediction(self, prediction):
+        return max(self.min_duration, min(self.max_duration, 5000 + prediction * 100))
+
+    def predict_best_duration(self, current_state):
+        if not self.is_trained:
+            return self.default_duration(current_state)
+
+        features = state_features(current_state)
+        key = self.prediction_cache.key(features)
+        prediction = self.prediction_cache.get(key)
+        if prediction is None:
+            prediction = self.fast_model.predict_one(features)
+            self.prediction_cache.put(key, prediction)
+        return self.duration_from_prediction(prediction)
+
+    def predict_durations(self, states):
+        """Green durations for many states in one model call, e.g. every candidate phase or junction"""
+        if not self.is_trained:
+            return [self.default_duration(state) for state in states]
+        X = np.array([state_features(state) for state in states], dtype=np.float64)
+        return [self.duration_from_prediction(p) for p in self.fast_model.predict_batch(X).tolist()]
+
+    def record_outcome(self, state, vehicles_cleared, avg_wait_time, density_efficiency):
+        self.data_collector.record_state(
+            [state[f"{name}_count"] for name in DIRECTION_NAMES],
+            [state[f"{name}_wait"] for name in DIRECTION_NAMES],
+            state['current_light'])
+        self.data_collector.record_outcome(vehicles_cleared, avg_wait_time, density_efficiency)
+        self.maybe_retrain(self.data_collector)
+
+    def maybe_retrain(self, collector):
+        """Show the scheduler the cycle the collector just recorded and retrain if it asks to"""
+        row = state_features(collector.current_state)
+        prediction = self.fast_model.predict_one(row) if self.is_trained else None
+        self.retrain_scheduler.observe(row, collector.current_state['outcome'], prediction)
+        reason = self.retrain_scheduler.reason()
+        if reason is None:
+            return False
+        self.train(collector.features, collector.labels)
+        if self.is_trained:
+            self.retrain_scheduler.retrained(collector.features, collector.labels, reason)
+        return self.is_trained
+
+    def decide(self, state):
+        next_green = next_in_sequence(state['current_light'])
+        return next_green, self.predict_best_duration(dict(state, current_light=next_green))
+
+
+class KNNTrafficController(LearningController):
+    name = "KNN regression"
+    model_name = "KNN"
+
+    def __init__(self, n_neighbors=3, min_samples=10, min_duration=3000, max_duration=10000, verbose=True,
+                 cache_size=1024, wait_quantum=0.0, retention=None, retrain_scheduler=None):
+        super().__init__(min_samples, min_duration, max_duration, verbose, cache_size, wait_quantum, retention,
+                         retrain_scheduler)
+        self.model = KNeighborsRegressor(n_neighbors=n_neighbors)
+        self.imputer = SimpleImputer(strategy='mean')
+
+    def train(self, features, labels):
+        if len(features) > self.min_samples and len(features) >= self.model.n_neighbors:
+            X = np.array(features)
+            y = np.array(labels)
+            X = self.imputer.fit_transform(X)
+            self.model.fit(X, y)
+            self.fast_model = FastKNNRegressor.from_sklearn(self.model, self.imputer)
+            self.prediction_cache.invalidate()
+            self.is_trained = True
+            if self.verbose:
+                print("KNN model trained with", len(features), "samples")
+
+
+class DecisionTreeTrafficController(LearningController):
+    name = "Decision tree"
+    model_name = "Decision Tree"
+
+    def __init__(self, max_depth=5, min_samples=10, min_duration=3000, max_duration=10000, verbose=True,
+                 cache_size=1024, wait_quantum=0.0, retention=None, retrain_scheduler=None):
+        super().__init__(min_samples, min_duration, max_duration, verbose, cache_size, wait_quantum, retention,
+                         retrain_scheduler)
+        self.model = DecisionTreeRegressor(max_depth=max_depth, random_state=0)
+
+    def train(self, features, labels):
+        if len(features) > self.min_samples:  # Only train once we have enough data
+            X = np.array(features)
+            y = np.array(labels)
+            self.model.fit(X, y)
+            self.fast_model = FastTreeRegressor.from_sklearn(self.model)
+            self.prediction_cache.invalidate()
+            self.is_trained = True
+            if self.verbose:
+                print("Decision Tree model trained with", len(features), "samples")
+
+
+class DensityKNN:
+    """KNN direction classifier over a bounded window of density samples
+
+    Samples go into a ring buffer. The classifier is only refitted once a
+    refit_fraction of the window differs from what it was last fitted on, and
+    until then predictions are memoised by density tuple.
+    """
+
+    def __init__(self, n_neighbors=3, capacity=100, refit_fraction=0.1):
+        self.knn = KNeighborsClassifier(n_neighbors=n_neighbors)
+        self.samples = deque(maxlen=capacity)
+        self.refit_fraction = refit_fraction
+        self.changed = 0  # samples differing from the ones they replaced since the last fit
+        self.fitted = False
+        self.proba_cache = {}
+        self.fits = 0
+        self.cache_hits = 0
+
+    def __len__(self):
+        return len(self.samples)
+
+    def add(self, density, label):
+        sample = (tuple(density), label)
+        if len(self.samples) < self.samples.maxlen or self.samples[0] != sample:
+            self.changed += 1
+        self.samples.append(sample)
+
+    def refit_if_stale(self):
+        if self.fitted and self.changed < self.refit_fraction * len(self.samples):
+            return False
+        densities, labels = zip(*self.samples)
+        self.knn.fit(densities, labels)
+        self.fitted = True
+        self.changed = 0
+        self.proba_cache.clear()
+        self.fits += 1
+        return True
+
+    def class_probabilities(self, density):
+        """Return {direction: probability} for a density vector"""
+        self.refit_if_stale()
+        key = tuple(density)
+        proba = self.proba_cache.get(key)
+        if proba is None:
+            proba = dict(zip(self.knn.classes_.tolist(), self.knn.predict_proba([key])[0]))
+            self.proba_cache[key] = proba
+        else:
+            self.cache_hits += 1
+        return proba
+
+
+class DensityKNNController(SignalController):
+    """KNN classifier over per-direction density, as in simulation_Dy3.py"""
+    name = "Density KNN"
+    observe_every_step = True
+
+    def __init__(self, min_green_time=3000, min_data=30, capacity=100, refit_fraction=0.1, verbose=True):
+        self.min_green_time = min_green_time
+        self.knn = DensityKNN(capacity=capacity, refit_fraction=refit_fraction)
+        self.min_data = min_data  # Minimum data points before using KNN
+        self.using_knn = False
+        self.verbose = verbose
+
+    def observe(self, state):
+        if state['current_light'] is not None:
+            self.knn.add(state['density'], state['current_light'])
+
+    def decide(self, state):
+        current_green = state['current_light']
+        density = state['density']
+        if len(self.knn) >= self.min_data and not self.using_knn:
+            self.using_knn = True
+
+        next_green = next_in_sequence(current_green)
+        if self.using_knn:
+            try:
+                class_proba = self.knn.class_probabilities(density)
+                scores = []
+                for d in range(4):
+                    if d == current_green:
+                        # Reduce score for current direction to encourage switching
+                        scores.append(density[d] * (class_proba.get(d, 0) * 0.7))
+                    else:
+                        scores.append(density[d] * (class_proba.get(d, 0) + 0.1))
+                next_green = int(np.argmax(scores))
+            except Exception as e:
+                if self.verbose:
+                    print(f"KNN Error: {e}")
+        return next_green, self.min_green_time
+
+
+class FormulaController(SignalController):
+    """Green time from vehicle counts per class, as in setTime() of simulation.py"""
+    name = "setTime formula"
+
+    def __init__(self, no_of_lanes=2, minimum=10, maximum=60):
+        self.no_of_lanes = no_of_lanes
+        self.minimum = minimum
+        self.maximum = maximum
+
+    def decide(self, state):
+        next_green = next_in_sequence(state['current_light'])
+        class_counts = state['class_counts'][next_green]
+        green_time = math.ceil(sum(class_counts.get(vclass, 0) * cross_time
+                                   for vclass, cross_time in VEHICLE_CROSS_TIMES.items())
+                               / (self.no_of_lanes + 1))
+        green_time = min(self.maximum, max(self.minimum, green_time))
+        return next_green, green_time * 1000
@@ -0,0 +1,191 @@
+# Compact binary event log for recording and replaying simulation runs.
+#
+# A log holds a small JSON header followed by fixed-size little-endian records:
+#   spawn     step, direction, lane, class, turn, speed, offset   (25 bytes)
+#   phase     step, direction, signal state (0 red, 1 yellow, 2 green)  (7 bytes)
+#   decision  step, next green, green duration ms                  (14 bytes)
+# Steps are physics steps of the simulation clock and floats are stored as
+# doubles, so replaying the spawns of a log reproduces the traffic bit for bit
+# without touching the random generator.
+#
+#   python event_log.py run.tlog                   # summary
+#   python event_log.py run.tlog --compare b.tlog  # first decision that differs
+#   python event_log.py run.tlog --rerun           # replay a headless log at full speed
+import argparse
+import json
+import struct
+from collections import defaultdict, namedtuple
+from controllers import SignalController, next_in_sequence
+
+MAGIC = b'TLOG'
+VERSION = 1
+
+SPAWN = 1
+PHASE = 2
+DECISION = 3
+
+RECORD_FORMATS = {
+    SPAWN: struct.Struct('<IBBBBdd'),
+    PHASE: struct.Struct('<IbB'),
+    DECISION: struct.Struct('<Ibd'),
+}
+
+Spawn = namedtuple('Spawn', 'step direction lane vclass turn speed offset')
+Phase = namedtuple('Phase', 'step direction state')
+Decision = namedtuple('Decision', 'step green duration')
+
+
+class EventLogWriter:
+    def __init__(self, path, **metadata):
+        self.path = path
+        self.file = open(path, 'wb')
+        header = json.dumps(metadata, sort_keys=True).encode()
+        self.file.write(MAGIC + struct.pack('<BH', VERSION, len(header)) + header)
+        self.counts = defaultdict(int)
+
+    def _write(self, kind, *values):
+        self.file.write(bytes((kind,)) + RECORD_FORMATS[kind].pack(*values))
+        self.counts[kind] += 1
+
+    def spawn(self, step, direction, lane, vclass, turn, speed, offset):
+        self._write(SPAWN, step, direction, lane, vclass, turn, speed, offset)
+
+    def phase(self, step, direction, state):
+        self._write(PHASE, step, -1 if direction is None else direction, state)
+
+    def decision(self, step, green, duration):
+        self._write(DECISION, step, green, duration)
+
+    def tell(self):
+        """Bytes written so far, a position truncate() can go back to"""
+        return self.file.tell()
+
+    def truncate(self, position):
+        """Drop the records written after `position`, for a run rewound to that point"""
+        self.file.seek(position)
+        self.file.truncate()
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class EventLog:
+    """A log read back into memory"""
+
+    def __init__(self, path):
+        self.spawns = []
+        self.phases = []
+        self.decisions = []
+        with open(path, 'rb') as f:
+            data = f.read()
+        if data[:4] != MAGIC:
+            raise ValueError(f"{path} is not a traffic event log")
+        version, header_length = struct.unpack_from('<BH', data, 4)
+        if version != VERSION:
+            raise ValueError(f"{path}: unsupported event log version {version}")
+        offset = 7 + header_length
+        self.metadata = json.loads(data[7:offset])
+        targets = {SPAWN: (self.spawns, Spawn), PHASE: (self.phases, Phase), DECISION: (self.decisions, Decision)}
+        while offset < len(data):
+            kind = data[offset]
+            record_format = RECORD_FORMATS[kind]
+            records, record_type = targets[kind]
+            records.append(record_type(*record_format.unpack_from(data, offset + 1)))
+            offset += 1 + record_format.size
+        self.spawns_by_step = defaultdict(list)
+        for spawn in self.spawns:
+            self.spawns_by_step[spawn.step].append(spawn)
+
+    def spawns_at(self, step):
+        return self.spawns_by_step.get(step, ())
+
+    @property
+    def last_step(self):
+        steps = [records[-1].step for records in (self.spawns, self.phases, self.decisions) if records]
+        return max(steps) if steps else 0
+
+
+class ReplayDemand:
+    """Demand for the headless engine that re-issues the spawns of a log"""
+
+    def __init__(self, log):
+        self.log = log
+
+    def fork(self):
+        """Spawns are looked up by step, so forked simulations can share the log"""
+        return self
+
+    def arrivals(self, step):
+        return [(spawn.direction, spawn.lane, spawn.vclass, spawn.turn) for spawn in self.log.spawns_at(step)]
+
+
+class ReplayController(SignalController):
+    """Re-issues the decisions of a log in order, for reproducing a run exactly"""
+    name = "Replay"
+
+    def __init__(self, log):
+        self.decisions = iter(log.decisions)
+
+    def decide(self, state):
+        decision = next(self.decisions, None)
+        if decision is None:
+            # Past the end of the recording: keep rotating with the last duration
+            return next_in_sequence(state['current_light']), getattr(self, 'last_duration', 5000)
+        self.last_duration = decision.duration
+        return decision.green, decision.duration
+
+
+def summarize(log):
+    lines = [f"metadata: {json.dumps(log.metadata, sort_keys=True)}",
+             f"steps: {log.last_step}",
+             f"spawns: {len(log.spawns)}",
+             f"phase changes: {len(log.phases)}",
+             f"decisions: {len(log.decisions)}"]
+    return '\n'.join(lines)
+
+
+def first_divergence(log, other):
+    """Index and pair of the first decisions that differ, or None if one log is a prefix of the other"""
+    for index, (a, b) in enumerate(zip(log.decisions, other.decisions)):
+        if a.step != b.step or a.green != b.green or abs(a.duration - b.duration) > 1e-3:
+            return index, a, b
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect traffic event logs")
+    parser.add_argument('log')
+    parser.add_argument('--compare', help="second log to compare decisions against")
+    parser.add_argument('--rerun', action='store_true',
+                        help="re-drive the headless engine with the log's spawns and decisions")
+    args = parser.parse_args()
+    log = EventLog(args.log)
+    print(summarize(log))
+    if args.compare:
+        other = EventLog(args.compare)
+        divergence = first_divergence(log, other)
+        if divergence is None:
+            print(f"decisions match for the first {min(len(log.decisions), len(other.decisions))} cycles")
+        else:
+            index, a, b = divergence
+            print(f"decision {index} differs: {a} vs {b}")
+    if args.rerun:
+        # Spawns and decisions only mean the same thing on the junction they were recorded on
+        if log.metadata.get('source') != 'headless':
+            parser.error(f"{args.log} was recorded by {log.metadata.get('source')}; only headless logs can be rerun")
+        from simulation_headless import HeadlessSimulation, TICK_MS
+        simulation = HeadlessSimulation(ReplayController(log), demand=ReplayDemand(log))
+        result = simulation.run(log.metadata.get('seconds', (log.last_step + 1) * TICK_MS / 1000))
+        print(f"rerun: {result['crossed']} crossed, mean wait {result['mean_wait']:.1f} s, "
+              f"{result['steps_per_second']:.0f} steps/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+# NumPy-only inference for the fitted traffic models.
+#
+# sklearn's predict() validates input and dispatches through several layers on
+# every call, which costs far more than the arithmetic for one 9-feature row.
+# The controllers export their fitted model into the plain arrays below once
+# after training and score the current state with them at the phase switch.
+# The tree can also score thousands of states at once with a vectorised walk.
+import time
+import numpy as np
+
+
+class FastKNNRegressor:
+    def __init__(self, X, y, n_neighbors, p=2, fill_values=None, fallback=None):
+        self.X = np.ascontiguousarray(X, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+        self.n_neighbors = n_neighbors
+        self.p = p
+        self.fill_values = None if fill_values is None else np.asarray(fill_values, dtype=np.float64)
+        # sklearn model used only when the k-th neighbour is tied, so the result always matches it
+        self.fallback = fallback
+        self.tie_fallbacks = 0
+
+    @classmethod
+    def from_sklearn(cls, model, imputer=None):
+        """Export a fitted KNeighborsRegressor (and optional SimpleImputer) to arrays"""
+        if model.weights != 'uniform':
+            raise ValueError("only uniform KNN weights are supported")
+        if model.effective_metric_ not in ('euclidean', 'manhattan', 'minkowski'):
+            raise ValueError(f"unsupported KNN metric: {model.effective_metric_}")
+        p = {'euclidean': 2, 'manhattan': 1}.get(model.effective_metric_, model.p)
+        fill_values = imputer.statistics_ if imputer is not None else None
+        return cls(model._fit_X, model._y, model.n_neighbors, p, fill_values, (model, imputer))
+
+    def _prepare(self, features):
+        x = np.asarray(features, dtype=np.float64)
+        if self.fill_values is not None:
+            missing = np.isnan(x)
+            if missing.any():
+                x = np.where(missing, self.fill_values, x)
+        return x
+
+    def _distances(self, x):
+        diff = self.X - x
+        if self.p == 2:
+            # Squared distances keep the neighbour order without the sqrt
+            return np.einsum('ij,ij->i', diff, diff)
+        if self.p == 1:
+            return np.abs(diff).sum(axis=1)
+        return (np.abs(diff) ** self.p).sum(axis=1)
+
+    def predict_one(self, features):
+        """Predict a single feature row"""
+        x = self._prepare(features)
+        k = self.n_neighbors
+        distances = self._distances(x)
+        if len(distances) <= k:
+            return float(self.y.mean())
+        nearest = np.argpartition(distances, k)
+        kth = distances[nearest[:k]].max()
+        if distances[nearest[k]] == kth and self.fallback is not None:
+            # Equidistant neighbours at the cut-off: sklearn's pick depends on its tree layout
+            self.tie_fallbacks += 1
+            model, imputer = self.fallback
+            row = imputer.transform([features]) if imputer is not None else [features]
+            return float(model.predict(row)[0])
+        return float(self.y[nearest[:k]].mean())
+
+    def predict_batch(self, X):
+        """Predict every row of a 2-D array (row by row, to keep the tie handling)"""
+        return np.array([self.predict_one(row) for row in np.asarray(X, dtype=np.float64).tolist()])
+
+
+class FastTreeRegressor:
+    def __init__(self, feature, threshold, children_left, children_right, value, missing_go_to_left=None):
+        self.feature = np.asarray(feature, dtype=np.intp)
+        self.threshold = np.asarray(threshold, dtype=np.float64)
+        self.children_left = np.asarray(children_left, dtype=np.intp)
+        self.children_right = np.asarray(children_right, dtype=np.intp)
+        self.value = np.asarray(value, dtype=np.float64)
+        if missing_go_to_left is None:
+            missing_go_to_left = np.zeros(len(self.feature), dtype=bool)
+        self.missing_go_to_left = np.asarray(missing_go_to_left, dtype=bool)
+        # Python lists are faster than NumPy scalar indexing for a 5-level walk
+        self._nodes = list(zip(self.feature.tolist(), self.threshold.tolist(),
+                               self.children_left.tolist(), self.children_right.tolist(),
+                               self.missing_go_to_left.tolist()))
+        self._values = self.value.tolist()
+
+        # Batch walk: leaves point back to themselves, so every row can take
+        # `depth` steps in lockstep and rows that reached a leaf stay there
+        node_ids = np.arange(len(self.feature))
+        leaves = self.children_left == -1
+        self._batch_left = np.where(leaves, node_ids, self.children_left)
+        self._batch_right = np.where(leaves, node_ids, self.children_right)
+        self._batch_feature = np.where(leaves, 0, self.feature)
+        self.depth = self._depth()
+
+    def _depth(self):
+        depth = 0
+        level = [0]
+        while True:
+            level = [child for node in level if self.children_left[node] != -1
+                     for child in (self.children_left[node], self.children_right[node])]
+            if not level:
+                return depth
+            depth += 1
+
+    @classmethod
+    def from_sklearn(cls, model):
+        """Export a fitted DecisionTreeRegressor to flat node arrays"""
+        tree = model.tree_
+        missing = getattr(tree, 'missing_go_to_left', None)
+        return cls(tree.feature, tree.threshold, tree.children_left, tree.children_right,
+                   tree.value[:, 0, 0], missing)
+
+    def predict_one(self, features):
+        """Predict a single feature row"""
+        # sklearn compares float32 copies of the inputs against the thresholds
+        x = np.asarray(features, dtype=np.float32).tolist()
+        node = 0
+        nodes = self._nodes
+        while True:
+            feature, threshold, left, right, missing_left = nodes[node]
+            if left == -1:
+                return self._values[node]
+            value = x[feature]
+            if value != value:
+                node = left if missing_left else right
+            elif value <= threshold:
+                node = left
+            else:
+                node = right
+
+    def predict_batch(self, X):
+        """Predict every row of a 2-D array in one vectorised walk"""
+        X = np.asarray(X, dtype=np.float32)
+        rows = np.arange(len(X))
+        node = np.zeros(len(X), dtype=np.intp)
+        for _ in range(self.depth):
+            value = X[rows, self._batch_feature[node]]
+            go_left = value <= self.threshold[node]
+            missing = np.isnan(value)
+            if missing.any():
+                go_left = np.where(missing, self.missing_go_to_left[node], go_left)
+            node = np.where(go_left, self._batch_left[node], self._batch_right[node])
+        return self.value[node]
+
+
+def benchmark(n_samples=500, n_calls=2000, seed=0):
+    """Compare sklearn and NumPy single-row prediction latency on synthetic controller data"""
+    from sklearn.neighbors import KNeighborsRegressor
+    from sklearn.tree import DecisionTreeRegressor
+    from sklearn.impute import SimpleImputer
+
+    rng = np.random.default_rng(seed)
+    # Same 9-column layout as TrafficDataCollector.features
+    X = np.hstack([rng.integers(0, 15, (n_samples, 4)),
+                   rng.uniform(0, 300, (n_samples, 4)).round(1),
+                   rng.integers(0, 4, (n_samples, 1))]).astype(float)
+    y = X[:, :4].sum(axis=1) * 10 - X[:, 4:8].mean(axis=1) + rng.normal(0, 5, n_samples)
+    rows = [list(row) for row in np.hstack([rng.integers(0, 15, (n_calls, 4)),
+                                            rng.uniform(0, 300, (n_calls, 4)).round(1),
+                                            rng.integers(0, 4, (n_calls, 1))]).astype(float)]
+
+    imputer = SimpleImputer(strategy='mean')
+    knn = KNeighborsRegressor(n_neighbors=3).fit(imputer.fit_transform(X), y)
+    tree = DecisionTreeRegressor(max_depth=5).fit(X, y)
+    fast_knn = FastKNNRegressor.from_sklearn(knn, imputer)
+    fast_tree = FastTreeRegressor.from_sklearn(tree)
+
+    cases = [
+        ("KNN", lambda row: knn.predict(imputer.transform([row]))[0], fast_knn.predict_one),
+        ("Decision Tree", lambda row: tree.predict([row])[0], fast_tree.predict_one),
+    ]
+    print(f"{'model':<15}{'sklearn us':>12}{'numpy us':>12}{'speedup':>10}{'max diff':>12}")
+    for name, slow, fast in cases:
+        start = time.perf_counter()
+        expected = [slow(row) for row in rows]
+        slow_us = (time.perf_counter() - start) / n_calls * 1e6
+        start = time.perf_counter()
+        actual = [fast(row) for row in rows]
+        fast_us = (time.perf_counter() - start) / n_calls * 1e6
+        max_diff = max(abs(a - b) for a, b in zip(expected, actual))
+        print(f"{name:<15}{slow_us:>12.1f}{fast_us:>12.1f}{slow_us / fast_us:>9.1f}x{max_diff:>12.2e}")
+
+    # Batch scoring: one call over every row
+    batch = np.array(rows)
+    start = time.perf_counter()
+    expected = tree.predict(batch)
+    slow_us = (time.perf_counter() - start) / n_calls * 1e6
+    start = time.perf_counter()
+    actual = fast_tree.predict_batch(batch)
+    fast_us = (time.perf_counter() - start) / n_calls * 1e6
+    max_diff = float(np.abs(expected - actual).max())
+    print(f"{'Tree batch':<15}{slow_us:>12.2f}{fast_us:>12.2f}{slow_us / fast_us:>9.1f}x{max_diff:>12.2e}"
+          f"  ({n_calls} rows per call)")
+
+
+if __name__ == "__main__":
+    benchmark()
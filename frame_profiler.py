@@ -0,0 +1,151 @@
+# Per-stage frame timing for the pygame main loops.
+#
+#   with profiler.stage('move'):
+#       ...
+#   profiler.end_frame()
+#
+# Time spent inside each named stage is summed over a frame and kept for the
+# last `window` frames, so the overlay and exports show rolling means,
+# percentiles and histograms per stage. Stages may nest (the efficiency tracker
+# runs inside the light update), in which case the outer stage includes the
+# inner one. While disabled, stage() hands back a shared no-op context manager
+# and end_frame() returns at once, so the timers can stay in the loop.
+import csv
+import json
+import time
+from collections import defaultdict, deque
+from contextlib import nullcontext
+import numpy as np
+
+# Upper bucket edges of the per-stage histograms, in milliseconds
+HISTOGRAM_EDGES_MS = [0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 33, 66]
+FRAME_BUDGET_MS = 1000 / 60
+# Wall seconds between recomputing the overlay's figures; percentiles over every window are too slow for each frame
+OVERLAY_REFRESH = 0.25
+
+_NULL_STAGE = nullcontext()
+
+
+class _StageTimer:
+    __slots__ = ('totals', 'name', 'start')
+
+    def __init__(self, totals, name):
+        self.totals = totals
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.totals[self.name] += time.perf_counter() - self.start
+
+
+class FrameProfiler:
+    def __init__(self, enabled=False, window=600):
+        self.enabled = enabled
+        self.show_overlay = enabled
+        self.window = window
+        self.frames = 0
+        self.timers = {}
+        self.current = defaultdict(float)  # seconds per stage in the frame being timed
+        self.samples = {'frame': deque(maxlen=window)}  # milliseconds per stage, one entry per frame
+        self.frame_start = time.perf_counter()
+        self.font = None
+        self.overlay_stats = {}
+        self.overlay_time = float('-inf')  # when overlay_stats was computed
+
+    @classmethod
+    def add_arguments(cls, parser):
+        parser.add_argument('--profile', action='store_true', help="time each stage of the frame (P toggles)")
+        parser.add_argument('--profile-export', metavar='PATH',
+                            help="write the frame timings to a .csv or .json file on exit")
+
+    def stage(self, name):
+        """Context manager timing one stage of the current frame"""
+        if not self.enabled:
+            return _NULL_STAGE
+        timer = self.timers.get(name)
+        if timer is None:
+            timer = self.timers[name] = _StageTimer(self.current, name)
+        return timer
+
+    def end_frame(self):
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.current['frame'] = now - self.frame_start
+        self.frame_start = now
+        for name in self.current:
+            if name not in self.samples:
+                # zeros for the frames before this stage first ran, so every stage covers the same frames
+                self.samples[name] = deque([0.0] * len(self.samples['frame']), maxlen=self.window)
+        for name, samples in self.samples.items():
+            samples.append(self.current.get(name, 0.0) * 1000)
+        self.current.clear()
+        self.frames += 1
+
+    def toggle(self):
+        self.enabled = not self.enabled
+        self.show_overlay = self.enabled
+        self.current.clear()
+        self.frame_start = time.perf_counter()
+
+    def summary(self):
+        """Rolling statistics per stage: mean, p50, p95 and max in ms, plus a histogram"""
+        stats = {}
+        for name, samples in self.samples.items():
+            if not samples:
+                continue
+            values = np.fromiter(samples, dtype=np.float64)
+            counts, _ = np.histogram(values, bins=[0] + HISTOGRAM_EDGES_MS + [np.inf])
+            stats[name] = {
+                'mean_ms': float(values.mean()),
+                'p50_ms': float(np.percentile(values, 50)),
+                'p95_ms': float(np.percentile(values, 95)),
+                'max_ms': float(values.max()),
+                'histogram': dict(zip([str(edge) for edge in HISTOGRAM_EDGES_MS] + ['inf'], counts.tolist())),
+            }
+        return stats
+
+    def export(self, path):
+        """Write summary() to a .json file, or to CSV for any other extension"""
+        stats = self.summary()
+        if path.endswith('.json'):
+            with open(path, 'w') as f:
+                json.dump({'frames': self.frames, 'window': self.window, 'stages': stats}, f, indent=2)
+            return
+        buckets = [str(edge) for edge in HISTOGRAM_EDGES_MS] + ['inf']
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['stage', 'mean_ms', 'p50_ms', 'p95_ms', 'max_ms'] + [f"le_{b}_ms" for b in buckets])
+            for name, stage in stats.items():
+                writer.writerow([name, stage['mean_ms'], stage['p50_ms'], stage['p95_ms'], stage['max_ms']]
+                                + [stage['histogram'][b] for b in buckets])
+
+    def draw_overlay(self, surface):
+        """Panel in the top-right corner with each stage's mean and p95 and a bar against the 60 fps budget"""
+        import pygame
+        if not self.show_overlay:
+            return
+        if self.font is None:
+            self.font = pygame.font.SysFont('monospace', 14)
+        font = self.font
+        now = time.perf_counter()
+        if now - self.overlay_time >= OVERLAY_REFRESH:
+            self.overlay_stats = self.summary()
+            self.overlay_time = now
+        stats = self.overlay_stats
+        line_height = font.get_linesize()
+        width = 330
+        panel = pygame.Surface((width, line_height * (len(stats) + 1) + 10), pygame.SRCALPHA)
+        panel.fill((0, 0, 0, 180))
+        panel.blit(font.render("stage        mean    p95 ms", True, (255, 255, 255)), (5, 5))
+        for row, (name, stage) in enumerate(stats.items(), start=1):
+            y = 5 + row * line_height
+            bar = int(min(1.0, stage['mean_ms'] / FRAME_BUDGET_MS) * (width - 230))
+            pygame.draw.rect(panel, (255, 80, 80) if name == 'frame' else (80, 200, 80),
+                             (220, y + 3, bar, line_height - 6))
+            text = f"{name:<11}{stage['mean_ms']:>6.2f}{stage['p95_ms']:>7.2f}"
+            panel.blit(font.render(text, True, (255, 255, 255)), (5, y))
+        surface.blit(panel, (surface.get_width() - width - 10, 10))
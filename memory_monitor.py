@@ -0,0 +1,229 @@
+# Memory-growth tracking for long runs.
+#
+#   python simulation_knn.py --memory --memory-log memory.csv --memory-budget 20
+#   python memory_monitor.py --hours 48 --controller knn --budget 5   # headless soak test
+#
+# Every `interval` simulated seconds the monitor records resident set size,
+# the memory tracemalloc has traced, and how many Vehicle, Surface, dict and
+# list objects are alive. Once past `warmup`, the RSS growth per simulated
+# hour is fitted over all samples; when it goes over `budget` MB/h the monitor
+# warns, or with action 'dump' also writes a tracemalloc snapshot and prints
+# the lines that allocated the most since the start. tracemalloc slows
+# allocation-heavy code (the live efficiency plots most of all) and counting
+# objects walks the whole heap, so the monitor is off unless asked for. Soak
+# tests over days are quickest with the headless engine (main() below).
+import csv
+import gc
+import os
+import sys
+import time
+import tracemalloc
+from collections import Counter
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+COUNTED_TYPES = ('Vehicle', 'Surface', 'dict', 'list')
+MB = 1024 * 1024
+
+
+def rss_bytes():
+    """Resident set size of this process; the peak where the current value can't be read"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024  # bytes on macOS, KB elsewhere
+
+
+def count_objects(type_names=COUNTED_TYPES):
+    """Live objects per type name
+
+    The garbage collector only lists container objects that can hold
+    references. Surfaces and dicts of plain values are not among them, so the
+    objects referenced from the listed ones are counted too, each once.
+    """
+    counts = Counter()
+    untracked = set()
+    for obj in gc.get_objects():
+        name = type(obj).__name__
+        if name in type_names:
+            counts[name] += 1
+        for ref in gc.get_referents(obj):
+            if type(ref).__name__ in type_names and not gc.is_tracked(ref) and id(ref) not in untracked:
+                untracked.add(id(ref))
+                counts[type(ref).__name__] += 1
+    return {name: counts[name] for name in type_names}
+
+
+class MemoryMonitor:
+    def __init__(self, enabled=False, interval=300, budget=None, action='warn', warmup=600, log_path=None,
+                 dump_dir='.', top=10):
+        self.enabled = enabled
+        self.interval = interval  # simulated seconds between samples
+        self.budget = budget  # MB of RSS growth per simulated hour, None for no check
+        self.action = action  # 'warn' or 'dump'
+        self.warmup = warmup  # simulated seconds before growth is judged
+        self.log_path = log_path
+        self.dump_dir = dump_dir
+        self.top = top
+        self.samples = []
+        self.next_sample = 0.0
+        self.over_budget = False
+        self.baseline = None  # tracemalloc snapshot taken at start()
+        self.log_file = None
+        self.log_writer = None
+        self.wall_start = time.perf_counter()
+
+    @classmethod
+    def add_arguments(cls, parser):
+        parser.add_argument('--memory', action='store_true', help="sample memory use while running")
+        parser.add_argument('--memory-interval', type=float, default=300, metavar='SECONDS',
+                            help="simulated seconds between memory samples")
+        parser.add_argument('--memory-budget', type=float, metavar='MB_PER_HOUR',
+                            help="RSS growth per simulated hour above which to warn")
+        parser.add_argument('--memory-action', choices=['warn', 'dump'], default='warn',
+                            help="on going over budget, warn or also dump a tracemalloc snapshot")
+        parser.add_argument('--memory-log', metavar='CSV', help="write every memory sample to this file")
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(args.memory or bool(args.memory_log) or args.memory_budget is not None, args.memory_interval,
+                   args.memory_budget, args.memory_action, log_path=args.memory_log)
+
+    def start(self):
+        if not self.enabled:
+            return
+        tracemalloc.start()
+        self.baseline = tracemalloc.take_snapshot()
+        self.wall_start = time.perf_counter()
+        if self.log_path:
+            self.log_file = open(self.log_path, 'w', newline='')
+            self.log_writer = csv.writer(self.log_file)
+            self.log_writer.writerow(['sim_seconds', 'wall_seconds', 'rss_mb', 'traced_mb', 'traced_peak_mb']
+                                     + [f"{name}_count" for name in COUNTED_TYPES])
+
+    def sample(self, sim_seconds):
+        """Take a sample if one is due at this simulated time"""
+        if not self.enabled or sim_seconds < self.next_sample:
+            return
+        self.next_sample = sim_seconds + self.interval
+        traced, peak = tracemalloc.get_traced_memory()
+        rss = rss_bytes()
+        sample = {
+            'sim_seconds': sim_seconds,
+            'wall_seconds': time.perf_counter() - self.wall_start,
+            'rss_mb': rss / MB if rss is not None else float('nan'),
+            'traced_mb': traced / MB,
+            'traced_peak_mb': peak / MB,
+            'counts': count_objects(),
+        }
+        self.samples.append(sample)
+        if self.log_writer is not None:
+            self.log_writer.writerow([f"{sample['sim_seconds']:.0f}", f"{sample['wall_seconds']:.1f}",
+                                      f"{sample['rss_mb']:.2f}", f"{sample['traced_mb']:.2f}",
+                                      f"{sample['traced_peak_mb']:.2f}"]
+                                     + [sample['counts'][name] for name in COUNTED_TYPES])
+            self.log_file.flush()
+        self.check_budget()
+
+    def growth_rate(self, key='rss_mb'):
+        """Least-squares growth of `key` in MB per simulated hour after the warm-up, or None"""
+        points = [(s['sim_seconds'] / 3600, s[key]) for s in self.samples if s['sim_seconds'] >= self.warmup]
+        if len(points) < 3:
+            return None
+        hours, values = np.array(points).T
+        if np.isnan(values).any() or hours[-1] == hours[0]:
+            return None
+        return float(np.polyfit(hours, values, 1)[0])
+
+    def check_budget(self):
+        if self.budget is None:
+            return
+        rate = self.growth_rate()
+        over = rate is not None and rate > self.budget
+        if over and not self.over_budget:
+            print(f"Memory warning: RSS growing {rate:.1f} MB per simulated hour "
+                  f"(budget {self.budget:g}) at {self.samples[-1]['sim_seconds'] / 3600:.2f} h")
+            if self.action == 'dump':
+                self.dump()
+        self.over_budget = over
+
+    def dump(self):
+        """Save a tracemalloc snapshot and print the allocation sites that grew most since start()"""
+        snapshot = tracemalloc.take_snapshot()
+        path = os.path.join(self.dump_dir, f"memory_{self.samples[-1]['sim_seconds']:.0f}s.snapshot")
+        snapshot.dump(path)
+        print(f"Snapshot written to {path}; largest growth since start:")
+        for stat in snapshot.compare_to(self.baseline, 'lineno')[:self.top]:
+            print(f"  {stat}")
+        return path
+
+    def report(self):
+        """First and last sample and the fitted growth rates, as text"""
+        if len(self.samples) < 2:
+            return "Memory: not enough samples"
+        first, last = self.samples[0], self.samples[-1]
+        lines = [f"Memory over {last['sim_seconds'] / 3600:.2f} simulated hours ({len(self.samples)} samples): "
+                 f"RSS {first['rss_mb']:.1f} -> {last['rss_mb']:.1f} MB, "
+                 f"traced {first['traced_mb']:.1f} -> {last['traced_mb']:.1f} MB"]
+        for key, label in (('rss_mb', 'RSS'), ('traced_mb', 'traced')):
+            rate = self.growth_rate(key)
+            if rate is not None:
+                lines.append(f"  {label} growth after warm-up: {rate:+.2f} MB per simulated hour")
+        lines.append('  objects: ' + ', '.join(f"{name} {first['counts'][name]} -> {last['counts'][name]}"
+                                               for name in COUNTED_TYPES))
+        return '\n'.join(lines)
+
+    def stop(self):
+        if not self.enabled:
+            return
+        print(self.report())
+        if self.log_file is not None:
+            self.log_file.close()
+        tracemalloc.stop()
+
+
+def main():
+    import argparse
+    import retention
+    from benchmark_controllers import CONTROLLERS
+    from simulation_headless import HeadlessSimulation, Demand, TICK_MS
+
+    parser = argparse.ArgumentParser(description="Soak-test the headless engine and report memory growth")
+    parser.add_argument('--hours', type=float, default=24, help="simulated hours to run")
+    parser.add_argument('--controller', choices=list(CONTROLLERS), default='knn')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--interval', type=float, default=300, help="simulated seconds between samples")
+    parser.add_argument('--warmup', type=float, default=3600, help="simulated seconds before growth is judged")
+    parser.add_argument('--budget', type=float, help="RSS growth in MB per simulated hour to warn above")
+    parser.add_argument('--action', choices=['warn', 'dump'], default='warn')
+    parser.add_argument('--log', metavar='CSV', help="write every sample to this file")
+    retention.add_arguments(parser)
+    args = parser.parse_args()
+
+    controller = CONTROLLERS[args.controller]()
+    if hasattr(controller, 'data_collector'):
+        controller.data_collector.retention = retention.make_retention(args.retention, args.max_samples, args.seed)
+    simulation = HeadlessSimulation(controller, demand=Demand(args.seed))
+    monitor = MemoryMonitor(True, args.interval, args.budget, args.action, args.warmup, args.log)
+    monitor.start()
+    steps = int(round(args.hours * 3600 * 1000 / TICK_MS))
+    steps_per_sample = int(round(args.interval * 1000 / TICK_MS))
+    for tick in range(steps):
+        if tick % steps_per_sample == 0:
+            monitor.sample(simulation.time_ms / 1000)
+        simulation.step()
+    monitor.sample(simulation.time_ms / 1000)
+    monitor.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+# Model-predictive signal controller: try each candidate decision on a forked simulation, keep the best.
+#
+#   python mpc_controller.py --seconds 600 --budget 500 --workers 4   # headless, against its fallback and the rest
+#   python mpc_controller.py --from-state --fallback knn              # model rebuilt from counts, as in pygame
+#   python simulation_Dy2.py --mpc --mpc-budget 300                   # drive the pygame lights
+#
+# At every phase switch the controller lists candidate decisions: each
+# direction that has vehicles waiting, paired with each of a few green times.
+# The fallback controller's own decision is always a candidate too. Each one is
+# played on a fork of the simulation (HeadlessSimulation.fork()) and then
+# rolled out for a short horizon under fixed rotation. The fork's arrivals are
+# drawn from a reseeded copy of the demand: the same rates, but not the
+# vehicles that will really come, so the rollouts see plausible rather than
+# actual future traffic. All candidates of one decision share those arrivals
+# and are compared on equal terms. The cost is the growth of the sum of
+# squared waits over the horizon, so every second waited weighs as much as the
+# vehicle has already waited. Minimising plain vehicle-seconds starves the
+# quiet approaches: the mean wait drops but the 95th percentile rises above
+# fixed rotation's. The cheapest candidate wins.
+#
+# Rollouts run in a pool of worker processes. Every decision has a hard
+# wall-clock budget. The fallback's candidate is scored first, so when the
+# budget runs out it is either in or the fallback's decision is used as is:
+# the controller never picks something it has not compared with the fallback.
+# A rollout already running in a worker can't be cancelled, so the ones that
+# missed their decision keep their workers until they finish. The next decision
+# only submits rollouts to the workers left idle, and stats() reports how often
+# that held a decision back.
+# The pygame simulators call prepare() when their green turns yellow, so the
+# rollouts run alongside the render loop during the yellow. Headless, attach()
+# gives the controller the simulation itself to fork. Otherwise the controller
+# lays the observed queues out in a headless junction and forks that.
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+import numpy as np
+from benchmark_controllers import CONTROLLERS, run_controller, format_table
+from controllers import SignalController, FixedRotationController, FirstDecision, DIRECTION_NAMES
+from simulation_headless import (HeadlessSimulation, Demand, TICK_MS, STOP_DISTANCE, CLASS_LENGTHS, gap,
+                                 vehicleTypes, noOfSignals, noOfLanes)
+
+# Order in which vehicles of a direction are laid out when the state has no class counts,
+# following the generator's mix: a bike for every four of the other classes
+DEFAULT_CLASS_CYCLE = [0, 1, 4, 2, 3]
+
+COLUMNS = [
+    ('controller', 'Controller', 18, ''),
+    ('throughput', 'Veh/min', 9, '.1f'),
+    ('mean_wait', 'Mean wait s', 12, '.2f'),
+    ('p95_wait', 'P95 wait s', 11, '.1f'),
+    ('decision_ms', 'Decision ms', 12, '.1f'),
+    ('decision_p95_ms', 'P95 ms', 8, '.1f'),
+    ('fallback_rate', 'Fallbacks', 10, '.0%'),
+]
+
+
+def squared_waits(simulation):
+    """Sum of squared waits, in s^2, of every vehicle that crossed and of those still waiting"""
+    waits = simulation.total_wait[~simulation.crossed].tolist()
+    waits += [simulation.tick - spawn_tick for queue in simulation.pending for _, _, _, spawn_tick in queue]
+    waits = np.array(waits, dtype=np.int64)
+    return (simulation.waits.squares + int(waits @ waits)) * (TICK_MS / 1000) ** 2
+
+
+def rollout(model, candidates, horizon):
+    """Cost of `horizon` seconds after each (next_green, green_ms) decision; runs in a worker"""
+    snapshot = model.snapshot()
+    before = squared_waits(model)
+    costs = []
+    for next_green, green_duration in candidates:
+        simulation = model.fork(FirstDecision(next_green, green_duration), snapshot)
+        simulation.run(horizon)
+        costs.append(squared_waits(simulation) - before)
+    return costs
+
+
+def model_from_state(state, interval_ms=750, direction_weights=(400, 400, 100, 100), seed=0):
+    """Headless junction at a decision point, holding the queues described by a controller state
+
+    Each direction's vehicles are packed back from the stop line, lane by
+    lane, with the direction's mean wait; those that do not fit on the road
+    wait to enter. Class counts are used when the state has them.
+    """
+    model = HeadlessSimulation(FixedRotationController(), demand=Demand(seed, interval_ms, direction_weights))
+    vehicles, positions = [], []
+    for direction, name in enumerate(DIRECTION_NAMES):
+        wait = int(round(state[f"{name}_wait"]))
+        if 'class_counts' in state:
+            counts = state['class_counts'][direction]
+            classes = [c for c in range(5) for _ in range(counts.get(vehicleTypes[c], 0))]
+        else:
+            classes = [DEFAULT_CLASS_CYCLE[i % len(DEFAULT_CLASS_CYCLE)] for i in range(state[f"{name}_count"])]
+        rear = [STOP_DISTANCE[direction]] * noOfLanes
+        alternate = 0
+        for vclass in classes:
+            # Bikes keep to lane 0, the other classes alternate between lanes 1 and 2
+            if vclass == 4:
+                lane = 0
+            else:
+                lane, alternate = 1 + alternate, 1 - alternate
+            if rear[lane] >= CLASS_LENGTHS[vclass]:
+                vehicles.append((model.next_uid, direction, lane, vclass, 0, wait))
+                positions.append(rear[lane])
+                rear[lane] -= CLASS_LENGTHS[vclass] + gap
+            else:
+                model.pending[direction * noOfLanes + lane].append((model.next_uid, vclass, 0, -wait))
+            model.next_uid += 1
+    if vehicles:
+        model.add_vehicles(vehicles)
+        model.pos = np.array(positions, dtype=np.float64)
+    return model
+
+
+class MPCController(SignalController):
+    name = "MPC"
+
+    def __init__(self, fallback=None, greens=(3000, 6000, 10000), horizon=12, budget_ms=500, workers=None,
+                 interval_ms=750, direction_weights=(400, 400, 100, 100), seed=0):
+        self.fallback = fallback if fallback is not None else FixedRotationController()
+        self.greens = list(greens)
+        self.horizon = horizon  # seconds rolled out after each candidate decision
+        self.budget = budget_ms / 1000  # wall-clock seconds per decision; 0 waits for every rollout
+        self.workers = workers if workers is not None else os.cpu_count()
+        self.pool = ProcessPoolExecutor(max_workers=self.workers) if self.workers else None
+        # Arrivals assumed when the model is rebuilt from a state
+        self.interval_ms = interval_ms
+        self.direction_weights = direction_weights
+        self.seed = seed  # with the tick, seeds the arrivals sampled for the rollouts
+        self.simulation = None
+        self.planned = None  # (started, fallback decision, candidates, futures, model) from prepare()
+        self.decision_times = []
+        self.fallbacks = 0
+        self.rollouts = 0
+        self.decisions = 0
+        self.stale = []  # futures of earlier decisions still holding a worker
+        self.backlogged = 0  # decisions that found workers still busy with them
+
+    def attach(self, simulation):
+        """Fork this headless simulation for the rollouts instead of rebuilding one from the state"""
+        self.simulation = simulation
+
+    def record_outcome(self, state, vehicles_cleared, avg_wait_time, density_efficiency):
+        self.fallback.record_outcome(state, vehicles_cleared, avg_wait_time, density_efficiency)
+
+    def candidates(self, state, fallback_decision):
+        waiting = [d for d, name in enumerate(DIRECTION_NAMES) if state[f"{name}_count"]] or range(noOfSignals)
+        decisions = [(d, green) for d in waiting for green in self.greens]
+        return [fallback_decision] + [decision for decision in decisions if decision != fallback_decision]
+
+    def model(self, state):
+        if self.simulation is not None:
+            model = self.simulation.fork(FixedRotationController())
+            if hasattr(model.demand, 'resampled'):
+                # Without this the rollouts would know exactly which vehicles arrive next
+                model.demand = model.demand.resampled(f"mpc-{self.seed}-{model.tick}")
+            return model
+        return model_from_state(state, self.interval_ms, self.direction_weights)
+
+    def prepare(self, state):
+        """Start the rollouts for the next decision and return at once"""
+        started = time.perf_counter()
+        fallback_decision = self.fallback.decide(state)
+        fallback_decision = (int(fallback_decision[0]), fallback_decision[1])
+        candidates = self.candidates(state, fallback_decision)
+        model = self.model(state)
+        futures = []
+        if self.pool is not None:
+            submitted = candidates
+            self.stale = [future for future in self.stale if not future.done()]
+            if self.stale:
+                # Queued behind them, new rollouts would eat into this decision's budget
+                self.backlogged += 1
+                submitted = candidates[:max(0, self.workers - len(self.stale))]
+            # The pool starts them in order, so the fallback's candidate is rolled out first
+            futures = [self.pool.submit(rollout, model, [candidate], self.horizon) for candidate in submitted]
+        self.planned = (started, fallback_decision, candidates, futures, model)
+
+    def costs(self, candidates, futures, model, deadline):
+        """Cost of every candidate rolled out before the deadline, None for the rest"""
+        costs = [None] * len(candidates)
+        if self.pool is None:
+            for i, candidate in enumerate(candidates):
+                if self.budget and time.perf_counter() >= deadline:
+                    break
+                costs[i], = rollout(model, [candidate], self.horizon)
+            return costs
+        done, _ = wait(futures, timeout=max(0.0, deadline - time.perf_counter()) if self.budget else None)
+        for i, future in enumerate(futures):
+            if future in done:
+                costs[i], = future.result()
+            elif not future.cancel():
+                self.stale.append(future)
+        return costs
+
+    def decide(self, state):
+        entered = time.perf_counter()
+        if self.planned is None:
+            self.prepare(state)
+        started, fallback_decision, candidates, futures, model = self.planned
+        self.planned = None
+        # Rollouts the pool finished since prepare() all count; waiting for the rest ends with the budget
+        deadline = (started if self.pool is not None else entered) + self.budget
+        costs = self.costs(candidates, futures, model, deadline)
+        rolled_out = [(cost, i) for i, cost in enumerate(costs) if cost is not None]
+        self.rollouts += len(rolled_out)
+        self.decisions += 1
+        self.decision_times.append(time.perf_counter() - entered)
+        if costs[0] is None:
+            self.fallbacks += 1
+            return fallback_decision
+        return candidates[min(rolled_out)[1]]
+
+    def stats(self):
+        decisions = np.array(self.decision_times) * 1000
+        return {
+            'decisions': self.decisions,
+            'fallback_rate': self.fallbacks / self.decisions if self.decisions else 0.0,
+            'rollouts_per_decision': self.rollouts / self.decisions if self.decisions else 0.0,
+            'backlog_rate': self.backlogged / self.decisions if self.decisions else 0.0,
+            'decision_ms': float(decisions.mean()) if len(decisions) else 0.0,
+            'decision_p95_ms': float(np.percentile(decisions, 95)) if len(decisions) else 0.0,
+        }
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+
+
+def run_mpc(controller, seconds, seed, interval_ms=750, from_state=False):
+    """Simulate the MPC controller headless, forking the run itself unless `from_state`"""
+    simulation = HeadlessSimulation(controller, demand=Demand(seed, interval_ms))
+    if not from_state:
+        controller.attach(simulation)
+    result = simulation.run(seconds)
+    result.update(controller.stats())
+    result['controller'] = controller.name
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Model-predictive control by rolling out forked simulations")
+    parser.add_argument('--seconds', type=float, default=600)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--interval', type=int, default=750, help="ms between generated vehicles")
+    parser.add_argument('--fallback', choices=[name for name in CONTROLLERS if name != 'density_knn'],
+                        default='fixed', help="heuristic used when the budget runs out")
+    parser.add_argument('--greens', type=float, nargs='+', default=[3, 6, 10], help="candidate green times (s)")
+    parser.add_argument('--horizon', type=float, default=12, help="seconds rolled out per candidate")
+    parser.add_argument('--budget', type=float, default=500, help="wall-clock ms per decision; 0 for no limit")
+    parser.add_argument('--workers', type=int, default=None, help="rollout processes; 0 rolls out in-process")
+    parser.add_argument('--from-state', action='store_true',
+                        help="rebuild the model from the observed counts and waits instead of forking the run")
+    parser.add_argument('--compare', nargs='*', default=['fixed', 'formula', 'knn'], choices=list(CONTROLLERS),
+                        help="controllers to run on the same demand for comparison")
+    args = parser.parse_args()
+
+    controller = MPCController(CONTROLLERS[args.fallback](), [g * 1000 for g in args.greens], args.horizon,
+                               args.budget, args.workers, args.interval, seed=args.seed)
+    start = time.perf_counter()
+    try:
+        result = run_mpc(controller, args.seconds, args.seed, args.interval, args.from_state)
+    finally:
+        controller.close()
+    elapsed = time.perf_counter() - start
+    result['controller'] = f"MPC ({args.fallback})"
+    results = [result]
+    for name in args.compare:
+        other = run_controller(CONTROLLERS[name](), args.seconds, args.seed, args.interval)
+        other['fallback_rate'] = 0.0
+        results.append(other)
+    print(format_table(results, COLUMNS))
+    print(f"MPC: {result['decisions']} decisions, {result['rollouts_per_decision']:.1f} rollouts each, "
+          f"{result['backlog_rate']:.0%} started with workers still busy, "
+          f"{args.horizon:g} s horizon, {args.budget:g} ms budget, {elapsed:.1f} s wall")
+
+
+if __name__ == "__main__":
+    main()
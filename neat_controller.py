@@ -0,0 +1,113 @@
+# NEAT neuro-evolution signal controller.
+#
+#   python neat_controller.py --generations 50             # evolve on all cores
+#   python neat_controller.py --resume neat-checkpoint-12  # continue a run
+#   python simulation_Dy2.py --neat neat_best_genome.pkl   # watch the winner drive the lights
+#
+# Each genome is scored by headless simulations on fixed demand seeds, so every
+# genome in a generation sees identical traffic. A checkpoint is written after
+# every generation and the best genome is pickled together with its config.
+import argparse
+import multiprocessing
+import pickle
+from functools import partial
+import neat
+from controllers import SignalController, DIRECTION_NAMES
+from simulation_headless import HeadlessSimulation, Demand
+
+CONFIG_PATH = "neat_config.txt"
+BEST_GENOME_PATH = "neat_best_genome.pkl"
+CHECKPOINT_PREFIX = "neat-checkpoint-"
+
+# Input scaling: counts are vehicles, waits are frames
+COUNT_SCALE = 20
+WAIT_SCALE = 600
+
+
+class NEATTrafficController(SignalController):
+    name = "NEAT"
+
+    def __init__(self, genome, config, min_duration=3000, max_duration=10000):
+        self.genome = genome
+        self.net = neat.nn.FeedForwardNetwork.create(genome, config)
+        self.min_duration = min_duration
+        self.max_duration = max_duration
+
+    @classmethod
+    def load(cls, path=BEST_GENOME_PATH, **kwargs):
+        """Load a genome exported by save_genome()"""
+        with open(path, 'rb') as f:
+            genome, config = pickle.load(f)
+        return cls(genome, config, **kwargs)
+
+    def network_inputs(self, state):
+        inputs = [state[f"{name}_count"] / COUNT_SCALE for name in DIRECTION_NAMES]
+        inputs += [state[f"{name}_wait"] / WAIT_SCALE for name in DIRECTION_NAMES]
+        inputs += [1.0 if state['current_light'] == d else 0.0 for d in range(4)]
+        return inputs
+
+    def decide(self, state):
+        outputs = self.net.activate(self.network_inputs(state))
+        next_green = max(range(4), key=lambda d: outputs[d])
+        # tanh output in [-1, 1] mapped onto the allowed green range
+        fraction = min(1.0, max(0.0, (outputs[4] + 1) / 2))
+        return next_green, self.min_duration + fraction * (self.max_duration - self.min_duration)
+
+
+def load_config(path=CONFIG_PATH):
+    return neat.Config(neat.DefaultGenome, neat.DefaultReproduction,
+                       neat.DefaultSpeciesSet, neat.DefaultStagnation, path)
+
+
+def save_genome(genome, config, path=BEST_GENOME_PATH):
+    with open(path, 'wb') as f:
+        pickle.dump((genome, config), f)
+
+
+def eval_genome(genome, config, seconds=300, seeds=(0, 1), interval=750):
+    """Fitness: vehicles per minute minus mean wait in seconds, averaged over the demand seeds"""
+    fitness = 0
+    for seed in seeds:
+        simulation = HeadlessSimulation(NEATTrafficController(genome, config), demand=Demand(seed, interval))
+        result = simulation.run(seconds)
+        fitness += result['throughput'] - result['mean_wait']
+    return fitness / len(seeds)
+
+
+def train(generations=50, config_path=CONFIG_PATH, workers=None, resume=None, seconds=300, seeds=(0, 1),
+          interval=750, output=BEST_GENOME_PATH, checkpoint_prefix=CHECKPOINT_PREFIX):
+    """Evolve a controller, evaluating each generation's genomes in parallel"""
+    if resume:
+        population = neat.Checkpointer.restore_checkpoint(resume)
+    else:
+        population = neat.Population(load_config(config_path))
+    population.add_reporter(neat.StdOutReporter(True))
+    population.add_reporter(neat.StatisticsReporter())
+    population.add_reporter(neat.Checkpointer(generation_interval=1, time_interval_seconds=None,
+                                              filename_prefix=checkpoint_prefix))
+
+    evaluator = neat.ParallelEvaluator(workers or multiprocessing.cpu_count(),
+                                       partial(eval_genome, seconds=seconds, seeds=tuple(seeds), interval=interval))
+    winner = population.run(evaluator.evaluate, generations)
+    save_genome(winner, population.config, output)
+    print(f"Best genome saved to {output} (fitness {winner.fitness:.2f})")
+    return winner
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evolve a NEAT signal controller on headless simulations")
+    parser.add_argument('--generations', type=int, default=50)
+    parser.add_argument('--config', default=CONFIG_PATH)
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument('--resume', help="checkpoint file to continue from")
+    parser.add_argument('--seconds', type=float, default=300, help="simulated seconds per evaluation")
+    parser.add_argument('--seeds', type=int, nargs='+', default=[0, 1], help="demand seeds every genome is scored on")
+    parser.add_argument('--interval', type=float, default=750, help="milliseconds between generated vehicles")
+    parser.add_argument('--output', default=BEST_GENOME_PATH)
+    args = parser.parse_args()
+    train(args.generations, args.config, args.workers, args.resume, args.seconds, args.seeds,
+          args.interval, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+# Cell-transmission screening of fixed-time signal plans.
+#
+#   python plan_screening.py --greens 3 5 8 12 20 --hours 1 --validate 5   # all 625 plans, best 5 in the tick engine
+#   python plan_screening.py --random 5000 --min-green 2 --max-green 30
+#   python plan_screening.py --corridor 4 --spacing 500 --greens 4 8 12 --offsets 0 3 6 9
+#
+# Every lane of every approach is a row of cells from the lane entry to the
+# stop line, and the traffic in a cell is a fluid amount of vehicles. Each
+# step, a cell sends what its vehicles can cover at free speed, capped by the
+# lane's saturation flow, and takes what its remaining storage allows
+# (Daganzo's cell-transmission model). The last cell discharges only while its
+# direction is green. Vehicles that find the first cell full wait in a queue
+# at the lane entry, like the tick engine's pending vehicles. All candidate
+# plans are one axis of the cell arrays, so a step advances all of them with a
+# handful of NumPy operations.
+#
+# The lane parameters come from the tick engine's geometry and vehicle mix
+# (simulation_headless.py): free speed from the class speeds, storage from the
+# lengths plus the gap, and saturation flow from the headway of a packed queue
+# pulling away. Arrivals are a steady flow at the generator's mean rate, so the
+# model misses the random bunching of real arrivals. Use it to rank plans, and
+# check the best ones in the tick engine with --validate.
+#
+# With --corridor the junctions sit on one east-west arterial. Traffic that
+# crosses a junction eastbound or westbound feeds the next junction's approach,
+# and can back up into the junction behind it. Junction j starts its cycle
+# j * offset seconds after the first one.
+import argparse
+import itertools
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from benchmark_controllers import run_controller, format_table
+from controllers import TimingPlanController
+from simulation_headless import (TICK_MS, STOP_LINE_DISTANCE, BOX_EXIT_DISTANCE, CLASS_SPEEDS, CLASS_LENGTHS, gap,
+                                 noOfSignals, noOfLanes)
+
+# Share of the generated vehicles in each lane, and the class mix of the lane:
+# bikes keep to lane 0, the other classes pick lane 1 or 2 (Demand.next_vehicle)
+LANE_SHARES = np.array([1 / 5, 2 / 5, 2 / 5])
+LANE_MIX = np.array([[0, 0, 0, 0, 1], [0.25, 0.25, 0.25, 0.25, 0], [0.25, 0.25, 0.25, 0.25, 0]])
+CLASS_SPEEDS_PER_S = CLASS_SPEEDS * 1000 / TICK_MS
+START_UP_LAG = TICK_MS / 1000  # each follower moves off one step after the vehicle ahead
+
+COLUMNS = [
+    ('plan', 'Greens s', 16, ''),
+    ('offset', 'Offset s', 9, '.1f'),
+    ('cycle', 'Cycle s', 8, '.1f'),
+    ('throughput', 'Veh/min', 8, '.1f'),
+    ('mean_delay', 'Delay s', 8, '.2f'),
+    ('max_queue', 'Max queue', 10, '.1f'),
+]
+
+VALIDATE_COLUMNS = [
+    ('plan', 'Greens s', 16, ''),
+    ('rank', 'CTM rank', 9, 'd'),
+    ('mean_delay', 'CTM delay s', 12, '.2f'),
+    ('mean_wait', 'Tick wait s', 12, '.2f'),
+    ('throughput', 'CTM veh/min', 12, '.1f'),
+    ('tick_throughput', 'Tick veh/min', 13, '.1f'),
+    ('tick_rank', 'Tick rank', 10, 'd'),
+]
+
+
+def lane_parameters(mix):
+    """Free speed (px/s), saturation flow (veh/s) and jam density (veh/px) of a lane with class mix `mix`"""
+    free_speed = 1 / (mix @ (1 / CLASS_SPEEDS_PER_S))
+    spacing = mix @ (CLASS_LENGTHS + gap)
+    # A follower in a discharging queue covers the leader's length plus the gap
+    # at the slower of the two speeds, one step after the leader
+    pair_speed = np.minimum.outer(CLASS_SPEEDS_PER_S, CLASS_SPEEDS_PER_S)
+    headway = mix @ (((CLASS_LENGTHS + gap)[:, None] / pair_speed) @ mix) + START_UP_LAG
+    return free_speed, 1 / headway, 1 / spacing
+
+
+def all_red_seconds(yellow=2.0, clearance=2.0):
+    """All-red time the tick engine holds after yellow: until the slowest long vehicle has left the box"""
+    box = (BOX_EXIT_DISTANCE - STOP_LINE_DISTANCE).max()
+    crossing = ((box + CLASS_LENGTHS) / CLASS_SPEEDS_PER_S).max()
+    return min(clearance, max(0.0, crossing - yellow))
+
+
+class CellTransmissionModel:
+    """Lanes of one junction, or of a corridor of junctions, as cell contents; candidate plans on the last axis"""
+
+    def __init__(self, junctions=1, spacing=500, step_ms=50, interval_ms=750,
+                 direction_weights=(400, 400, 100, 100), yellow=2.0, clearance=2.0):
+        self.junctions = junctions
+        self.yellow = yellow
+        self.all_red = all_red_seconds(yellow, clearance)
+        links = [(j, d, lane) for j in range(junctions) for d in range(noOfSignals) for lane in range(noOfLanes)]
+        index = {link: i for i, link in enumerate(links)}
+        self.junction = np.array([j for j, _, _ in links])
+        self.direction = np.array([d for _, d, _ in links])
+        lanes = np.array([lane for _, _, lane in links])
+
+        # Eastbound (direction 0) traffic moves on to the next junction, westbound (2) to the previous one
+        self.upstream = np.full(len(links), -1)
+        self.downstream = np.full(len(links), -1)
+        for (j, d, lane), i in index.items():
+            following = {0: (j + 1, d, lane), 2: (j - 1, d, lane)}.get(d)
+            if following in index:
+                self.downstream[i] = index[following]
+                self.upstream[index[following]] = i
+        self.source = self.upstream < 0
+        length = np.where(self.source, STOP_LINE_DISTANCE[self.direction], spacing)
+
+        parameters = np.array([lane_parameters(LANE_MIX[lane]) for lane in lanes])
+        self.free_speed, self.capacity, self.jam_density = parameters.T
+        critical_density = self.capacity / self.free_speed
+        self.wave_speed = self.capacity / (self.jam_density - critical_density)
+
+        # Courant condition: neither vehicles nor the start-up wave may skip a cell in one step,
+        # so each lane gets the most cells that are still long enough for the step
+        self.dt = step_ms / 1000
+        cells = np.maximum(1, np.floor(length / (np.maximum(self.free_speed, self.wave_speed) * self.dt))).astype(int)
+        self.cells = int(cells.max())
+        self.first = self.cells - cells  # lanes are right-aligned on the stop line; cells before first stay empty
+        self.dx = length / cells
+        self.storage = self.jam_density * self.dx
+
+        weights = np.array(direction_weights, dtype=np.float64)
+        rate = 1000 / interval_ms * weights[self.direction] / weights.sum() * LANE_SHARES[lanes]
+        self.arrival_rate = np.where(self.source, rate, 0.0)
+
+    def signal_timing(self, greens, offsets):
+        """Per lane and plan: cycle length, green start within the cycle, green end and start shift"""
+        lost = self.yellow + self.all_red
+        cycle = greens.sum(axis=1) + noOfSignals * lost
+        starts = np.cumsum(greens + lost, axis=1) - (greens + lost)
+        start = starts.T[self.direction]
+        return cycle, start, start + greens.T[self.direction], self.junction[:, None] * offsets
+
+    def evaluate(self, greens, offsets=None, seconds=3600):
+        """Advance every plan (one row of greens, in seconds per direction) and return its measures"""
+        greens = np.asarray(greens, dtype=np.float64)
+        plans = len(greens)
+        offsets = np.zeros(plans) if offsets is None else np.asarray(offsets, dtype=np.float64)
+        cycle, green_start, green_end, shift = self.signal_timing(greens, offsets)
+        lanes = len(self.first)
+        dt = self.dt
+
+        # Cells of all lanes on one axis, plans on the last one, so a lane's cells are contiguous rows.
+        # Single precision halves the memory traffic and leaves the rankings unchanged
+        def per_cell(values):
+            return np.repeat(values, self.cells)[:, None].astype(np.float32)
+        rows = np.arange(lanes) * self.cells
+        first, last = rows + self.first, rows + self.cells - 1
+        speed_over_dx = per_cell(self.free_speed / self.dx)
+        wave_over_dx = per_cell(self.wave_speed / self.dx)
+        capacity = per_cell(self.capacity)
+        storage = per_cell(self.storage)
+        free_flow = per_cell(self.dx / self.free_speed)
+        lane_capacity = self.capacity[:, None].astype(np.float32)
+        source = self.source[:, None]
+        exits = self.downstream < 0
+        downstream_first = first[np.where(exits, 0, self.downstream)]
+        arrivals = (self.arrival_rate[:, None] * dt).astype(np.float32)
+
+        n = np.zeros((lanes * self.cells, plans), dtype=np.float32)
+        pending = np.zeros((lanes, plans), dtype=np.float32)
+        crossed = np.zeros((lanes, plans))
+        delay = np.zeros(plans)
+        queue_sum = np.zeros((self.junctions, noOfSignals, plans))
+        queue_max = np.zeros((self.junctions, noOfSignals, plans))
+        y = np.zeros_like(n)
+
+        steps = int(round(seconds / dt))
+        for step in range(steps):
+            in_cycle = np.mod(step * dt - shift, cycle)
+            green = (in_cycle >= green_start) & (in_cycle < green_end)
+
+            sending = np.minimum(speed_over_dx * n, capacity)
+            receiving = np.minimum(capacity, wave_over_dx * (storage - n))
+            np.minimum(sending[:-1], receiving[1:], out=y[:-1])
+            discharge = np.minimum(sending[last], lane_capacity * green)
+            if not exits.all():
+                discharge = np.where(exits[:, None], discharge, np.minimum(discharge, receiving[downstream_first]))
+            y[last] = discharge
+
+            pending += arrivals
+            entry = np.minimum(pending / dt, receiving[first])
+            inflow = np.where(source, entry, discharge[self.upstream.clip(0)])
+            pending -= np.where(source, entry, 0) * dt
+
+            # Vehicles that do not cover a cell per free-flow cell time are queued
+            queued = pending + (n - y * free_flow).reshape(lanes, self.cells, plans).sum(axis=1)
+            delay += queued.sum(axis=0) * dt
+            by_approach = queued.reshape(self.junctions, noOfSignals, noOfLanes, plans).sum(axis=2)
+            queue_sum += by_approach
+            np.maximum(queue_max, by_approach, out=queue_max)
+
+            y *= dt
+            n -= y
+            y[last] = 0  # discharged vehicles leave the lane
+            n[1:] += y[:-1]
+            n[first] += inflow * dt
+            crossed += discharge * dt
+
+        arrived = self.arrival_rate.sum() * steps * dt
+        return {
+            'cycle': cycle,
+            'crossed': crossed.sum(axis=0),
+            'throughput': (crossed * exits[:, None]).sum(axis=0) / seconds * 60,
+            'mean_delay': delay / arrived,
+            'mean_queue': np.moveaxis(queue_sum, -1, 0) / max(steps, 1),
+            'max_queue': np.moveaxis(queue_max, -1, 0),
+        }
+
+
+def candidate_plans(greens=None, count=None, min_green=2, max_green=30, offsets=(0,), seed=0):
+    """Rows of per-direction greens and an offset for each: every combination of `greens`, or `count` random ones"""
+    if greens:
+        rows = np.array(list(itertools.product(greens, repeat=noOfSignals)), dtype=np.float64)
+    else:
+        rows = np.random.default_rng(seed).integers(min_green, max_green + 1, (count, noOfSignals)).astype(float)
+    return np.repeat(rows, len(offsets), axis=0), np.tile(np.asarray(offsets, dtype=np.float64), len(rows))
+
+
+def plan_label(greens):
+    return '/'.join(f"{g:g}" for g in greens)
+
+
+def validate_plan(greens, seconds, seed, interval_ms):
+    """Run one plan in the tick engine; executed in a worker process"""
+    return run_controller(TimingPlanController([g * 1000 for g in greens]), seconds, seed, interval_ms)
+
+
+def validate(rows, seconds, seed, interval_ms, workers=None):
+    """Tick-engine summaries for the given result rows, in the same order"""
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(validate_plan, row['greens'], seconds, seed, interval_ms) for row in rows]
+        return [future.result() for future in futures]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Screen fixed-time signal plans with a cell-transmission model")
+    parser.add_argument('--greens', type=float, nargs='+', help="green times (s) to combine across the four directions")
+    parser.add_argument('--random', type=int, default=1000, help="random plans to draw when --greens is not given")
+    parser.add_argument('--min-green', type=int, default=2)
+    parser.add_argument('--max-green', type=int, default=30)
+    parser.add_argument('--hours', type=float, default=1.0, help="simulated hours per plan")
+    parser.add_argument('--interval', type=int, default=750, help="ms between generated vehicles")
+    parser.add_argument('--step', type=float, default=50, help="model time step in ms; cells are sized to it")
+    parser.add_argument('--corridor', type=int, default=1, metavar='JUNCTIONS')
+    parser.add_argument('--spacing', type=float, default=500, help="stop line to stop line along the corridor (px)")
+    parser.add_argument('--offsets', type=float, nargs='+', default=[0], help="offsets (s) between corridor junctions")
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--validate', type=int, default=0, metavar='K',
+                        help="run the K best plans in the tick engine and compare")
+    parser.add_argument('--validate-seconds', type=float, default=1800)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    model = CellTransmissionModel(args.corridor, args.spacing, args.step, args.interval)
+    greens, offsets = candidate_plans(args.greens, args.random, args.min_green, args.max_green, args.offsets,
+                                      args.seed)
+    start = time.perf_counter()
+    result = model.evaluate(greens, offsets, args.hours * 3600)
+    elapsed = time.perf_counter() - start
+
+    order = np.argsort(result['mean_delay'], kind='stable')
+    rows = [{'greens': greens[i].tolist(), 'plan': plan_label(greens[i]), 'offset': offsets[i],
+             'cycle': result['cycle'][i], 'throughput': result['throughput'][i],
+             'mean_delay': result['mean_delay'][i], 'max_queue': result['max_queue'][i].max(), 'rank': rank + 1}
+            for rank, i in enumerate(order)]
+    junctions = f"{args.corridor} junctions {args.spacing:g} px apart" if args.corridor > 1 else "one junction"
+    print(f"{len(greens)} plans, {junctions}, {args.hours:g} simulated hours each, "
+          f"{len(model.first)} lanes of up to {model.cells} cells, step {model.dt * 1000:.1f} ms")
+    print(format_table(rows[:args.top], COLUMNS if args.corridor > 1 else
+                       [column for column in COLUMNS if column[0] != 'offset']))
+    print(f"Screened in {elapsed:.1f} s, {len(greens) * args.hours / elapsed:.0f} plan-hours per second")
+
+    if args.validate:
+        if args.corridor > 1:
+            print("The tick engine models a single junction; --validate needs --corridor 1")
+            return
+        checked = rows[:args.validate]
+        start = time.perf_counter()
+        summaries = validate(checked, args.validate_seconds, args.seed, args.interval, args.workers)
+        for row, summary in zip(checked, summaries):
+            row['mean_wait'] = summary['mean_wait']
+            row['tick_throughput'] = summary['throughput']
+        for tick_rank, row in enumerate(sorted(checked, key=lambda row: row['mean_wait'])):
+            row['tick_rank'] = tick_rank + 1
+        print(f"\nTick engine, {args.validate_seconds:g} simulated seconds, seed {args.seed} "
+              f"({time.perf_counter() - start:.1f} s)")
+        print(format_table(checked, VALIDATE_COLUMNS))
+
+
+if __name__ == "__main__":
+    main()
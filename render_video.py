@@ -0,0 +1,186 @@
+# Offline video rendering of recorded headless runs.
+#
+#   python benchmark_controllers.py --controllers knn --seconds 300 --record logs
+#   python render_video.py logs/knn.tlog knn.mp4 --seconds 120 --workers 4
+#   python render_video.py logs/knn.tlog knn.mp4 --speed 4 --scale 0.5   # 4x time-lapse at half size
+#
+# An event log holds the spawns and controller decisions of a run, and
+# replaying them through the headless engine reproduces every vehicle position
+# and signal state tick by tick. The video's frames are split into one chunk
+# per worker process. Each worker replays the log up to its first frame without
+# drawing, then draws its frames with the simulation_Dy.py background, vehicle
+# and signal sprites on SDL's dummy driver, so no desktop session is needed.
+# Raw RGB frames are piped into ffmpeg, one encoder per chunk, and the chunks
+# are joined without re-encoding. Without ffmpeg on the PATH the raw chunks are
+# joined into one .rgb file and the command to encode it is printed.
+import argparse
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import numpy as np
+import pygame
+from event_log import EventLog, ReplayController, ReplayDemand
+from simulation_headless import (HeadlessSimulation, TICK_MS, RED, YELLOW, GREEN, directionNumbers, vehicleTypes,
+                                 laneCoods, noOfSignals)
+
+SCREEN_SIZE = (1400, 800)
+BACKGROUND = 'images/mod_int.png'
+SIGNAL_IMAGES = {RED: 'images/signals/red.png', YELLOW: 'images/signals/yellow.png',
+                 GREEN: 'images/signals/green.png'}
+# Where simulation_Dy.py draws the signals and the crossed counts
+signalCoods = [(530, 230), (810, 230), (810, 570), (530, 570)]
+vehicleCountCoods = [(480, 210), (880, 210), (880, 550), (480, 550)]
+
+
+class FrameRenderer:
+    """Draws the headless engine's state with the simulation_Dy.py sprites"""
+
+    def __init__(self, scale=1.0):
+        pygame.init()
+        pygame.display.set_mode((1, 1))  # convert() needs a display, even a dummy one
+        self.screen = pygame.Surface(SCREEN_SIZE)
+        self.size = (int(SCREEN_SIZE[0] * scale), int(SCREEN_SIZE[1] * scale))
+        self.output = pygame.Surface(self.size) if scale != 1.0 else self.screen
+        self.background = pygame.image.load(BACKGROUND).convert()
+        self.signals = {state: pygame.image.load(path).convert_alpha() for state, path in SIGNAL_IMAGES.items()}
+        self.sprites = {(d, c): pygame.image.load(f"images/{name}/{vehicleTypes[c]}.png").convert_alpha()
+                        for d, name in directionNumbers.items() for c in vehicleTypes}
+        self.font = pygame.font.Font(None, 30)
+
+    def vehicle_positions(self, simulation):
+        """Top-left screen corner of every vehicle, from its distance along the approach"""
+        direction, pos, length = simulation.direction, simulation.pos, simulation.length
+        across = np.array([laneCoods[directionNumbers[d]] for d in range(noOfSignals)])[direction, simulation.lane]
+        along = np.select([direction == 0, direction == 1, direction == 2],
+                          [pos - length, pos - length, SCREEN_SIZE[0] - pos], SCREEN_SIZE[1] - pos)
+        horizontal = (direction == 0) | (direction == 2)
+        return np.where(horizontal, along, across), np.where(horizontal, across, along)
+
+    def draw(self, simulation):
+        screen = self.screen
+        screen.blit(self.background, (0, 0))
+        x, y = self.vehicle_positions(simulation)
+        screen.blits([(self.sprites[d, c], (px, py)) for d, c, px, py
+                      in zip(simulation.direction.tolist(), simulation.vclass.tolist(), x.tolist(), y.tolist())],
+                     doreturn=False)
+        for i in range(noOfSignals):
+            screen.blit(self.signals[simulation.states[i]], signalCoods[i])
+            count = self.font.render(str(int(simulation.crossed_counts[i].sum())), True, (0, 0, 0), (255, 255, 255))
+            screen.blit(count, vehicleCountCoods[i])
+        elapsed = self.font.render(f"Time Elapsed: {simulation.time_ms / 1000:.0f}", True, (0, 0, 0), (255, 255, 255))
+        screen.blit(elapsed, (1100, 50))
+        if self.output is not screen:
+            pygame.transform.smoothscale(screen, self.size, self.output)
+        return pygame.image.tobytes(self.output, 'RGB')
+
+
+def frame_tick(frame, fps, speed):
+    """Physics tick shown in a frame"""
+    return int(round(frame * speed * 1000 / fps / TICK_MS))
+
+
+def ffmpeg_input(size, fps):
+    return ['-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f"{size[0]}x{size[1]}", '-r', f"{fps:g}"]
+
+
+def render_chunk(log_path, first, last, fps, speed, scale, chunk_path, encode):
+    """Worker: render frames [first, last) to chunk_path, encoded when `encode` is set, raw RGB otherwise"""
+    log = EventLog(log_path)
+    simulation = HeadlessSimulation(ReplayController(log), demand=ReplayDemand(log))
+    renderer = FrameRenderer(scale)
+    start = time.perf_counter()
+    while simulation.tick < frame_tick(first, fps, speed):
+        simulation.step()
+    replay_seconds = time.perf_counter() - start
+
+    if encode:
+        encoder = subprocess.Popen(['ffmpeg', '-y', '-loglevel', 'error'] + ffmpeg_input(renderer.size, fps)
+                                   + ['-i', '-', '-c:v', 'libx264', '-pix_fmt', 'yuv420p', chunk_path],
+                                   stdin=subprocess.PIPE)
+        out = encoder.stdin
+    else:
+        out = open(chunk_path, 'wb')
+    with out:
+        for frame in range(first, last):
+            while simulation.tick < frame_tick(frame, fps, speed):
+                simulation.step()
+            out.write(renderer.draw(simulation))
+    if encode and encoder.wait() != 0:
+        raise RuntimeError(f"ffmpeg failed on {chunk_path}")
+    return {'frames': last - first, 'replay_seconds': replay_seconds,
+            'render_seconds': time.perf_counter() - start - replay_seconds}
+
+
+def render_video(log_path, output, seconds=None, fps=30, speed=1.0, scale=1.0, workers=None):
+    """Render a recorded run to `output`, splitting the frames across worker processes"""
+    log = EventLog(log_path)
+    if seconds is None:
+        seconds = log.metadata.get('seconds', (log.last_step + 1) * TICK_MS / 1000)
+    frames = int(seconds / speed * fps)
+    workers = min(workers or os.cpu_count(), frames)
+    bounds = np.linspace(0, frames, workers + 1).astype(int)
+    encode = shutil.which('ffmpeg') is not None
+    size = (int(SCREEN_SIZE[0] * scale), int(SCREEN_SIZE[1] * scale))
+
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(output))) as workdir:
+        chunks = [os.path.join(workdir, f"chunk_{i:03d}.{'mp4' if encode else 'rgb'}") for i in range(workers)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(render_chunk, log_path, bounds[i], bounds[i + 1], fps, speed, scale, chunks[i],
+                                   encode) for i in range(workers)]
+            stats = [future.result() for future in futures]
+
+        if encode:
+            listing = os.path.join(workdir, 'chunks.txt')
+            with open(listing, 'w') as f:
+                f.writelines(f"file '{chunk}'\n" for chunk in chunks)
+            subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', listing,
+                            '-c', 'copy', output], check=True)
+        else:
+            output = os.path.splitext(output)[0] + '.rgb'
+            with open(output, 'wb') as joined:
+                for chunk in chunks:
+                    with open(chunk, 'rb') as f:
+                        shutil.copyfileobj(f, joined)
+            print("ffmpeg not found; encode the raw frames with:")
+            print(' '.join(['ffmpeg'] + ffmpeg_input(size, fps)
+                           + ['-i', output, '-pix_fmt', 'yuv420p', os.path.splitext(output)[0] + '.mp4']))
+
+    wall = time.perf_counter() - start
+    return {'output': output, 'frames': frames, 'workers': workers, 'video_seconds': frames / fps,
+            'wall_seconds': wall, 'replay_seconds': max(s['replay_seconds'] for s in stats),
+            'render_seconds': sum(s['render_seconds'] for s in stats)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render a recorded headless run to video, in parallel")
+    parser.add_argument('log', help="event log written by benchmark_controllers.py --record")
+    parser.add_argument('output', help="video file (.mp4); raw .rgb frames when ffmpeg is missing")
+    parser.add_argument('--seconds', type=float, help="simulated seconds to render (default: the whole log)")
+    parser.add_argument('--fps', type=float, default=30)
+    parser.add_argument('--speed', type=float, default=1.0, help="simulated seconds per video second")
+    parser.add_argument('--scale', type=float, default=1.0, help="frame size relative to 1400x800")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: all cores)")
+    args = parser.parse_args()
+
+    log = EventLog(args.log)
+    if log.metadata.get('source') != 'headless':
+        print(f"note: {args.log} was recorded by {log.metadata.get('source')}; "
+              f"its spawns are replayed in the headless engine's junction")
+    result = render_video(args.log, args.output, args.seconds, args.fps, args.speed, args.scale, args.workers)
+    print(f"{result['output']}: {result['frames']} frames ({result['video_seconds']:.1f} s of video) "
+          f"in {result['wall_seconds']:.1f} s with {result['workers']} workers, "
+          f"{result['video_seconds'] / result['wall_seconds']:.2f}x real time")
+    print(f"  longest replay to a chunk start {result['replay_seconds']:.1f} s, "
+          f"drawing and encoding {result['render_seconds']:.1f} s across workers")
+
+
+if __name__ == "__main__":
+    main()
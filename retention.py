@@ -0,0 +1,113 @@
+# Sample-retention policies that cap how many training rows a TrafficDataCollector keeps.
+#
+# A policy is asked where each new row should go: appended (None), written over
+# an existing slot (its index) or dropped (DROP). Every policy except KeepAll
+# holds the collector at a fixed capacity, so training cost and model memory
+# stop growing however long the simulation runs.
+import random
+from collections import defaultdict, deque
+
+DROP = -1
+
+
+class KeepAll:
+    """Keep every row (the original behaviour)"""
+    name = "all"
+
+    def place(self, row, stored):
+        return None
+
+
+class ReservoirRetention:
+    """Uniform sample of everything seen so far (Vitter's algorithm R)"""
+    name = "reservoir"
+
+    def __init__(self, capacity=500, seed=0):
+        self.capacity = capacity
+        self.rng = random.Random(seed)
+        self.seen = 0
+
+    def place(self, row, stored):
+        self.seen += 1
+        if stored < self.capacity:
+            return None
+        slot = self.rng.randrange(self.seen)
+        return slot if slot < self.capacity else DROP
+
+
+class RecencyRetention:
+    """Biased reservoir: every new row is kept and evicts a random old one
+
+    A row survives each later insertion with probability 1 - 1/capacity, so
+    its chance of still being kept decays exponentially with age and the set
+    follows the current traffic pattern.
+    """
+    name = "recency"
+
+    def __init__(self, capacity=500, seed=0):
+        self.capacity = capacity
+        self.rng = random.Random(seed)
+
+    def place(self, row, stored):
+        if stored < self.capacity:
+            return None
+        return self.rng.randrange(self.capacity)
+
+
+class DensityCoresetRetention:
+    """Keep rare states, thin out crowded ones
+
+    Rows are bucketed on a coarse grid (counts in steps of count_cell vehicles,
+    waits in steps of wait_cell frames, light as is). Once full, a new row
+    replaces the oldest row of the most crowded cell, so near-duplicate rush
+    hour states share a few slots and one-off states are never evicted by them.
+    """
+    name = "coreset"
+
+    def __init__(self, capacity=500, count_cell=2, wait_cell=60):
+        self.capacity = capacity
+        self.count_cell = count_cell
+        self.wait_cell = wait_cell
+        self.cells = defaultdict(deque)  # cell -> slots in insertion order
+
+    def cell(self, row):
+        counts = tuple(int(c // self.count_cell) for c in row[:4])
+        waits = tuple(int(w // self.wait_cell) for w in row[4:8])
+        return counts + waits + tuple(row[8:])
+
+    def place(self, row, stored):
+        cell = self.cell(row)
+        if stored < self.capacity:
+            self.cells[cell].append(stored)
+            return None
+        crowded = max(self.cells, key=lambda c: len(self.cells[c]))
+        if cell in self.cells and len(self.cells[cell]) == len(self.cells[crowded]):
+            crowded = cell  # ties go to the new row's own cell
+        slot = self.cells[crowded].popleft()
+        if not self.cells[crowded]:
+            del self.cells[crowded]
+        self.cells[cell].append(slot)
+        return slot
+
+
+RETENTION_POLICIES = {
+    'all': KeepAll,
+    'reservoir': ReservoirRetention,
+    'recency': RecencyRetention,
+    'coreset': DensityCoresetRetention,
+}
+
+
+def make_retention(name='all', capacity=500, seed=0):
+    """Build a policy by its command-line name"""
+    if name == 'all':
+        return KeepAll()
+    if name == 'coreset':
+        return DensityCoresetRetention(capacity)
+    return RETENTION_POLICIES[name](capacity, seed)
+
+
+def add_arguments(parser):
+    parser.add_argument('--retention', choices=list(RETENTION_POLICIES), default='all',
+                        help="how training samples are kept once --max-samples is reached")
+    parser.add_argument('--max-samples', type=int, default=500, help="training set size for --retention")
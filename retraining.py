@@ -0,0 +1,87 @@
+# Retraining schedules for the learning controllers.
+#
+# The controllers used to refit after every cycle. RetrainScheduler refits only
+# when the model has stopped describing the traffic: the outcomes it predicted
+# are off in one direction, or the states coming in have moved away from those
+# it was trained on. A refit also happens once enough new samples have piled up.
+import numpy as np
+
+
+class AlwaysRetrain:
+    """Refit after every cycle (the original behaviour)"""
+
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+        self.retrains = []  # (samples seen, reason) per refit
+        self.samples_seen = 0
+
+    def observe(self, row, outcome, prediction):
+        self.samples_seen += 1
+
+    def reason(self):
+        return "every cycle"
+
+    def retrained(self, features, labels, reason):
+        self.retrains.append((self.samples_seen, reason))
+
+
+class RetrainScheduler(AlwaysRetrain):
+    """Refit on residual or feature drift, or after max_new_samples new rows
+
+    Drift is measured over the rows seen since the last refit, in standard
+    deviations of the training set: the mean residual (observed outcome minus
+    prediction) against the spread of the labels, and each feature's mean
+    against that feature's spread. Nothing is tested before min_window rows.
+    """
+
+    def __init__(self, residual_threshold=0.5, feature_threshold=1.0, min_window=5, max_new_samples=50,
+                 feature_names=None, verbose=True):
+        super().__init__(verbose)
+        self.residual_threshold = residual_threshold
+        self.feature_threshold = feature_threshold
+        self.min_window = min_window
+        self.max_new_samples = max_new_samples
+        self.feature_names = feature_names
+        self.residuals = []
+        self.recent_features = []
+        self.feature_mean = None
+        self.feature_std = None
+        self.label_std = None
+
+    def observe(self, row, outcome, prediction):
+        super().observe(row, outcome, prediction)
+        self.recent_features.append(row)
+        if prediction is not None:
+            self.residuals.append(outcome - prediction)
+
+    def reason(self):
+        """Why the model should be refitted now, or None to keep it"""
+        if self.label_std is None:
+            return "first training"
+        new = len(self.recent_features)
+        if new >= self.max_new_samples:
+            return f"{new} new samples"
+        if new < self.min_window:
+            return None
+        if self.residuals:
+            bias = np.mean(self.residuals) / self.label_std
+            if abs(bias) > self.residual_threshold:
+                return f"residual drift: outcomes {bias:+.2f} sd from predictions over {len(self.residuals)} cycles"
+        shift = np.abs(np.mean(self.recent_features, axis=0) - self.feature_mean) / self.feature_std
+        worst = int(np.argmax(shift))
+        if shift[worst] > self.feature_threshold:
+            name = self.feature_names[worst] if self.feature_names else f"feature {worst}"
+            return f"feature drift: {name} moved {shift[worst]:.2f} sd over {new} cycles"
+        return None
+
+    def retrained(self, features, labels, reason):
+        super().retrained(features, labels, reason)
+        X = np.asarray(features, dtype=np.float64)
+        self.feature_mean = np.nanmean(X, axis=0)
+        std = np.nanstd(X, axis=0)
+        self.feature_std = np.where(std > 0, std, 1.0)
+        self.label_std = float(np.std(labels)) or 1.0
+        self.residuals = []
+        self.recent_features = []
+        if self.verbose:
+            print(f"Retraining after {self.samples_seen} cycles: {reason}")
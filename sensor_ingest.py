@@ -0,0 +1,449 @@
+# Sensor ingestion: run the signal controllers on external detector feeds.
+#
+#   python sensor_ingest.py record feed.jsonl --seconds 600          # a detector feed from a headless run
+#   python sensor_ingest.py serve --controller knn                   # UDP and TCP on 127.0.0.1:9870
+#   python sensor_ingest.py replay feed.jsonl --speed 50 --reorder 0.1
+#
+# Detectors send batches of readings as JSON, one batch per UDP datagram or
+# per line on a TCP connection:
+#   {"sent": 1760000000.123, "readings": [{"t": 12.5, "approach": "north", "sensor": "north-0",
+#                                           "count": 7, "occupancy": 0.42, "wait": 3.1}, ...]}
+# t is the time of the reading on the feed's clock, in seconds. sent is the
+# sender's wall clock and is only used to measure ingest latency. count is the
+# number of vehicles queued over the sensor's lane and occupancy the fraction of
+# the loop they cover. wait is the mean wait of those vehicles in seconds, for
+# detectors that can tell; the wait features read 0 for approaches without it.
+#
+# Counts and occupancy are levels, not increments, so merging keeps the newest
+# reading of every sensor. A packet that arrives after a newer one from the same
+# sensor is superseded and skipped, and a reading more than `max_age` seconds
+# behind the newest one seen is late and dropped, so the merged state does not
+# depend on arrival order. A reading more than `max_skew` seconds ahead of the
+# newest one is dropped too: one bad timestamp (a sender in milliseconds, say)
+# would otherwise move the clock so far on that every later reading was late.
+# Readings with a non-finite time, a negative or fractional count, an approach
+# that is neither a name nor an index, occupancy outside [0, 1] or a negative
+# wait are malformed. The approach totals come out in the state layout of
+# HeadlessSimulation.observe(), and every controller in controllers.py runs on
+# them unchanged. Phases are timed by the feed's clock, so a feed replayed at
+# 50x real time is also controlled at 50x.
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+from collections import deque
+import numpy as np
+from controllers import DIRECTION_NAMES, density_efficiency
+from simulation_headless import HeadlessSimulation, Demand, TICK_MS, STOP_DISTANCE, noOfSignals, noOfLanes
+
+DEFAULT_PORT = 9870
+DETECTOR_LENGTH = 100  # pixels of road before the stop line a recorded loop covers
+TCP_LINE_LIMIT = 1 << 20
+
+
+def parse_approach(value):
+    """Approach index from a name ('north') or a number"""
+    if isinstance(value, bool) or not isinstance(value, (str, int)):
+        raise TypeError(f"approach must be a name or an index, not {value!r}")
+    approach = DIRECTION_NAMES.index(value) if isinstance(value, str) else value
+    if not 0 <= approach < noOfSignals:
+        raise ValueError(f"no approach {value}")
+    return approach
+
+
+def parse_number(value, name, low=0.0, high=math.inf):
+    """Finite number in [low, high]; raises TypeError or ValueError otherwise"""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise TypeError(f"{name} must be a number, not {value!r}")
+    if not math.isfinite(value) or not low <= value <= high:
+        raise ValueError(f"{name} {value} out of range")
+    return value
+
+
+class SensorState:
+    """Newest reading of every sensor, merged into per-approach totals"""
+
+    def __init__(self, max_age=5.0, max_skew=60.0):
+        self.max_age = max_age  # seconds behind the newest reading before a reading is late
+        self.max_skew = max_skew  # seconds ahead of the newest reading before a reading is dropped
+        self.readings = {}  # (approach, sensor) -> (t, count, occupancy, wait)
+        self.clock = 0.0  # newest reading time seen, on the feed's clock
+        self.applied = 0
+        self.superseded = 0
+        self.late = 0
+        self.ahead = 0
+
+    def apply(self, reading):
+        """Merge one reading; raises KeyError, ValueError or TypeError on a malformed one"""
+        t = float(parse_number(reading['t'], 't', -math.inf))
+        key = (parse_approach(reading['approach']), str(reading.get('sensor', '')))
+        count = parse_number(reading['count'], 'count')
+        if count != int(count):
+            raise ValueError(f"count {count} is not a whole number")
+        count = int(count)
+        occupancy = float(parse_number(reading.get('occupancy', 0.0), 'occupancy', 0.0, 1.0))
+        wait = reading.get('wait')
+        wait = None if wait is None else float(parse_number(wait, 'wait'))
+        if t < self.clock - self.max_age:
+            self.late += 1
+            return
+        # The first reading sets the clock, wherever the feed's clock starts
+        if self.applied and t > self.clock + self.max_skew:
+            self.ahead += 1
+            return
+        current = self.readings.get(key)
+        if current is not None and current[0] >= t:
+            self.superseded += 1
+            return
+        self.readings[key] = (t, count, occupancy, wait)
+        self.clock = max(self.clock, t)
+        self.applied += 1
+
+    def stale(self):
+        """Sensors whose newest reading is more than max_age behind the feed"""
+        return [key for key, (t, *_) in self.readings.items() if t < self.clock - self.max_age]
+
+    def observe(self, current_light=None):
+        """Traffic state in the dict layout the controllers consume"""
+        counts = [0] * noOfSignals
+        occupancy = [[] for _ in range(noOfSignals)]
+        wait_sums = [0.0] * noOfSignals
+        wait_counts = [0] * noOfSignals
+        for (approach, _), (_, count, occ, wait) in self.readings.items():
+            counts[approach] += count
+            occupancy[approach].append(occ)
+            if wait is not None:
+                wait_sums[approach] += wait * count
+                wait_counts[approach] += count
+        # controllers were trained on waits in simulation steps
+        waits = [wait_sums[d] / wait_counts[d] * 1000 / TICK_MS if wait_counts[d] else 0 for d in range(noOfSignals)]
+        return {
+            'north_count': counts[0],
+            'east_count': counts[1],
+            'south_count': counts[2],
+            'west_count': counts[3],
+            'north_wait': waits[0],
+            'east_wait': waits[1],
+            'south_wait': waits[2],
+            'west_wait': waits[3],
+            'current_light': current_light,
+            'density': counts,
+            'occupancy': [sum(values) / len(values) if values else 0.0 for values in occupancy],
+            # detectors don't classify vehicles; the setTime formula counts them all as cars
+            'class_counts': [{'car': counts[d]} for d in range(noOfSignals)],
+            'time': self.clock * 1000,
+        }
+
+
+class IngestStats:
+    def __init__(self, window=10000):
+        self.batches = 0
+        self.readings = 0
+        self.bytes = 0
+        self.malformed_batches = 0
+        self.malformed_readings = 0
+        self.latencies = deque(maxlen=window)  # ms from send to merge, for the last `window` batches
+        self.first = None  # perf_counter() at the first and the latest batch
+        self.last = None
+
+    def record(self, nbytes, readings, sent):
+        self.last = time.perf_counter()
+        if self.first is None:
+            self.first = self.last
+        self.batches += 1
+        self.readings += readings
+        self.bytes += nbytes
+        if isinstance(sent, (int, float)):
+            self.latencies.append((time.time() - sent) * 1000)
+
+    def readings_per_second(self):
+        """Ingest rate between the first and the latest batch"""
+        elapsed = self.last - self.first if self.first is not None else 0
+        return self.readings / elapsed if elapsed > 0 else 0.0
+
+    def report(self, state):
+        lines = [f"Ingest: {self.batches} batches, {self.readings} readings ({self.readings_per_second():.0f}/s, "
+                 f"{self.bytes / 1024:.0f} KB), malformed {self.malformed_batches} batches "
+                 f"+ {self.malformed_readings} readings",
+                 f"  merged {state.applied}, superseded {state.superseded}, late {state.late}, "
+                 f"ahead {state.ahead}; "
+                 f"{len(state.readings)} sensors, {len(state.stale())} stale; feed clock {state.clock:.1f} s"]
+        if self.latencies:
+            latencies = np.fromiter(self.latencies, dtype=np.float64)
+            lines.append(f"  latency p50 {np.percentile(latencies, 50):.2f} ms, "
+                         f"p95 {np.percentile(latencies, 95):.2f} ms, max {latencies.max():.2f} ms")
+        return '\n'.join(lines)
+
+
+class _DatagramProtocol(asyncio.DatagramProtocol):
+    def __init__(self, ingest):
+        self.ingest = ingest
+
+    def datagram_received(self, data, addr):
+        self.ingest.handle_batch(data)
+
+
+class SensorIngest:
+    """UDP and TCP listeners on the same port feeding a SensorState"""
+
+    def __init__(self, state=None, host='127.0.0.1', port=DEFAULT_PORT):
+        self.state = state if state is not None else SensorState()
+        self.stats = IngestStats()
+        self.host = host
+        self.port = port
+        self.udp = None
+        self.tcp = None
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self.udp, _ = await loop.create_datagram_endpoint(lambda: _DatagramProtocol(self),
+                                                          local_addr=(self.host, self.port))
+        self.tcp = await asyncio.start_server(self.handle_stream, self.host, self.port, limit=TCP_LINE_LIMIT)
+
+    def close(self):
+        if self.udp is not None:
+            self.udp.close()
+        if self.tcp is not None:
+            self.tcp.close()
+
+    def handle_batch(self, data):
+        try:
+            batch = json.loads(data)
+            readings = batch['readings']
+            if not isinstance(readings, list):
+                raise TypeError("readings must be a list")
+        except (ValueError, KeyError, TypeError):
+            self.stats.malformed_batches += 1
+            return
+        for reading in readings:
+            try:
+                self.state.apply(reading)
+            except (KeyError, ValueError, TypeError):
+                self.stats.malformed_readings += 1
+        self.stats.record(len(data), len(readings), batch.get('sent'))
+
+    async def handle_stream(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.strip():
+                    self.handle_batch(line)
+        except (ConnectionError, ValueError):  # ValueError: a line over TCP_LINE_LIMIT
+            pass
+        finally:
+            writer.close()
+
+
+class SensorSignals:
+    """A controller's phase cycle driven by the merged sensor state and timed by the feed's clock"""
+
+    def __init__(self, controller, state, yellow_duration=2000, verbose=True):
+        self.controller = controller
+        self.state = state
+        self.yellow_duration = yellow_duration
+        self.verbose = verbose
+        self.current_green = None
+        self.phase_end = 0.0  # feed time in ms when the current green and yellow are over
+        self.green_start_count = 0
+        self.last_time = None
+        self.cycles = 0
+        self.decision_times = []
+
+    def update(self):
+        """Catch up with the feed: observe new readings and switch phase when one is due"""
+        now = self.state.clock * 1000
+        if now == self.last_time:
+            return
+        self.last_time = now
+        state = self.state.observe(self.current_green)
+        if self.controller.observe_every_step:
+            self.controller.observe(state)
+        if now < self.phase_end:
+            return
+        counts = state['density']
+        if self.current_green is not None:
+            # detectors see queues, not departures: what left the green approach's queue stands in for cleared
+            cleared = max(0, self.green_start_count - counts[self.current_green])
+            avg_wait = sum(state[f"{name}_wait"] for name in DIRECTION_NAMES) / noOfSignals
+            self.controller.record_outcome(state, cleared, avg_wait, density_efficiency(counts, self.current_green))
+        start = time.perf_counter()
+        next_green, green_duration = self.controller.decide(state)
+        self.decision_times.append(time.perf_counter() - start)
+        self.current_green = next_green
+        self.green_start_count = counts[next_green]
+        self.phase_end = now + green_duration + self.yellow_duration
+        self.cycles += 1
+        if self.verbose:
+            print(f"t={now / 1000:.1f}s green {DIRECTION_NAMES[next_green]} for {green_duration / 1000:.1f}s, "
+                  f"queues {counts}")
+
+
+def lane_readings(simulation):
+    """One reading per lane, as a loop detector at the stop line would report it"""
+    waiting = ~simulation.crossed
+    key = simulation.direction * noOfLanes + simulation.lane
+    sensors = noOfSignals * noOfLanes
+    counts = np.bincount(key[waiting], minlength=sensors)
+    wait_sums = np.bincount(key[waiting], weights=simulation.wait_time[waiting], minlength=sensors)
+    for k, queue in enumerate(simulation.pending):
+        counts[k] += len(queue)
+        wait_sums[k] += sum(simulation.tick - spawn_tick for *_, spawn_tick in queue)
+    stop = STOP_DISTANCE[simulation.direction]
+    covered = np.minimum(simulation.pos, stop) - np.maximum(simulation.pos - simulation.length, stop - DETECTOR_LENGTH)
+    occupancy = np.bincount(key, weights=np.clip(covered, 0, None), minlength=sensors) / DETECTOR_LENGTH
+    t = round(simulation.time_ms / 1000, 3)
+    return [{'t': t, 'approach': DIRECTION_NAMES[k // noOfLanes],
+             'sensor': f"{DIRECTION_NAMES[k // noOfLanes]}-{k % noOfLanes}", 'count': int(counts[k]), 'occupancy': round(min(1.0, occupancy[k]), 3),
+             'wait': round(wait_sums[k] / counts[k] * TICK_MS / 1000, 2) if counts[k] else 0.0}
+            for k in range(sensors)]
+
+
+def record_feed(path, controller, seconds, seed=0, interval_ms=250):
+    """Write the lane readings of a headless run every interval_ms to a JSON-lines feed"""
+    simulation = HeadlessSimulation(controller, demand=Demand(seed))
+    steps_per_reading = max(1, int(round(interval_ms / TICK_MS)))
+    written = 0
+    with open(path, 'w') as f:
+        for _ in range(int(round(seconds * 1000 / TICK_MS))):
+            simulation.step()
+            if simulation.tick % steps_per_reading == 0:
+                for reading in lane_readings(simulation):
+                    f.write(json.dumps(reading) + '\n')
+                    written += 1
+    return written
+
+
+def load_feed(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+async def replay_feed(readings, host='127.0.0.1', port=DEFAULT_PORT, protocol='udp', speed=10.0, batch_size=50,
+                      reorder=0.0, seed=0):
+    """Push recorded readings to an ingest server at `speed` times real time (0: as fast as possible)
+
+    With `reorder` > 0 that fraction of batches is swapped with the next one,
+    so the server sees packets out of order.
+    """
+    batches = [readings[i:i + batch_size] for i in range(0, len(readings), batch_size)]
+    rng = random.Random(seed)
+    for i in range(len(batches) - 1):
+        if rng.random() < reorder:
+            batches[i], batches[i + 1] = batches[i + 1], batches[i]
+
+    loop = asyncio.get_running_loop()
+    if protocol == 'udp':
+        transport, _ = await loop.create_datagram_endpoint(asyncio.DatagramProtocol, remote_addr=(host, port))
+        writer = None
+    else:
+        _, writer = await asyncio.open_connection(host, port)
+    feed_start = min(reading['t'] for reading in readings) if readings else 0.0
+    start = time.perf_counter()
+    sent_bytes = 0
+    for batch in batches:
+        if speed:
+            delay = (batch[0]['t'] - feed_start) / speed - (time.perf_counter() - start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        payload = json.dumps({'sent': time.time(), 'readings': batch}).encode()
+        sent_bytes += len(payload)
+        if writer is None:
+            transport.sendto(payload)
+            await asyncio.sleep(0)
+        else:
+            writer.write(payload + b'\n')
+            await writer.drain()
+    if writer is None:
+        transport.close()
+    else:
+        writer.close()
+        await writer.wait_closed()
+    elapsed = time.perf_counter() - start
+    return {'batches': len(batches), 'readings': len(readings), 'bytes': sent_bytes, 'seconds': elapsed,
+            'readings_per_second': len(readings) / elapsed if elapsed > 0 else 0.0}
+
+
+async def serve(args):
+    from benchmark_controllers import CONTROLLERS
+    ingest = SensorIngest(SensorState(args.max_age, args.max_skew), args.host, args.port)
+    await ingest.start()
+    signals = None
+    if args.controller != 'none':
+        signals = SensorSignals(CONTROLLERS[args.controller](), ingest.state, verbose=not args.quiet)
+    print(f"Listening for sensor batches on udp and tcp {args.host}:{args.port}")
+    start = time.perf_counter()
+    next_report = start + args.report_every
+    try:
+        while args.duration is None or time.perf_counter() - start < args.duration:
+            await asyncio.sleep(args.poll)
+            if signals is not None:
+                signals.update()
+            if args.report_every and time.perf_counter() >= next_report:
+                print(ingest.stats.report(ingest.state))
+                next_report += args.report_every
+    finally:
+        ingest.close()
+        print(ingest.stats.report(ingest.state))
+        if signals is not None and signals.decision_times:
+            print(f"  {signals.cycles} phases decided, "
+                  f"mean decision {np.mean(signals.decision_times) * 1000:.3f} ms")
+
+
+def main():
+    from benchmark_controllers import CONTROLLERS
+    parser = argparse.ArgumentParser(description="Feed the signal controllers from external detector readings")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    server = commands.add_parser('serve', help="ingest readings over UDP and TCP and run a controller on them")
+    server.add_argument('--host', default='127.0.0.1')
+    server.add_argument('--port', type=int, default=DEFAULT_PORT)
+    server.add_argument('--controller', choices=list(CONTROLLERS) + ['none'], default='fixed')
+    server.add_argument('--max-age', type=float, default=5.0,
+                        help="feed seconds behind the newest reading after which a reading is late")
+    server.add_argument('--max-skew', type=float, default=60.0,
+                        help="feed seconds ahead of the newest reading past which a reading is dropped")
+    server.add_argument('--poll', type=float, default=0.01, help="wall seconds between controller updates")
+    server.add_argument('--report-every', type=float, default=10, help="wall seconds between stats lines (0: off)")
+    server.add_argument('--duration', type=float, help="stop after this many wall seconds")
+    server.add_argument('--quiet', action='store_true', help="don't print every phase decision")
+
+    recorder = commands.add_parser('record', help="write a detector feed from a headless run")
+    recorder.add_argument('feed')
+    recorder.add_argument('--seconds', type=float, default=600, help="simulated seconds")
+    recorder.add_argument('--controller', choices=list(CONTROLLERS), default='fixed')
+    recorder.add_argument('--seed', type=int, default=0)
+    recorder.add_argument('--interval', type=float, default=250, help="milliseconds between readings")
+
+    replayer = commands.add_parser('replay', help="push a recorded feed to a server")
+    replayer.add_argument('feed')
+    replayer.add_argument('--host', default='127.0.0.1')
+    replayer.add_argument('--port', type=int, default=DEFAULT_PORT)
+    replayer.add_argument('--protocol', choices=['udp', 'tcp'], default='udp')
+    replayer.add_argument('--speed', type=float, default=10, help="times real time (0: as fast as possible)")
+    replayer.add_argument('--batch', type=int, default=50, help="readings per message")
+    replayer.add_argument('--reorder', type=float, default=0.0, help="fraction of batches sent out of order")
+    replayer.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        try:
+            asyncio.run(serve(args))
+        except KeyboardInterrupt:
+            pass
+    elif args.command == 'record':
+        written = record_feed(args.feed, CONTROLLERS[args.controller](), args.seconds, args.seed, args.interval)
+        print(f"{args.feed}: {written} readings over {args.seconds:.0f} simulated seconds")
+    else:
+        result = asyncio.run(replay_feed(load_feed(args.feed), args.host, args.port, args.protocol, args.speed,
+                                         args.batch, args.reorder, args.seed))
+        print(f"Sent {result['readings']} readings in {result['batches']} batches "
+              f"({result['bytes'] / 1024:.0f} KB) over {args.protocol} in {result['seconds']:.2f} s, "
+              f"{result['readings_per_second']:.0f} readings/s")
+
+
+if __name__ == "__main__":
+    main()
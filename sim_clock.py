@@ -0,0 +1,111 @@
+# Simulation clock that is independent of wall time.
+#
+# Physics advances in fixed steps of dt_ms simulated milliseconds, control
+# decisions run every few physics steps and rendering happens at its own rate
+# (or never). How many physics steps run per rendered frame depends on the
+# speed multiplier, or in turbo mode on how many fit into one frame's wall-time
+# budget, but the steps themselves never change, so a run produces the same
+# results whatever the render rate or speed. The step is fixed at 1/60 s: the
+# variants move each vehicle by its speed and count waits in whole steps, as
+# their original 60 fps loops did, so another step length would change them.
+import time
+
+# Longest wall-time gap caught up in one frame, so a stalled window doesn't
+# trigger a burst of thousands of steps
+MAX_FRAME_LAG = 0.25
+PHYSICS_HZ = 60  # physics steps per simulated second
+SPEED_STEPS = [0.25, 0.5, 1, 2, 4, 8, 16, 32, 64]
+
+
+class SimulationClock:
+    def __init__(self, control_hz=60, render_hz=60, speed=1.0, turbo=False, duration=None):
+        self.physics_hz = PHYSICS_HZ
+        self.dt_ms = 1000 / PHYSICS_HZ
+        self.control_interval = max(1, round(PHYSICS_HZ / control_hz))  # physics steps per decision
+        self.render_hz = render_hz  # 0 means never render
+        self.speed = speed
+        self.turbo = turbo
+        self.duration = duration  # simulated seconds to run for, None for no limit
+        self.step = 0
+        self.accumulator = 0.0
+        self.last_wall = time.perf_counter()
+        self.next_frame = self.last_wall
+
+    @classmethod
+    def add_arguments(cls, parser):
+        parser.add_argument('--control-hz', type=float, default=60, help="traffic light updates per simulated second")
+        parser.add_argument('--render-hz', type=float, default=60, help="frames drawn per wall second (0: never)")
+        parser.add_argument('--speed', type=float, default=1.0, help="simulated seconds per wall second")
+        parser.add_argument('--turbo', action='store_true', help="run as fast as the CPU allows")
+        parser.add_argument('--duration', type=float, metavar='SECONDS', help="quit after this many simulated seconds")
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(args.control_hz, args.render_hz, args.speed, args.turbo, args.duration)
+
+    def now(self):
+        """Simulated milliseconds since the start, the replacement for pygame.time.get_ticks()"""
+        return self.step * self.dt_ms
+
+    def finished(self):
+        # Counted in steps, so float rounding of now() can't add or drop one
+        return self.duration is not None and self.step >= round(self.duration * self.physics_hz)
+
+    def control_due(self):
+        return self.step % self.control_interval == 0
+
+    def render_due(self):
+        return self.render_hz > 0
+
+    def physics_steps(self):
+        """Yield once per physics step to run before the next rendered frame, never past the duration
+
+        A run with a duration therefore ends on exactly the same step whatever
+        the speed, turbo or render rate.
+        """
+        now = time.perf_counter()
+        if self.turbo:
+            # Fill one frame's worth of wall time with as many steps as fit
+            deadline = now + 1 / (self.render_hz or 30)
+            while not self.finished():
+                yield self.step
+                self.step += 1
+                if time.perf_counter() >= deadline:
+                    break
+        else:
+            self.accumulator += min(now - self.last_wall, MAX_FRAME_LAG) * 1000 * self.speed
+            while self.accumulator >= self.dt_ms and not self.finished():
+                self.accumulator -= self.dt_ms
+                yield self.step
+                self.step += 1
+        self.last_wall = time.perf_counter()
+
+    def wait_frame(self):
+        """Sleep until the next frame is due; turbo mode never sleeps"""
+        frame_time = 1 / (self.render_hz or self.physics_hz)
+        now = time.perf_counter()
+        if self.turbo:
+            self.next_frame = now
+            return
+        self.next_frame = max(self.next_frame + frame_time, now - frame_time)
+        if self.next_frame > now:
+            time.sleep(self.next_frame - now)
+
+    def faster(self):
+        self.speed = next((s for s in SPEED_STEPS if s > self.speed), self.speed)
+
+    def slower(self):
+        self.speed = next((s for s in reversed(SPEED_STEPS) if s < self.speed), self.speed)
+
+    def seek(self, step):
+        """Go on from physics step `step` without catching up on the wall time spent paused"""
+        self.step = step
+        self.accumulator = 0.0
+        self.last_wall = self.next_frame = time.perf_counter()
+
+    def toggle_turbo(self):
+        self.turbo = not self.turbo
+        self.accumulator = 0.0
+
+    def describe(self):
+        return "TURBO" if self.turbo else f"x{self.speed:g}"
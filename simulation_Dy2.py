@@ -1,5 +1,6 @@
 import pygame
 import random
+import argparse
 from collections import defaultdict
 
 # Initialize pygame
@@ -30,6 +31,10 @@ INTERSECTION_BOTTOM = 450
 INTERSECTION_LEFT = 300
 INTERSECTION_RIGHT = 500
 
+# Vehicles of each direction inside the box, kept up to date by Vehicle.move()
+# so clearance checks don't have to scan every vehicle
+intersection_occupancy = [0] * 4
+
 def create_intersection_background():
     background = pygame.Surface((WIDTH, HEIGHT))
     background.fill(GRAY)
@@ -92,26 +97,34 @@ class Vehicle:
                 self.y -= self.speed
                 if not self.has_entered_intersection and self.y < INTERSECTION_BOTTOM:
                     self.has_entered_intersection = True
-                if self.y < INTERSECTION_TOP:
+                    intersection_occupancy[self.direction] += 1
+                if not self.has_exited_intersection and self.y < INTERSECTION_TOP:
                     self.has_exited_intersection = True
+                    intersection_occupancy[self.direction] -= 1
             elif self.direction == EAST:
                 self.x += self.speed
                 if not self.has_entered_intersection and self.x > INTERSECTION_LEFT:
                     self.has_entered_intersection = True
-                if self.x > INTERSECTION_RIGHT:
+                    intersection_occupancy[self.direction] += 1
+                if not self.has_exited_intersection and self.x > INTERSECTION_RIGHT:
                     self.has_exited_intersection = True
+                    intersection_occupancy[self.direction] -= 1
             elif self.direction == SOUTH:
                 self.y += self.speed
                 if not self.has_entered_intersection and self.y > INTERSECTION_TOP:
                     self.has_entered_intersection = True
-                if self.y > INTERSECTION_BOTTOM:
+                    intersection_occupancy[self.direction] += 1
+                if not self.has_exited_intersection and self.y > INTERSECTION_BOTTOM:
                     self.has_exited_intersection = True
+                    intersection_occupancy[self.direction] -= 1
             elif self.direction == WEST:
                 self.x -= self.speed
                 if not self.has_entered_intersection and self.x < INTERSECTION_RIGHT:
                     self.has_entered_intersection = True
-                if self.x < INTERSECTION_LEFT:
+                    intersection_occupancy[self.direction] += 1
+                if not self.has_exited_intersection and self.x < INTERSECTION_LEFT:
                     self.has_exited_intersection = True
+                    intersection_occupancy[self.direction] -= 1
                 
             self.wait_time = 0
         else:
@@ -136,7 +149,7 @@ class Vehicle:
         return False
 
 class TrafficLightSystem:
-    def __init__(self):
+    def __init__(self, controller=None):
         self.states = [RED] * 4
         self.yellow_states = [False] * 4
         self.current_green = None
@@ -145,12 +158,28 @@ class TrafficLightSystem:
         self.last_change_time = pygame.time.get_ticks()
         self.sequence = [NORTH, EAST, SOUTH, WEST]
         self.intersection_clear = True
+        self.controller = controller  # optional SignalController choosing phase and duration
+        self.prepared = False  # controller told about the coming decision this cycle
+        
+    def check_intersection_clear(self, vehicles=None):
+        """True when no vehicle from a direction other than the green one is in the box"""
+        return not any(count for direction, count in enumerate(intersection_occupancy)
+                       if direction != self.current_green)
         
-    def check_intersection_clear(self, vehicles):
+    def observe(self, vehicles):
+        """Queue counts and mean waits per direction, in the controllers' state layout"""
+        vehicle_counts = defaultdict(int)
+        wait_times = defaultdict(int)
         for vehicle in vehicles:
-            if vehicle.is_in_intersection() and vehicle.direction != self.current_green:
-                return False
-        return True
+            if not vehicle.has_entered_intersection:
+                vehicle_counts[vehicle.direction] += 1
+                wait_times[vehicle.direction] += vehicle.wait_time
+        state = {'current_light': self.current_green}
+        for direction, name in enumerate(['north', 'east', 'south', 'west']):
+            count = vehicle_counts[direction]
+            state[f"{name}_count"] = count
+            state[f"{name}_wait"] = wait_times[direction] / count if count else 0
+        return state
         
     def update(self, vehicles):
         current_time = pygame.time.get_ticks()
@@ -161,12 +190,20 @@ class TrafficLightSystem:
         if time_since_change > self.green_duration + self.yellow_duration or (
             time_since_change > self.green_duration + self.yellow_duration + 2000 and not self.intersection_clear):
             
-            if self.current_green is None:
+            if self.controller is not None:
+                next_green, self.green_duration = self.controller.decide(self.observe(vehicles))
+                self.current_green = int(next_green)
+            elif self.current_green is None:
                 self.current_green = self.sequence[0]
             else:
                 current_index = self.sequence.index(self.current_green)
                 self.current_green = self.sequence[(current_index + 1) % 4]
             self.last_change_time = current_time
+            self.prepared = False
+        elif self.controller is not None and not self.prepared and time_since_change > self.green_duration:
+            # Yellow has started: slow controllers can work on the next decision while frames render
+            self.controller.prepare(self.observe(vehicles))
+            self.prepared = True
         
         for i in range(4):
             if i == self.current_green:
@@ -199,11 +236,28 @@ class TrafficLightSystem:
                             (pos[0], pos[1] + 30), 10)
 
 def main():
+    parser = argparse.ArgumentParser(description="Traffic light simulation")
+    parser.add_argument('--neat', metavar='GENOME', help="drive the lights with a genome exported by neat_controller.py")
+    parser.add_argument('--mpc', action='store_true', help="drive the lights with rollouts of forked simulations")
+    parser.add_argument('--mpc-budget', type=float, default=300, help="ms the MPC may block a frame per decision")
+    parser.add_argument('--mpc-workers', type=int, default=None, help="rollout processes (default: all cores)")
+    args = parser.parse_args()
+    controller = None
+    if args.neat:
+        from neat_controller import NEATTrafficController
+        controller = NEATTrafficController.load(args.neat)
+    elif args.mpc:
+        from controllers import FixedRotationController
+        from mpc_controller import MPCController
+        # Falls back to this file's own rotation; vehicles arrive every 30 frames from any direction
+        controller = MPCController(FixedRotationController(), budget_ms=args.mpc_budget, workers=args.mpc_workers,
+                                   interval_ms=500, direction_weights=(1, 1, 1, 1))
+
     running = True
     clock = pygame.time.Clock()
     vehicles = []
     spawn_timer = 0
-    traffic_light_system = TrafficLightSystem()
+    traffic_light_system = TrafficLightSystem(controller)
     font = pygame.font.SysFont('Arial', 24)
     
     # Vehicle counters
@@ -287,7 +341,7 @@ def main():
         green_text = ["NORTH", "EAST", "SOUTH", "WEST"][current_green] if current_green != -1 else "NONE"
         stats = [
             f"Vehicles: {len(vehicles)}",
-            f"Green Light: {green_text}",
+            f"Green Light: {green_text} ({traffic_light_system.green_duration / 1000:.1f}s, {controller.name if controller else 'Fixed'})",
             f"Intersection Clear: {'YES' if traffic_light_system.intersection_clear else 'NO'}",
             f"North: {current_counts[NORTH]} (Entered: {vehicle_counters[NORTH]})",
             f"East: {current_counts[EAST]} (Entered: {vehicle_counters[EAST]})",
@@ -303,6 +357,8 @@ def main():
         pygame.display.flip()
         clock.tick(60)
     
+    if args.mpc:
+        controller.close()
     pygame.quit()
 
 if __name__ == "__main__":
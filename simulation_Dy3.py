@@ -1,8 +1,12 @@
 import pygame
 import random
+import argparse
 import numpy as np
 from collections import defaultdict
-from sklearn.neighbors import KNeighborsClassifier
+from sim_clock import SimulationClock
+from controllers import DensityKNN
+from frame_profiler import FrameProfiler
+from memory_monitor import MemoryMonitor
 
 # Initialize pygame
 pygame.init()
@@ -39,6 +43,14 @@ INTERSECTION_BOTTOM = 400
 INTERSECTION_LEFT = 250
 INTERSECTION_RIGHT = 550
 
+# Vehicles of each direction inside the box, kept up to date by Vehicle.update_state()
+# so clearance checks don't have to scan every vehicle
+intersection_occupancy = [0] * 4
+
+# Simulated time; main() replaces it with one configured from the command line
+sim_clock = SimulationClock()
+profiler = FrameProfiler()  # enabled with --profile or the P key
+
 class Vehicle:
     def __init__(self, x, y, direction):
         self.x = x
@@ -64,6 +76,7 @@ class Vehicle:
             self.y = random.randint(INTERSECTION_TOP + 50, INTERSECTION_BOTTOM - 50)
 
     def update_state(self):
+        previous = self.state
         if self.direction == NORTH:
             if INTERSECTION_TOP < self.y <= INTERSECTION_BOTTOM:
                 self.state = IN_INTERSECTION
@@ -84,6 +97,11 @@ class Vehicle:
                 self.state = IN_INTERSECTION
             elif self.x <= INTERSECTION_LEFT:
                 self.state = CLEARED
+        if self.state != previous:
+            if self.state == IN_INTERSECTION:
+                intersection_occupancy[self.direction] += 1
+            elif previous == IN_INTERSECTION:
+                intersection_occupancy[self.direction] -= 1
 
     def move(self, light_state, yellow_light):
         # Only stop if approaching a red or yellow light
@@ -141,13 +159,11 @@ class TrafficLightSystem:
         self.states = [RED] * 4  # One for each direction
         self.yellow_states = [False] * 4
         self.current_green = None
-        self.last_change = pygame.time.get_ticks()
+        self.last_change = sim_clock.now()
         self.min_green_time = 3000  # 3 seconds minimum
         self.max_green_time = 8000  # 8 seconds maximum
         self.yellow_time = 2000     # 2 seconds yellow
-        self.traffic_data = []
-        self.traffic_labels = []
-        self.knn = KNeighborsClassifier(n_neighbors=3)
+        self.knn = DensityKNN(n_neighbors=3, capacity=100)  # last 100 density samples
         self.min_data = 30  # Minimum data points before using KNN
         self.using_knn = False
         
@@ -167,14 +183,12 @@ class TrafficLightSystem:
                     
         return density
         
-    def is_intersection_clear(self, vehicles, exclude_direction=None):
-        for v in vehicles:
-            if v.state == IN_INTERSECTION and (exclude_direction is None or v.direction != exclude_direction):
-                return False
-        return True
+    def is_intersection_clear(self, vehicles=None, exclude_direction=None):
+        return not any(count for direction, count in enumerate(intersection_occupancy)
+                       if direction != exclude_direction)
         
     def update(self, vehicles):
-        current_time = pygame.time.get_ticks()
+        current_time = sim_clock.now()
         elapsed = current_time - self.last_change
         
         # Get current traffic density
@@ -182,11 +196,7 @@ class TrafficLightSystem:
         
         # Store data for KNN training
         if self.current_green is not None:
-            self.traffic_data.append(density)
-            self.traffic_labels.append(self.current_green)
-            if len(self.traffic_data) > 100:  # Keep last 100 data points
-                self.traffic_data = self.traffic_data[-100:]
-                self.traffic_labels = self.traffic_labels[-100:]
+            self.knn.add(density, self.current_green)
         
         # Check if we should consider changing lights
         if self.current_green is None or elapsed > self.min_green_time:
@@ -196,26 +206,23 @@ class TrafficLightSystem:
             if elapsed > self.max_green_time or (intersection_clear and elapsed > self.min_green_time):
                 
                 # Switch to KNN once we have enough data
-                if len(self.traffic_data) >= self.min_data and not self.using_knn:
+                if len(self.knn) >= self.min_data and not self.using_knn:
                     self.using_knn = True
                 
                 if self.using_knn:
                     try:
-                        # Train KNN with current data
-                        self.knn.fit(self.traffic_data, self.traffic_labels)
-                        
-                        # Get probabilities for each direction
-                        proba = self.knn.predict_proba([density])[0]
+                        # Probabilities for each direction (refits only once the window has changed enough)
+                        proba = self.knn.class_probabilities(density)
                         
                         # Calculate scores for each direction
                         scores = []
                         for d in range(4):
                             if d == self.current_green:
                                 # Reduce score for current direction to encourage switching
-                                scores.append(density[d] * (proba[d] * 0.7))
+                                scores.append(density[d] * (proba.get(d, 0) * 0.7))
                             else:
                                 # Add small bias to prevent zero scores
-                                scores.append(density[d] * (proba[d] + 0.1))
+                                scores.append(density[d] * (proba.get(d, 0) + 0.1))
                         
                         # Select direction with highest score
                         next_green = np.argmax(scores)
@@ -284,7 +291,20 @@ def draw_intersection():
         pygame.draw.rect(screen, WHITE, (x, HEIGHT//2-5, 20, 10))
 
 def main():
-    clock = pygame.time.Clock()
+    global sim_clock, profiler
+    parser = argparse.ArgumentParser(description=pygame.display.get_caption()[0])
+    SimulationClock.add_arguments(parser)
+    FrameProfiler.add_arguments(parser)
+    MemoryMonitor.add_arguments(parser)
+    parser.add_argument('--seed', type=int, help="seed the vehicle generator for a reproducible run")
+    args = parser.parse_args()
+    sim_clock = SimulationClock.from_args(args)
+    profiler = FrameProfiler(enabled=args.profile or bool(args.profile_export))
+    memory_monitor = MemoryMonitor.from_args(args)
+    memory_monitor.start()
+    if args.seed is not None:
+        random.seed(args.seed)
+
     font = pygame.font.SysFont('Arial', 24)
     
     # Initialize systems
@@ -294,7 +314,7 @@ def main():
     total_crossed = 0
     
     running = True
-    while running:
+    while running and not sim_clock.finished():
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 running = False
@@ -305,59 +325,87 @@ def main():
                     print(f"Current Green: {['North','East','South','West'][traffic_lights.current_green]}")
                     print(f"Traffic Density: N:{density[NORTH]} E:{density[EAST]} S:{density[SOUTH]} W:{density[WEST]}")
                     print(f"Using KNN: {traffic_lights.using_knn}")
-                    print(f"Training Data: {len(traffic_lights.traffic_data)} samples")
+                    print(f"Training Data: {len(traffic_lights.knn)} samples, {traffic_lights.knn.fits} fits, "
+                          f"{traffic_lights.knn.cache_hits} cached predictions")
+                elif event.key == pygame.K_t:
+                    sim_clock.toggle_turbo()
+                elif event.key in (pygame.K_PLUS, pygame.K_EQUALS, pygame.K_KP_PLUS):
+                    sim_clock.faster()
+                elif event.key in (pygame.K_MINUS, pygame.K_KP_MINUS):
+                    sim_clock.slower()
+                elif event.key == pygame.K_p:
+                    profiler.toggle()
         
-        # Spawn new vehicles
-        spawn_timer += 1
-        if spawn_timer >= 15:  # Spawn more frequently to create density
-            # Weighted random choice - higher chance for North/South to create asymmetry
-            direction = random.choices([NORTH, EAST, SOUTH, WEST], 
-                                     weights=[1.5, 1.0, 1.5, 1.0], k=1)[0]
-            vehicles.append(Vehicle(0, 0, direction))  # Position will be set in constructor
-            spawn_timer = 0
+        # Fixed-step physics; how many steps run per frame depends on speed/turbo only
+        for _ in sim_clock.physics_steps():
+            # Spawn new vehicles
+            with profiler.stage('spawn'):
+                spawn_timer += 1
+                if spawn_timer >= 15:  # Spawn more frequently to create density
+                    # Weighted random choice - higher chance for North/South to create asymmetry
+                    direction = random.choices([NORTH, EAST, SOUTH, WEST], 
+                                             weights=[1.5, 1.0, 1.5, 1.0], k=1)[0]
+                    vehicles.append(Vehicle(0, 0, direction))  # Position will be set in constructor
+                    spawn_timer = 0
         
-        # Update systems
-        traffic_lights.update(vehicles)
+            # Update systems
+            if sim_clock.control_due():
+                with profiler.stage('lights'):
+                    traffic_lights.update(vehicles)
         
-        # Move vehicles
-        to_remove = []
-        for v in vehicles:
-            v.move(traffic_lights.states, traffic_lights.yellow_states)
-            if v.is_off_screen():
-                to_remove.append(v)
-                if v.state == CLEARED:
-                    total_crossed += 1
+            # Move vehicles
+            with profiler.stage('move'):
+                to_remove = []
+                for v in vehicles:
+                    v.move(traffic_lights.states, traffic_lights.yellow_states)
+                    if v.is_off_screen():
+                        to_remove.append(v)
+                        if v.state == CLEARED:
+                            total_crossed += 1
         
-        for v in to_remove:
-            vehicles.remove(v)
+                for v in to_remove:
+                    vehicles.remove(v)
+
+        if sim_clock.render_due():
+            # Draw everything
+            with profiler.stage('draw'):
+                screen.fill(GRAY)
+                draw_intersection()
         
-        # Draw everything
-        screen.fill(GRAY)
-        draw_intersection()
+                # Draw vehicles (sorted by position for proper overlapping)
+                for v in sorted(vehicles, key=lambda v: v.y if v.direction in [NORTH, SOUTH] else -v.x):
+                    v.draw()
         
-        # Draw vehicles (sorted by position for proper overlapping)
-        for v in sorted(vehicles, key=lambda v: v.y if v.direction in [NORTH, SOUTH] else -v.x):
-            v.draw()
+                traffic_lights.draw_lights()
         
-        traffic_lights.draw_lights()
+            # Draw stats
+            with profiler.stage('hud'):
+                density = traffic_lights.get_traffic_density(vehicles)
+                stats = [
+                    f"Vehicles: {len(vehicles)} | Crossed: {total_crossed}",
+                    f"North: {density[NORTH]} | East: {density[EAST]}",
+                    f"South: {density[SOUTH]} | West: {density[WEST]}",
+                    f"Current Green: {['North','East','South','West'][traffic_lights.current_green if traffic_lights.current_green is not None else 0]}",
+                    f"Control: {'KNN' if traffic_lights.using_knn else 'Sequential'}",
+                    f"Speed: {sim_clock.describe()} (T turbo, +/- speed)",
+                    "Press D for debug info, P for frame timings"
+                ]
         
-        # Draw stats
-        density = traffic_lights.get_traffic_density(vehicles)
-        stats = [
-            f"Vehicles: {len(vehicles)} | Crossed: {total_crossed}",
-            f"North: {density[NORTH]} | East: {density[EAST]}",
-            f"South: {density[SOUTH]} | West: {density[WEST]}",
-            f"Current Green: {['North','East','South','West'][traffic_lights.current_green if traffic_lights.current_green is not None else 0]}",
-            f"Control: {'KNN' if traffic_lights.using_knn else 'Sequential'}",
-            "Press D for debug info"
-        ]
+                for i, text in enumerate(stats):
+                    surf = font.render(text, True, WHITE)
+                    screen.blit(surf, (10, 10 + i*25))
         
-        for i, text in enumerate(stats):
-            surf = font.render(text, True, WHITE)
-            screen.blit(surf, (10, 10 + i*25))
-        
-        pygame.display.flip()
-        clock.tick(60)
+            profiler.draw_overlay(screen)
+            with profiler.stage('flip'):
+                pygame.display.flip()
+        with profiler.stage('wait'):
+            sim_clock.wait_frame()
+        profiler.end_frame()
+        memory_monitor.sample(sim_clock.now() / 1000)
+
+    if args.profile_export:
+        profiler.export(args.profile_export)
+    memory_monitor.stop()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
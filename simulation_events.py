@@ -0,0 +1,497 @@
+# Discrete-event engine for evaluating signal plans over long horizons.
+#
+#   python simulation_events.py --hours 24 --controllers fixed formula --fixed-green 30
+#   python simulation_events.py --hours 24 --profile 0.3,0.2,0.5,1.5,1,1,1.5,0.6   # hourly, repeated
+#   python simulation_events.py --compare 1800     # check against the tick engine over 30 minutes
+#
+# The tick engine (simulation_headless.py) moves every vehicle every 1/60 s,
+# even while a queue sits out a long red. This engine keeps a heap of the
+# moments something changes and jumps from one to the next: a vehicle is
+# generated, enters its lane, crosses the stop line, or the signals switch.
+# Lanes are first-in first-out queues. A vehicle reaches the stop line after
+# its free-flow travel time, or later when it has to queue: each vehicle leaves
+# at least one saturation headway after the one ahead of it and only while its
+# light is green. The default headways come from the tick engine's geometry:
+# the vehicle ahead's length plus the gap, covered at the slower of the two
+# speeds, plus the one-step start-up lag of each follower. A queued vehicle
+# that was held up by a slower one crosses at that vehicle's speed. With
+# --headways settime they are the per-vehicle crossing times of setTime() in
+# simulation.py (carTime, busTime, ...), which discharge much more slowly.
+# A lane takes a new vehicle only while its queue, packed bumper to bumper,
+# leaves room at the entry, so long queues back up into the generator like
+# they do in the tick engine. Switches wait for the box to clear, as there.
+#
+# Per-lane crossed counts and delays agree with the tick engine to within a
+# few percent (--compare) while demand stays below capacity. Far beyond it,
+# when queues outlast several cycles, the delays drift apart by up to about
+# ten percent. A simulated day takes seconds instead of an hour. The learned
+# controllers see slightly different states in the two engines, and once one
+# of their decisions differs the runs follow different signal plans, so
+# --compare drives the event engine with the tick engine's decisions and shows
+# the controller's own run beside it.
+# Controllers that observe every step (the density KNN) need the tick engine.
+import argparse
+import heapq
+import math
+import time
+from collections import deque
+import numpy as np
+from controllers import VEHICLE_CROSS_TIMES, FixedRotationController
+from event_log import Decision, ReplayController
+from simulation_headless import (HeadlessSimulation, Demand, TICK_MS, STOP_DISTANCE, STOP_LINE_DISTANCE,
+                                 BOX_EXIT_DISTANCE, CLASS_SPEEDS, CLASS_LENGTHS, gap, vehicleTypes, noOfSignals,
+                                 noOfLanes)
+
+# Event kinds, in the order they are handled when they fall on the same moment
+ARRIVAL = 0
+ENTRY = 1
+DEPARTURE = 2
+SWITCH = 3
+
+START_UP_LAG_MS = TICK_MS  # each follower moves off one step after the vehicle ahead
+SPEEDS_PER_MS = CLASS_SPEEDS / TICK_MS
+LANE_ERROR_FLOOR = 20  # vehicles; --compare judges smaller lanes against this many
+
+
+def first_tick_at(time_ms):
+    """The tick engine's first step at or after time_ms, as a time in ms"""
+    tick = math.ceil(time_ms / TICK_MS)
+    if (tick - 1) * TICK_MS >= time_ms:
+        tick -= 1
+    elif tick * TICK_MS < time_ms:
+        tick += 1
+    return tick * TICK_MS
+
+
+class ProfileDemand(Demand):
+    """Demand whose arrival rate follows hourly multipliers, repeating after the last hour"""
+
+    def __init__(self, profile, seed=0, interval_ms=750, direction_weights=(400, 400, 100, 100)):
+        super().__init__(seed, interval_ms, direction_weights)
+        self.profile = list(profile)
+
+    def spawn_interval(self, time_ms):
+        hour = int(time_ms // 3600000)
+        rate = self.profile[hour % len(self.profile)]
+        if rate <= 0:
+            return (hour + 1) * 3600000 - time_ms + self.interval_ms
+        return self.interval_ms / rate
+
+
+class Lane:
+    __slots__ = ('direction', 'number', 'pending', 'road', 'footprint', 'entry_free', 'entry_scheduled',
+                 'last_departure', 'last_length', 'last_speed', 'version')
+
+    def __init__(self, direction, number):
+        self.direction = direction
+        self.number = number
+        self.pending = deque()  # (generated ms, class) of vehicles waiting to enter the road
+        # [generated, class, entered, free-flow and earliest stop line crossing] in ms of vehicles not yet crossed
+        self.road = deque()
+        self.footprint = 0.0  # lengths plus gaps of the vehicles on the road
+        self.entry_free = 0.0  # when the last vehicle to enter has moved a gap clear of the entry
+        self.entry_scheduled = False
+        self.last_departure = -math.inf
+        self.last_length = 0.0
+        self.last_speed = math.inf
+        self.version = 0  # bumped to cancel a scheduled departure
+
+
+class EventSimulation:
+    def __init__(self, controller, seed=0, demand=None, yellow_duration=2000, clearance_duration=2000,
+                 headways='engine'):
+        if controller.observe_every_step:
+            raise ValueError(f"{controller.name} observes every step; run it on the tick engine")
+        self.controller = controller
+        self.demand = demand if demand is not None else Demand(seed)
+        self.yellow_duration = yellow_duration
+        self.clearance_duration = clearance_duration
+        self.headways = headways
+        self.lanes = [Lane(d, l) for d in range(noOfSignals) for l in range(noOfLanes)]
+
+        self.events = []
+        self.sequence = 0
+        self.now = 0.0
+        self.processed = 0
+
+        self.current_green = None
+        self.green_start = -math.inf
+        self.green_end = -math.inf
+        self.yellow_end = 0.0
+        self.last_green_end = [0.0] * noOfSignals
+        self.box_clear = 0.0  # when the last vehicle to cross leaves the box
+        self.cycle_count = 0
+        self.cycle_cleared = 0
+
+        self.crossed_counts = np.zeros((noOfSignals, noOfLanes), dtype=np.int64)
+        self.delays = []  # ms each crossed vehicle spent stopped or waiting to enter
+        self.decision_times = []
+        self.wall_time = 0.0
+
+        self.schedule_arrival()
+        self.push(0.0, SWITCH, None)
+
+    # Same bookkeeping at a switch as the tick engine
+    cycle_outcome = HeadlessSimulation.cycle_outcome
+
+    @property
+    def time_ms(self):
+        return self.now
+
+    def push(self, time_ms, kind, data):
+        self.sequence += 1
+        heapq.heappush(self.events, (time_ms, kind, self.sequence, data))
+
+    def schedule_arrival(self):
+        demand = self.demand
+        generated = demand.next_spawn_time
+        vehicle = demand.next_vehicle()
+        demand.next_spawn_time += demand.spawn_interval(generated)
+        self.push(first_tick_at(generated), ARRIVAL, vehicle)
+
+    def headway(self, lane, vclass):
+        """Least time between this vehicle and the one ahead of it crossing the stop line"""
+        if self.headways == 'settime':
+            return VEHICLE_CROSS_TIMES[vehicleTypes[vclass]] * 1000
+        # it can't be closer than a gap behind where the vehicle ahead was a step earlier
+        return (lane.last_length + gap) / lane.last_speed + START_UP_LAG_MS
+
+    # Lane entry
+
+    def try_enter(self, lane):
+        if not lane.pending or lane.entry_scheduled:
+            return
+        # The last vehicle's rear is a gap clear of the entry once the packed queue fits in front of the stop
+        if lane.footprint > STOP_DISTANCE[lane.direction]:
+            return  # a departure frees room and tries again
+        lane.entry_scheduled = True
+        self.push(first_tick_at(max(self.now, lane.entry_free)), ENTRY, lane)
+
+    def enter(self, lane):
+        lane.entry_scheduled = False
+        generated, vclass = lane.pending.popleft()
+        speed = SPEEDS_PER_MS[vclass]
+        length = CLASS_LENGTHS[vclass]
+        free_flow = self.now + STOP_LINE_DISTANCE[lane.direction] / speed
+        lane.road.append([generated, vclass, self.now, free_flow, free_flow])
+        lane.footprint += length + gap
+        lane.entry_free = self.now + (length + gap) / speed
+        if len(lane.road) == 1:
+            self.schedule_departure(lane)
+        self.try_enter(lane)
+
+    # Stop line
+
+    def schedule_departure(self, lane):
+        """Schedule the lane's front vehicle to cross, if it can before its light turns"""
+        lane.version += 1
+        if not lane.road or lane.direction != self.current_green:
+            return
+        _, vclass, _, _, earliest = lane.road[0]
+        speed = SPEEDS_PER_MS[vclass]
+        stop_to_line = (STOP_LINE_DISTANCE[lane.direction] - STOP_DISTANCE[lane.direction]) / speed
+        following = lane.last_departure + self.headway(lane, vclass)
+        crossing = max(earliest, following)
+        if crossing - stop_to_line < self.green_start:
+            crossing = max(crossing, self.green_start + stop_to_line)  # held at the stop until green
+        if crossing - stop_to_line >= self.green_end:
+            return  # waits for the next green
+        # a vehicle held up by a slower one ahead crosses at that one's speed
+        speed_at_line = min(speed, lane.last_speed) if following >= earliest else speed
+        self.push(crossing, DEPARTURE, (lane, lane.version, speed_at_line))
+
+    def depart(self, lane, version, speed_at_line):
+        if version != lane.version:
+            return
+        generated, vclass, entered, free_flow, _ = lane.road.popleft()
+        speed = SPEEDS_PER_MS[vclass]
+        length = CLASS_LENGTHS[vclass]
+        lane.footprint -= length + gap
+        lane.last_departure = self.now
+        lane.last_length = length
+        lane.last_speed = speed_at_line
+        self.crossed_counts[lane.direction, lane.number] += 1
+        self.cycle_cleared += 1
+        self.delays.append(entered - generated + max(0.0, self.now - free_flow))
+        box_exit = self.now + (BOX_EXIT_DISTANCE[lane.direction] - STOP_LINE_DISTANCE[lane.direction] + length) / speed
+        self.box_clear = max(self.box_clear, box_exit)
+        self.schedule_departure(lane)
+        self.try_enter(lane)
+
+    def release_queue(self, lane):
+        """At the start of the lane's green: when each vehicle could reach the stop line on its own
+
+        A vehicle that has come to a stop in the queue drives off from its place
+        one step after the vehicle ahead of it does, and one still on its way
+        keeps going; either way it also has to stay behind the vehicle ahead
+        (headway()).
+        """
+        ahead = 0.0
+        for index, vehicle in enumerate(lane.road):
+            _, vclass, entered, free_flow, _ = vehicle
+            speed = SPEEDS_PER_MS[vclass]
+            place = STOP_DISTANCE[lane.direction] - ahead
+            if entered + place / speed <= self.green_start:
+                start = self.green_start + index * START_UP_LAG_MS
+                vehicle[4] = start + (STOP_LINE_DISTANCE[lane.direction] - place) / speed
+            else:
+                vehicle[4] = free_flow
+            ahead += CLASS_LENGTHS[vclass] + gap
+
+    # Signals
+
+    def stopped_since(self, lane, index, ahead):
+        """When the index-th vehicle on the road came to a stop, or None while it is moving"""
+        _, vclass, entered, _, _ = lane.road[index]
+        if lane.direction == self.current_green and self.now < self.green_end:
+            return None
+        slot = STOP_DISTANCE[lane.direction] - ahead
+        return max(entered + slot / SPEEDS_PER_MS[vclass], self.last_green_end[lane.direction])
+
+    def observe(self):
+        """Traffic state in the dict layout the controllers consume"""
+        counts = [0] * noOfSignals
+        wait_sums = [0.0] * noOfSignals
+        class_counts = np.zeros((noOfSignals, len(vehicleTypes)), dtype=np.int64)
+        for lane in self.lanes:
+            d = lane.direction
+            ahead = 0.0
+            for index, (_, vclass, _, _, _) in enumerate(lane.road):
+                stopped = self.stopped_since(lane, index, ahead)
+                if stopped is not None and stopped < self.now:
+                    wait_sums[d] += (self.now - stopped) / TICK_MS
+                ahead += CLASS_LENGTHS[vclass] + gap
+                class_counts[d, vclass] += 1
+            for generated, vclass in lane.pending:
+                wait_sums[d] += (self.now - generated) / TICK_MS
+                class_counts[d, vclass] += 1
+            counts[d] += len(lane.road) + len(lane.pending)
+        waits = [wait_sums[d] / counts[d] if counts[d] else 0 for d in range(noOfSignals)]
+        return {
+            'north_count': counts[0],
+            'east_count': counts[1],
+            'south_count': counts[2],
+            'west_count': counts[3],
+            'north_wait': waits[0],
+            'east_wait': waits[1],
+            'south_wait': waits[2],
+            'west_wait': waits[3],
+            'current_light': self.current_green,
+            'density': counts,
+            'class_counts': [{vehicleTypes[c]: int(class_counts[d, c]) for c in range(len(vehicleTypes))}
+                             for d in range(noOfSignals)],
+            'time': self.now,
+        }
+
+    def switch(self):
+        if self.current_green is not None:
+            if self.now < self.yellow_end:
+                return
+            # All red until the box has cleared, for at most clearance_duration
+            deadline = self.yellow_end + self.clearance_duration
+            if self.box_clear > self.now and self.now < deadline:
+                self.push(first_tick_at(min(self.box_clear, deadline)), SWITCH, None)
+                return
+            self.last_green_end[self.current_green] = self.green_end
+        state = self.observe()
+        outcome = self.cycle_outcome(state)
+        start = time.perf_counter()
+        if outcome is not None:
+            self.controller.record_outcome(state, *outcome)
+        next_green, green_duration = self.controller.decide(state)
+        self.decision_times.append(time.perf_counter() - start)
+
+        self.current_green = int(next_green)
+        self.green_start = self.now
+        self.green_end = self.now + green_duration
+        self.yellow_end = self.green_end + self.yellow_duration
+        self.cycle_count += 1
+        self.cycle_cleared = 0
+        for lane in self.lanes:
+            if lane.direction == self.current_green:
+                self.release_queue(lane)
+                self.schedule_departure(lane)
+        self.push(first_tick_at(self.yellow_end), SWITCH, None)
+
+    def run(self, seconds):
+        """Advance the simulation by the given number of simulated seconds"""
+        end = first_tick_at(self.now + seconds * 1000)
+        start = time.perf_counter()
+        events = self.events
+        while events and events[0][0] < end:
+            self.now, kind, _, data = heapq.heappop(events)
+            self.processed += 1
+            if kind == ARRIVAL:
+                direction, lane_number, vclass, _ = data
+                lane = self.lanes[direction * noOfLanes + lane_number]
+                lane.pending.append((self.now, vclass))
+                self.try_enter(lane)
+                self.schedule_arrival()
+            elif kind == ENTRY:
+                self.enter(data)
+            elif kind == DEPARTURE:
+                self.depart(*data)
+            else:
+                self.switch()
+        self.now = end
+        self.wall_time += time.perf_counter() - start
+        return self.summary()
+
+    def summary(self):
+        """The tick engine's summary() for the run so far"""
+        sim_seconds = self.now / 1000
+        delays = list(self.delays)
+        for lane in self.lanes:
+            ahead = 0.0
+            for generated, vclass, entered, _, _ in lane.road:
+                # time on the road beyond what driving up to its place in the queue takes
+                travel = (STOP_DISTANCE[lane.direction] - ahead) / SPEEDS_PER_MS[vclass]
+                delays.append(entered - generated + max(0.0, self.now - entered - travel))
+                ahead += CLASS_LENGTHS[vclass] + gap
+            delays.extend(self.now - generated for generated, _ in lane.pending)
+        delays = np.array(delays, dtype=np.float64) / 1000
+        decisions = np.array(self.decision_times) * 1000
+        crossed = int(self.crossed_counts.sum())
+        return {
+            'sim_seconds': sim_seconds,
+            'crossed': crossed,
+            'lane_crossed': self.crossed_counts.tolist(),
+            'throughput': crossed / sim_seconds * 60 if sim_seconds else 0,
+            'mean_wait': float(delays.mean()) if len(delays) else 0.0,
+            'p95_wait': float(np.percentile(delays, 95)) if len(delays) else 0.0,
+            'cycles': self.cycle_count,
+            'decision_ms': float(decisions.mean()) if len(decisions) else 0.0,
+            'decision_p95_ms': float(np.percentile(decisions, 95)) if len(decisions) else 0.0,
+            # ticks the tick engine would have stepped per wall second, for comparing the two
+            'steps_per_second': self.now / TICK_MS / self.wall_time if self.wall_time else 0.0,
+            'events': self.processed,
+        }
+
+
+def make_controller(name, fixed_green):
+    from benchmark_controllers import CONTROLLERS
+    if name == 'fixed':
+        return FixedRotationController(int(fixed_green * 1000))
+    return CONTROLLERS[name]()
+
+
+class DecisionRecorder:
+    """Stands in for an EventLogWriter and keeps only the decisions, for a ReplayController"""
+
+    def __init__(self):
+        self.decisions = []
+
+    def spawn(self, *record):
+        pass
+
+    def phase(self, *record):
+        pass
+
+    def decision(self, step, green, duration):
+        self.decisions.append(Decision(step, green, duration))
+
+
+def compare(names, seconds, seed, interval_ms, fixed_green, headways, tolerance):
+    """Run both engines on the same demand; returns the result rows and whether all were within tolerance
+
+    The event engine replays the tick engine's decisions, so what is judged
+    is the engines and not how far a learned controller's plan drifts after
+    its first differing decision. That drift shows in 'Own wait s', the event
+    engine's mean wait with the controller deciding for itself. Lane errors
+    are relative to at least LANE_ERROR_FLOOR vehicles, so a lane that saw a
+    handful doesn't fail on one vehicle.
+    """
+    rows = []
+    agree = True
+    for name in names:
+        decisions = DecisionRecorder()
+        tick = HeadlessSimulation(make_controller(name, fixed_green), demand=Demand(seed, interval_ms),
+                                  recorder=decisions).run(seconds)
+        event = EventSimulation(ReplayController(decisions), demand=Demand(seed, interval_ms),
+                                headways=headways).run(seconds)
+        own = EventSimulation(make_controller(name, fixed_green), demand=Demand(seed, interval_ms),
+                              headways=headways).run(seconds)
+        tick_lanes = np.array(tick['lane_crossed'])
+        event_lanes = np.array(event['lane_crossed'])
+        lane_error = float((np.abs(event_lanes - tick_lanes) / np.maximum(tick_lanes, LANE_ERROR_FLOOR)).max())
+        wait_error = abs(event['mean_wait'] - tick['mean_wait']) / max(tick['mean_wait'], 1e-9)
+        within = lane_error <= tolerance and wait_error <= tolerance
+        agree &= within
+        rows.append({'controller': name, 'tick_crossed': tick['crossed'], 'event_crossed': event['crossed'],
+                     'lane_error': lane_error, 'tick_wait': tick['mean_wait'], 'event_wait': event['mean_wait'],
+                     'wait_error': wait_error, 'own_wait': own['mean_wait'],
+                     'speedup': event['steps_per_second'] / tick['steps_per_second'],
+                     'within': 'yes' if within else 'NO'})
+    return rows, agree
+
+
+COMPARE_COLUMNS = [
+    ('controller', 'Controller', 12, ''),
+    ('tick_crossed', 'Tick crossed', 13, 'd'),
+    ('event_crossed', 'Event crossed', 14, 'd'),
+    ('lane_error', 'Worst lane', 11, '.1%'),
+    ('tick_wait', 'Tick wait s', 12, '.2f'),
+    ('event_wait', 'Event wait s', 13, '.2f'),
+    ('wait_error', 'Wait diff', 10, '.1%'),
+    ('own_wait', 'Own wait s', 11, '.2f'),
+    ('speedup', 'Speedup', 8, '.0f'),
+    ('within', 'Within', 7, ''),
+]
+
+COLUMNS = [
+    ('controller', 'Controller', 12, ''),
+    ('crossed', 'Crossed', 9, 'd'),
+    ('throughput', 'Veh/min', 9, '.1f'),
+    ('mean_wait', 'Mean wait s', 12, '.1f'),
+    ('p95_wait', 'P95 wait s', 11, '.1f'),
+    ('cycles', 'Cycles', 8, 'd'),
+    ('events', 'Events', 10, 'd'),
+    ('wall_seconds', 'Wall s', 8, '.1f'),
+]
+
+
+def main():
+    from benchmark_controllers import CONTROLLERS, format_table
+    names = [name for name, factory in CONTROLLERS.items() if not factory().observe_every_step]
+    parser = argparse.ArgumentParser(description="Evaluate signal plans with the discrete-event engine")
+    parser.add_argument('--hours', type=float, default=24, help="simulated hours")
+    parser.add_argument('--controllers', nargs='+', choices=names, default=['fixed', 'formula'])
+    parser.add_argument('--fixed-green', type=float, default=5, help="green seconds of the fixed rotation")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--interval', type=float, default=750, help="milliseconds between generated vehicles")
+    parser.add_argument('--profile', help="comma-separated hourly demand multipliers, repeated over the run")
+    parser.add_argument('--headways', choices=['engine', 'settime'], default='engine',
+                        help="saturation headways from the tick engine's geometry or setTime()'s crossing times")
+    parser.add_argument('--compare', type=float, metavar='SECONDS',
+                        help="instead, run both engines for this long and compare them")
+    parser.add_argument('--tolerance', type=float, default=0.05,
+                        help="largest relative difference per lane and in mean wait for --compare")
+    args = parser.parse_args()
+
+    if args.compare:
+        rows, agree = compare(args.controllers, args.compare, args.seed, args.interval, args.fixed_green,
+                              args.headways, args.tolerance)
+        print(f"Tick engine against event engine over {args.compare:.0f} simulated seconds, seed {args.seed}")
+        print(format_table(rows, COMPARE_COLUMNS))
+        if not agree:
+            raise SystemExit(1)
+        return
+
+    results = []
+    for name in args.controllers:
+        if args.profile:
+            demand = ProfileDemand([float(value) for value in args.profile.split(',')], args.seed, args.interval)
+        else:
+            demand = Demand(args.seed, args.interval)
+        simulation = EventSimulation(make_controller(name, args.fixed_green), demand=demand, headways=args.headways)
+        result = simulation.run(args.hours * 3600)
+        result['controller'] = name
+        result['wall_seconds'] = simulation.wall_time
+        results.append(result)
+    print(f"{args.hours:g} simulated hours per controller, seed {args.seed}"
+          f"{', hourly profile ' + args.profile if args.profile else ''}")
+    print(format_table(results, COLUMNS))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,479 @@
+# Headless, fixed-step traffic simulation for comparing signal controllers.
+#
+# The world follows simulation_Dy.py / simulation_state.py: a 1400x800
+# junction with three lanes per approach, the same stop lines, stopping gap and
+# vehicle classes, and vehicles generated the way generateVehicles() does it.
+# Vehicles live in NumPy arrays instead of pygame sprites and time advances in
+# fixed 1/60 s steps, so runs are reproducible from a seed and go as fast as the
+# CPU allows. Turning vehicles are recorded but drive straight through the box.
+# Runs can be written to an event log and replayed from it (event_log.py).
+# snapshot() captures the whole state cheaply and fork() branches a copy off it
+# with another controller, for asking what a decision would lead to.
+import copy
+import random
+import time
+from collections import deque
+import numpy as np
+from controllers import density_efficiency
+
+# Directions, numbered as in simulation.py. Controllers index their
+# NORTH/EAST/SOUTH/WEST features positionally, so approach i is feature i.
+directionNumbers = {0: 'right', 1: 'down', 2: 'left', 3: 'up'}
+vehicleTypes = {0: 'car', 1: 'bus', 2: 'truck', 3: 'rickshaw', 4: 'bike'}
+noOfSignals = 4
+noOfLanes = 3
+
+# Signal states
+RED = 0
+YELLOW = 1
+GREEN = 2
+
+# One physics step is one frame of the pygame variants
+TICK_MS = 1000 / 60
+
+speeds = {'car': 2.25, 'bus': 1.8, 'truck': 1.8, 'rickshaw': 2, 'bike': 2.5}  # pixels per step
+lengths = {'car': 27, 'bus': 38, 'truck': 31, 'rickshaw': 23, 'bike': 19}  # sprite length along the road
+gap = 15  # stopping and moving gap
+
+# Distances along each approach, measured from where vehicles enter the screen
+# to the vehicle's front (defaultStop, stopLines and the far side of the box)
+STOP_DISTANCE = np.array([580, 320, 590, 255], dtype=np.float64)
+STOP_LINE_DISTANCE = np.array([590, 330, 600, 265], dtype=np.float64)
+BOX_EXIT_DISTANCE = np.array([800, 535, 810, 470], dtype=np.float64)
+END_DISTANCE = np.array([1500, 900, 1500, 900], dtype=np.float64)
+
+# Lane coordinates across the road, used to place vehicles on screen
+laneCoods = {'right': [348, 370, 398], 'down': [755, 727, 697], 'left': [498, 466, 436], 'up': [602, 627, 657]}
+
+CLASS_SPEEDS = np.array([speeds[vehicleTypes[i]] for i in range(5)], dtype=np.float64)
+CLASS_LENGTHS = np.array([lengths[vehicleTypes[i]] for i in range(5)], dtype=np.float64)
+
+# Per-vehicle arrays of HeadlessSimulation. Steps replace them instead of
+# writing into them, so snapshots can share them.
+VEHICLE_ARRAYS = ('uid', 'direction', 'lane', 'vclass', 'turn', 'pos', 'speed', 'length', 'crossed', 'wait_time',
+                  'total_wait')
+
+# Waits are counted per step up to ten simulated minutes; longer ones share the last bin
+WAIT_BINS = 36000
+DECISION_WINDOW = 1000  # latest decision times kept for the latency percentile
+
+
+class Demand:
+    """Seeded vehicle generator drawing lanes, classes and turns like generateVehicles()"""
+
+    def __init__(self, seed=0, interval_ms=750, direction_weights=(400, 400, 100, 100)):
+        self.rng = random.Random(seed)
+        self.interval_ms = interval_ms
+        self.next_spawn_time = 0
+        self.direction_weights = direction_weights
+        total = 0
+        self.cumulative = []
+        for weight in direction_weights:
+            total += weight
+            self.cumulative.append(total)
+
+    def next_vehicle(self):
+        """Return (direction_number, lane, vehicle_class, will_turn) for the next vehicle"""
+        vehicle_type = self.rng.randint(0, 4)
+        if vehicle_type == 4:
+            lane_number = 0
+        else:
+            lane_number = self.rng.randint(0, 1) + 1
+        will_turn = 0
+        if lane_number == 2:
+            will_turn = 1 if self.rng.randint(0, 4) <= 2 else 0
+        temp = self.rng.randint(0, self.cumulative[-1] - 1)
+        direction_number = 0
+        while temp >= self.cumulative[direction_number]:
+            direction_number += 1
+        return direction_number, lane_number, vehicle_type, will_turn
+
+    def spawn_interval(self, time_ms):
+        """Milliseconds from a vehicle generated at time_ms to the next one"""
+        return self.interval_ms
+
+    def fork(self):
+        """Independent copy that goes on to generate the same vehicles"""
+        clone = copy.copy(self)
+        clone.rng = random.Random()
+        clone.rng.setstate(self.rng.getstate())
+        return clone
+
+    def resampled(self, seed):
+        """Copy that goes on at the same rates but draws its vehicles from `seed` instead"""
+        clone = copy.copy(self)
+        clone.rng = random.Random(seed)
+        return clone
+
+    def arrivals(self, step):
+        """Vehicles generated during the given physics step"""
+        current_time = step * TICK_MS
+        vehicles = []
+        while self.next_spawn_time <= current_time:
+            vehicles.append(self.next_vehicle())
+            self.next_spawn_time += self.spawn_interval(self.next_spawn_time)
+        return vehicles
+
+
+class HeadlessSimulation:
+    def __init__(self, controller, seed=0, demand=None, yellow_duration=2000, clearance_duration=2000,
+                 recorder=None):
+        self.controller = controller
+        self.demand = demand if demand is not None else Demand(seed)
+        self.recorder = recorder  # optional event_log.EventLogWriter
+        self.yellow_duration = yellow_duration
+        self.clearance_duration = clearance_duration  # longest all-red hold while the box clears
+
+        # Vehicles on the road, one entry per array slot
+        self.uid = np.empty(0, dtype=np.int64)
+        self.direction = np.empty(0, dtype=np.int64)
+        self.lane = np.empty(0, dtype=np.int64)
+        self.vclass = np.empty(0, dtype=np.int64)
+        self.turn = np.empty(0, dtype=np.int8)
+        self.pos = np.empty(0, dtype=np.float64)
+        self.speed = np.empty(0, dtype=np.float64)
+        self.length = np.empty(0, dtype=np.float64)
+        self.crossed = np.empty(0, dtype=bool)
+        self.wait_time = np.empty(0, dtype=np.int64)  # steps stopped since last moving, like Vehicle.wait_time
+        self.total_wait = np.empty(0, dtype=np.int64)  # steps stopped before the stop line
+
+        # Vehicles generated while their lane entry was still occupied
+        self.pending = [deque() for _ in range(noOfSignals * noOfLanes)]
+        self.next_uid = 0
+
+        self.tick = 0
+        self.states = [RED] * noOfSignals
+        self.current_green = None
+        self.green_duration = 0
+        self.last_change_time = 0
+        self.cycle_count = 0
+        self.cycle_cleared = 0
+
+        self.crossed_counts = np.zeros((noOfSignals, noOfLanes), dtype=np.int64)
+        self.waits = Tally(WAIT_BINS)  # steps waited by each vehicle that crossed
+        self.decision_count = 0
+        self.decision_total = 0.0  # seconds spent in the controller over all phase switches
+        self.recent_decisions = np.empty(0)  # the latest DECISION_WINDOW of them, replaced rather than written into
+        self.wall_time = 0.0
+
+    @property
+    def time_ms(self):
+        return self.tick * TICK_MS
+
+    def box_occupancy(self):
+        """Vehicles of each direction between the stop line and the far side of the box"""
+        in_box = self.crossed & (self.pos - self.length <= BOX_EXIT_DISTANCE[self.direction])
+        return np.bincount(self.direction[in_box], minlength=noOfSignals)
+
+    def observe(self):
+        """Traffic state in the dict layout the controllers consume"""
+        waiting = ~self.crossed
+        directions = self.direction[waiting]
+        counts = np.bincount(directions, minlength=noOfSignals)
+        wait_sums = np.bincount(directions, weights=self.wait_time[waiting], minlength=noOfSignals)
+        class_counts = np.bincount(directions * 5 + self.vclass[waiting], minlength=noOfSignals * 5)
+        class_counts = class_counts.reshape(noOfSignals, 5)
+        for key, queue in enumerate(self.pending):
+            direction = key // noOfLanes
+            for _, vclass, _, spawn_tick in queue:
+                counts[direction] += 1
+                wait_sums[direction] += self.tick - spawn_tick
+                class_counts[direction, vclass] += 1
+        counts = counts.tolist()
+        waits = [wait_sums[d] / counts[d] if counts[d] else 0 for d in range(noOfSignals)]
+        return {
+            'north_count': counts[0],
+            'east_count': counts[1],
+            'south_count': counts[2],
+            'west_count': counts[3],
+            'north_wait': waits[0],
+            'east_wait': waits[1],
+            'south_wait': waits[2],
+            'west_wait': waits[3],
+            'current_light': self.current_green,
+            'density': counts,
+            'class_counts': [{vehicleTypes[c]: int(class_counts[d, c]) for c in range(5)}
+                             for d in range(noOfSignals)],
+            'time': self.time_ms,
+        }
+
+    def cycle_outcome(self, state):
+        """(vehicles cleared, mean wait, density efficiency) of the cycle ending at `state`; None before the first"""
+        if self.current_green is None:
+            return None
+        vehicle_counts = [state['north_count'], state['east_count'], state['south_count'], state['west_count']]
+        avg_wait = (state['north_wait'] + state['east_wait'] + state['south_wait'] + state['west_wait']) / 4
+        return self.cycle_cleared, avg_wait, density_efficiency(vehicle_counts, self.current_green)
+
+    def switch_phase(self, current_time):
+        state = self.observe()
+        outcome = self.cycle_outcome(state)
+        start = time.perf_counter()
+        if outcome is not None:
+            self.controller.record_outcome(state, *outcome)
+        next_green, green_duration = self.controller.decide(state)
+        self.apply_decision(current_time, next_green, green_duration, time.perf_counter() - start)
+
+    def apply_decision(self, current_time, next_green, green_duration, seconds):
+        """Start the next green; `seconds` is what the decision took"""
+        self.decision_count += 1
+        self.decision_total += seconds
+        self.recent_decisions = np.append(self.recent_decisions[1 - DECISION_WINDOW:], seconds)
+        if self.recorder is not None:
+            self.recorder.decision(self.tick, int(next_green), green_duration)
+
+        self.current_green = int(next_green)
+        self.green_duration = green_duration
+        self.last_change_time = current_time
+        self.cycle_count += 1
+        self.cycle_cleared = 0
+
+    def switch_due(self, current_time):
+        """Whether the controller has to pick the next phase at current_time"""
+        if self.current_green is None:
+            return True
+        time_since_change = current_time - self.last_change_time
+        if time_since_change < self.green_duration + self.yellow_duration:
+            return False
+        # All red until the box has cleared, for at most clearance_duration
+        return (not self.box_occupancy().any() or
+                time_since_change >= self.green_duration + self.yellow_duration + self.clearance_duration)
+
+    def update_signals(self):
+        current_time = self.time_ms
+        if self.switch_due(current_time):
+            self.switch_phase(current_time)
+
+        time_since_change = current_time - self.last_change_time
+        for i in range(noOfSignals):
+            if i != self.current_green:
+                state = RED
+            elif time_since_change < self.green_duration:
+                state = GREEN
+            elif time_since_change < self.green_duration + self.yellow_duration:
+                state = YELLOW
+            else:
+                state = RED
+            if state != self.states[i] and self.recorder is not None:
+                self.recorder.phase(self.tick, i, state)
+            self.states[i] = state
+
+    def spawn_vehicles(self):
+        for direction, lane, vclass, will_turn in self.demand.arrivals(self.tick):
+            self.pending[direction * noOfLanes + lane].append((self.next_uid, vclass, will_turn, self.tick))
+            self.next_uid += 1
+            if self.recorder is not None:
+                self.recorder.spawn(self.tick, direction, lane, vclass, will_turn, CLASS_SPEEDS[vclass],
+                                    laneCoods[directionNumbers[direction]][lane])
+
+        if not any(self.pending):
+            return
+        # A lane can take a new vehicle once the last one has moved a gap onto the road
+        lane_rear = np.full(noOfSignals * noOfLanes, np.inf)
+        np.minimum.at(lane_rear, self.direction * noOfLanes + self.lane, self.pos - self.length)
+        new = []
+        for key, queue in enumerate(self.pending):
+            if queue and lane_rear[key] >= gap:
+                uid, vclass, will_turn, spawn_tick = queue.popleft()
+                new.append((uid, key // noOfLanes, key % noOfLanes, vclass, will_turn, self.tick - spawn_tick))
+        if new:
+            self.add_vehicles(new)
+
+    def add_vehicles(self, new):
+        uid, direction, lane, vclass, turn, waited = (np.array(column) for column in zip(*new))
+        self.uid = np.concatenate([self.uid, uid])
+        self.direction = np.concatenate([self.direction, direction])
+        self.lane = np.concatenate([self.lane, lane])
+        self.vclass = np.concatenate([self.vclass, vclass])
+        self.turn = np.concatenate([self.turn, turn.astype(np.int8)])
+        self.pos = np.concatenate([self.pos, np.zeros(len(new))])
+        self.speed = np.concatenate([self.speed, CLASS_SPEEDS[vclass]])
+        self.length = np.concatenate([self.length, CLASS_LENGTHS[vclass]])
+        self.crossed = np.concatenate([self.crossed, np.zeros(len(new), dtype=bool)])
+        self.wait_time = np.concatenate([self.wait_time, waited])
+        self.total_wait = np.concatenate([self.total_wait, waited])
+
+    def move_vehicles(self):
+        if not len(self.pos):
+            return
+        direction = self.direction
+        pos = self.pos
+        green = np.array([state == GREEN for state in self.states])
+
+        target = pos + self.speed
+        # Vehicles that have not crossed stop at the stop line unless their light is green
+        blocked = ~self.crossed & ~green[direction]
+        target = np.where(blocked, np.minimum(target, STOP_DISTANCE[direction]), target)
+
+        # Keep a gap behind the vehicle ahead in the same lane
+        lane_key = direction * noOfLanes + self.lane
+        order = np.lexsort((-pos, lane_key))
+        same_lane = lane_key[order[1:]] == lane_key[order[:-1]]
+        ahead = order[:-1][same_lane]
+        behind = order[1:][same_lane]
+        target[behind] = np.minimum(target[behind], pos[ahead] - self.length[ahead] - gap)
+
+        new_pos = np.maximum(target, pos)
+        moved = new_pos > pos
+        self.wait_time = np.where(moved, 0, self.wait_time + 1)
+        self.total_wait = self.total_wait + (~moved & ~self.crossed)
+        self.pos = new_pos
+
+        crossed_now = ~self.crossed & (new_pos > STOP_LINE_DISTANCE[direction])
+        if crossed_now.any():
+            self.crossed = self.crossed | crossed_now
+            np.add.at(self.crossed_counts, (direction[crossed_now], self.lane[crossed_now]), 1)
+            self.waits = self.waits.add(self.total_wait[crossed_now])
+            self.cycle_cleared += int(crossed_now.sum())
+
+        gone = new_pos - self.length > END_DISTANCE[direction]
+        if gone.any():
+            self.remove_vehicles(~gone)
+
+    def remove_vehicles(self, keep):
+        for name in VEHICLE_ARRAYS:
+            setattr(self, name, getattr(self, name)[keep])
+
+    def queued_wait(self):
+        """Steps waited so far by the vehicles that have not crossed, including those not yet on the road"""
+        waited = int(self.total_wait[~self.crossed].sum())
+        for queue in self.pending:
+            waited += sum(self.tick - spawn_tick for _, _, _, spawn_tick in queue)
+        return waited
+
+    def snapshot(self):
+        """State to come back to with restore() or to branch from with fork()
+
+        The vehicle arrays are shared rather than copied, since steps never
+        write into them, so a snapshot costs about the same at any number of
+        vehicles. The vehicles waiting to enter, the crossed counts and the
+        demand's random state are copied. Waits and decision times are kept
+        as fixed-size tallies that are replaced rather than updated, so they
+        are shared the same way.
+        """
+        return Snapshot(
+            arrays={name: getattr(self, name) for name in VEHICLE_ARRAYS},
+            pending=[tuple(queue) for queue in self.pending],
+            signals=(self.tick, self.next_uid, list(self.states), self.current_green, self.green_duration,
+                     self.last_change_time, self.cycle_count, self.cycle_cleared, self.wall_time),
+            crossed_counts=self.crossed_counts.copy(),
+            demand=self.demand.fork(),
+            history=(self.waits, self.decision_count, self.decision_total, self.recent_decisions),
+        )
+
+    def restore(self, snapshot):
+        """Return to a snapshot taken from this simulation or the one it was forked from"""
+        for name, array in snapshot.arrays.items():
+            setattr(self, name, array)
+        self.pending = [deque(queue) for queue in snapshot.pending]
+        (self.tick, self.next_uid, states, self.current_green, self.green_duration, self.last_change_time,
+         self.cycle_count, self.cycle_cleared, self.wall_time) = snapshot.signals
+        self.states = list(states)
+        self.crossed_counts = snapshot.crossed_counts.copy()
+        self.demand = snapshot.demand.fork()
+        self.waits, self.decision_count, self.decision_total, self.recent_decisions = snapshot.history
+
+    def fork(self, controller, snapshot=None):
+        """New simulation continuing from now, or from `snapshot`, with its own controller and no recorder"""
+        clone = copy.copy(self)
+        clone.controller = controller
+        clone.recorder = None
+        clone.restore(snapshot if snapshot is not None else self.snapshot())
+        return clone
+
+    def step(self):
+        self.spawn_vehicles()
+        if self.controller.observe_every_step:
+            self.controller.observe(self.observe())
+        self.update_signals()
+        self.move_vehicles()
+        self.tick += 1
+
+    def run(self, seconds):
+        """Advance the simulation by the given number of simulated seconds"""
+        steps = int(round(seconds * 1000 / TICK_MS))
+        start = time.perf_counter()
+        for _ in range(steps):
+            self.step()
+        self.wall_time += time.perf_counter() - start
+        return self.summary()
+
+    def summary(self):
+        """Throughput, wait and controller cost for the run so far"""
+        sim_seconds = self.time_ms / 1000
+        # Vehicles still queued count with the wait they have accumulated so far
+        waits = self.waits.add(self.total_wait[~self.crossed])
+        waits = waits.add(np.array([self.tick - spawn_tick for queue in self.pending for _, _, _, spawn_tick in queue],
+                                   dtype=np.int64))
+        decisions = self.recent_decisions * 1000
+        crossed = int(self.crossed_counts.sum())
+        return {
+            'sim_seconds': sim_seconds,
+            'crossed': crossed,
+            'lane_crossed': self.crossed_counts.tolist(),
+            'throughput': crossed / sim_seconds * 60 if sim_seconds else 0,  # vehicles per minute
+            'mean_wait': waits.mean() * TICK_MS / 1000,
+            'p95_wait': waits.percentile(95) * TICK_MS / 1000,
+            'cycles': self.cycle_count,
+            'decision_ms': self.decision_total / self.decision_count * 1000 if self.decision_count else 0.0,
+            'decision_p95_ms': float(np.percentile(decisions, 95)) if len(decisions) else 0.0,
+            'steps_per_second': self.tick / self.wall_time if self.wall_time else 0.0,
+        }
+
+
+class Snapshot:
+    """Frozen HeadlessSimulation state; see HeadlessSimulation.snapshot()"""
+    __slots__ = ('arrays', 'pending', 'signals', 'crossed_counts', 'demand', 'history')
+
+    def __init__(self, arrays, pending, signals, crossed_counts, demand, history):
+        self.arrays = arrays
+        self.pending = pending
+        self.signals = signals
+        self.crossed_counts = crossed_counts
+        self.demand = demand
+        self.history = history
+
+    @property
+    def vehicles(self):
+        return len(self.arrays['pos']) + sum(len(queue) for queue in self.pending)
+
+
+class Tally:
+    """Count, sum, sum of squares and histogram of whole-step waits, in constant memory
+
+    The sums are exact Python integers. The histogram has one bin per step
+    below `bins - 1` and a last bin for everything longer, so percentiles are
+    exact up to there. add() returns a new tally instead of changing this
+    one, which lets snapshots and forks share tallies without copying them.
+    """
+    __slots__ = ('count', 'total', 'squares', 'histogram')
+
+    def __init__(self, bins, count=0, total=0, squares=0, histogram=None):
+        self.count = count
+        self.total = total
+        self.squares = squares
+        self.histogram = np.zeros(bins, dtype=np.int64) if histogram is None else histogram
+
+    def __len__(self):
+        return self.count
+
+    def add(self, steps):
+        if not len(steps):
+            return self
+        histogram = self.histogram.copy()
+        np.add.at(histogram, np.minimum(steps, len(histogram) - 1), 1)
+        return Tally(len(histogram), self.count + len(steps), self.total + int(steps.sum()),
+                     self.squares + int(steps @ steps), histogram)
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, q):
+        """np.percentile of the waits added, with its linear interpolation between neighbouring ranks"""
+        if not self.count:
+            return 0.0
+        rank = q / 100 * (self.count - 1)
+        below = int(rank)
+        cumulative = np.cumsum(self.histogram)
+        low, high = np.searchsorted(cumulative, [below, min(below + 1, self.count - 1)], side='right')
+        return float(low + (high - low) * (rank - below))
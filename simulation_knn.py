@@ -3,13 +3,22 @@ import random
 import math
 from collections import defaultdict
 import numpy as np
-from sklearn.neighbors import KNeighborsRegressor
-from sklearn.impute import SimpleImputer
+import controllers
+from controllers import KNNTrafficController, FEATURE_NAMES, DIRECTION_NAMES
 import matplotlib.pyplot as plt
 import csv
 import os
 import time
+import argparse
 from datetime import datetime
+from sim_clock import SimulationClock
+from event_log import EventLog, EventLogWriter
+from frame_profiler import FrameProfiler
+from memory_monitor import MemoryMonitor
+from telemetry import TelemetryServer
+from time_travel import SnapshotRing, SCRUB_STEP, MB
+import retention
+from retraining import RetrainScheduler, AlwaysRetrain
 
 # Initialize pygame
 pygame.init()
@@ -41,11 +50,34 @@ INTERSECTION_BOTTOM = 450
 INTERSECTION_LEFT = 300
 INTERSECTION_RIGHT = 500
 
+# Vehicles of each direction inside the box, kept up to date by Vehicle.move()
+# so clearance checks don't have to scan every vehicle
+intersection_occupancy = [0] * 4
+
 # Efficiency tracker settings
 EFFICIENCY_WINDOW_SIZE = 10  # Number of cycles to average for efficiency calculation
 GRAPH_UPDATE_INTERVAL = 1000  # Update graph every 1000 milliseconds
 CSV_SAVE_INTERVAL = 30000  # Save to CSV every 30 seconds
 
+# Simulated time; main() replaces it with one configured from the command line
+sim_clock = SimulationClock()
+event_recorder = None  # EventLogWriter when started with --record
+profiler = FrameProfiler()  # enabled with --profile or the P key
+telemetry = None  # TelemetryServer when started with --telemetry
+
+# Rewind snapshots: one STATE_DTYPE record for the clock, the main loop's counters, the lights and the random
+# generator, and one VEHICLE_DTYPE row per vehicle. The KNN model and the data it learnt from are not rewound.
+LIGHT_COLORS = (RED, YELLOW, GREEN)
+STATE_DTYPE = np.dtype([
+    ('step', '<i8'), ('spawn_timer', '<i4'), ('total_crossed', '<i4'), ('spawned', '<i4', 4),
+    ('current_green', 'i1'), ('lights', 'u1', 4), ('yellow', '?', 4), ('green_duration', '<f8'),
+    ('last_change_time', '<f8'), ('cycle_count', '<i4'), ('avg_wait_before', '<f8'),
+    ('last_cycle_crossed', '<i4'), ('log_offset', '<i8'), ('rng', '<u4', 625)])
+VEHICLE_DTYPE = np.dtype([
+    ('x', '<f8'), ('y', '<f8'), ('speed', '<f8'), ('direction', 'u1'), ('entered', '?'), ('exited', '?'),
+    ('waiting', '?'), ('wait_time', '<i4'), ('total_wait_time', '<i4'), ('entry_time', '<f8'),
+    ('creation_time', '<f8')])
+
 def create_intersection_background():
     background = pygame.Surface((WIDTH, HEIGHT))
     background.fill(GRAY)
@@ -63,6 +95,16 @@ try:
 except:
     road_img = create_intersection_background()
 
+def spawn_position(direction, offset):
+    """Screen position a vehicle enters at, given its coordinate across the road"""
+    if direction == NORTH:
+        return offset, HEIGHT + 30
+    elif direction == EAST:
+        return -30, offset
+    elif direction == SOUTH:
+        return offset, -30
+    return WIDTH + 30, offset
+
 class Vehicle:
     def __init__(self, x, y, direction):
         self.x = x
@@ -77,7 +119,7 @@ class Vehicle:
         self.car_surface = self.create_car_surface()
         self.waiting = False
         self.total_wait_time = 0
-        self.creation_time = pygame.time.get_ticks()
+        self.creation_time = sim_clock.now()
 
     def create_car_surface(self):
         car = pygame.Surface((40, 80), pygame.SRCALPHA)
@@ -115,33 +157,41 @@ class Vehicle:
                 self.y -= self.speed
                 if not self.has_entered_intersection and self.y < INTERSECTION_BOTTOM:
                     self.has_entered_intersection = True
-                    self.entry_time = pygame.time.get_ticks()
-                if self.y < INTERSECTION_TOP:
+                    intersection_occupancy[self.direction] += 1
+                    self.entry_time = sim_clock.now()
+                if not self.has_exited_intersection and self.y < INTERSECTION_TOP:
                     self.has_exited_intersection = True
+                    intersection_occupancy[self.direction] -= 1
                     self.update_color()
             elif self.direction == EAST:
                 self.x += self.speed
                 if not self.has_entered_intersection and self.x > INTERSECTION_LEFT:
                     self.has_entered_intersection = True
-                    self.entry_time = pygame.time.get_ticks()
-                if self.x > INTERSECTION_RIGHT:
+                    intersection_occupancy[self.direction] += 1
+                    self.entry_time = sim_clock.now()
+                if not self.has_exited_intersection and self.x > INTERSECTION_RIGHT:
                     self.has_exited_intersection = True
+                    intersection_occupancy[self.direction] -= 1
                     self.update_color()
             elif self.direction == SOUTH:
                 self.y += self.speed
                 if not self.has_entered_intersection and self.y > INTERSECTION_TOP:
                     self.has_entered_intersection = True
-                    self.entry_time = pygame.time.get_ticks()
-                if self.y > INTERSECTION_BOTTOM:
+                    intersection_occupancy[self.direction] += 1
+                    self.entry_time = sim_clock.now()
+                if not self.has_exited_intersection and self.y > INTERSECTION_BOTTOM:
                     self.has_exited_intersection = True
+                    intersection_occupancy[self.direction] -= 1
                     self.update_color()
             elif self.direction == WEST:
                 self.x -= self.speed
                 if not self.has_entered_intersection and self.x < INTERSECTION_RIGHT:
                     self.has_entered_intersection = True
-                    self.entry_time = pygame.time.get_ticks()
-                if self.x < INTERSECTION_LEFT:
+                    intersection_occupancy[self.direction] += 1
+                    self.entry_time = sim_clock.now()
+                if not self.has_exited_intersection and self.x < INTERSECTION_LEFT:
                     self.has_exited_intersection = True
+                    intersection_occupancy[self.direction] -= 1
                     self.update_color()
             self.wait_time = 0
         else:
@@ -171,13 +221,13 @@ class Vehicle:
 
     def get_journey_time(self):
         """Return the total time this vehicle has been in the simulation"""
-        return pygame.time.get_ticks() - self.creation_time
+        return sim_clock.now() - self.creation_time
 
 class EfficiencyTracker:
     def __init__(self):
         self.data = []
-        self.last_graph_update = pygame.time.get_ticks()
-        self.last_csv_save = pygame.time.get_ticks()
+        self.last_graph_update = time.perf_counter() * 1000
+        self.last_csv_save = sim_clock.now()
         self.filename = f"traffic_efficiency_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
         self.header_written = False
         
@@ -199,15 +249,16 @@ class EfficiencyTracker:
             self.data = self.data[-100:]
         
         # Save data to CSV periodically
-        current_time = pygame.time.get_ticks()
+        current_time = sim_clock.now()
         if current_time - self.last_csv_save > CSV_SAVE_INTERVAL:
             self.save_to_csv()
             self.last_csv_save = current_time
             
-        # Update plots periodically
-        if current_time - self.last_graph_update > GRAPH_UPDATE_INTERVAL:
+        # Update plots periodically (wall time, so turbo runs don't redraw every cycle)
+        wall_time = time.perf_counter() * 1000
+        if wall_time - self.last_graph_update > GRAPH_UPDATE_INTERVAL:
             self.update_plots()
-            self.last_graph_update = current_time
+            self.last_graph_update = wall_time
 
     def calculate_average_efficiency(self):
         """Calculate average efficiency from recent cycles"""
@@ -321,124 +372,27 @@ class EfficiencyTracker:
         except Exception as e:
             print(f"Error updating plots: {e}")
 
-class TrafficDataCollector:
-    def __init__(self):
-        self.history = []
-        self.current_state = {}
-        self.features = []
-        self.labels = []
-
-    def record_state(self, vehicle_counts, wait_times, current_light):
-        self.current_state = {
-            'north_count': vehicle_counts[NORTH],
-            'east_count': vehicle_counts[EAST],
-            'south_count': vehicle_counts[SOUTH],
-            'west_count': vehicle_counts[WEST],
-            'north_wait': wait_times[NORTH],
-            'east_wait': wait_times[EAST],
-            'south_wait': wait_times[SOUTH],
-            'west_wait': wait_times[WEST],
-            'current_light': current_light
-        }
-
-    def record_outcome(self, vehicles_cleared, avg_wait_time, density_efficiency):
-        self.current_state['outcome'] = vehicles_cleared * 10 - avg_wait_time + density_efficiency
-        self.history.append(self.current_state)
-        features = [
-            self.current_state['north_count'],
-            self.current_state['east_count'],
-            self.current_state['south_count'],
-            self.current_state['west_count'],
-            self.current_state['north_wait'],
-            self.current_state['east_wait'],
-            self.current_state['south_wait'],
-            self.current_state['west_wait'],
-            self.current_state['current_light']
-        ]
-        self.features.append(features)
-        self.labels.append(self.current_state['outcome'])
-
-class KNNTrafficController:
-    def __init__(self):
-        self.model = KNeighborsRegressor(n_neighbors=3)
-        self.is_trained = False
-        self.imputer = SimpleImputer(strategy='mean')
-
-    def train(self, features, labels):
-        if len(features) > 10:
-            X = np.array(features)
-            y = np.array(labels)
-            X = self.imputer.fit_transform(X)
-            self.model.fit(X, y)
-            self.is_trained = True
-            print("KNN model trained with", len(features), "samples")
-
-    def predict_best_duration(self, current_state):
-        if not self.is_trained:
-            # Default duration based on highest density
-            max_direction = max([NORTH, EAST, SOUTH, WEST], 
-                              key=lambda d: current_state[f"{['north', 'east', 'south', 'west'][d]}_count"])
-            base_duration = 5000
-            density_factor = current_state[f"{['north', 'east', 'south', 'west'][max_direction]}_count"] * 100
-            return min(10000, max(3000, base_duration + density_factor))
-            
-        features = [
-            current_state['north_count'],
-            current_state['east_count'],
-            current_state['south_count'],
-            current_state['west_count'],
-            current_state['north_wait'],
-            current_state['east_wait'],
-            current_state['south_wait'],
-            current_state['west_wait'],
-            current_state['current_light']
-        ]
-        features = self.imputer.transform([features])
-        prediction = self.model.predict(features)[0]
-        return max(3000, min(10000, 5000 + prediction * 100))
-
 class TrafficLightSystem:
-    def __init__(self):
+    def __init__(self, retention_policy=None, retrain_scheduler=None):
         self.states = [RED] * 4
         self.yellow_states = [False] * 4
         self.current_green = None
         self.green_duration = 5000
         self.yellow_duration = 2000
-        self.last_change_time = pygame.time.get_ticks()
-        self.sequence = [NORTH, EAST, SOUTH, WEST]
-        self.data_collector = TrafficDataCollector()
-        self.knn_controller = KNNTrafficController()
+        self.last_change_time = sim_clock.now()
+        self.controller = KNNTrafficController(retention=retention_policy, retrain_scheduler=retrain_scheduler)
         self.efficiency_tracker = EfficiencyTracker()
         self.avg_wait_before = 0
         self.last_cycle_vehicles_crossed = 0
         self.cycle_count = 0
 
-    def check_intersection_clear(self, vehicles):
-        for vehicle in vehicles:
-            if vehicle.is_in_intersection() and vehicle.direction != self.current_green:
-                return False
-        return True
-
-    def calculate_density_efficiency(self, vehicle_counts, current_green):
-        """Calculate efficiency based on how well we're serving the highest density direction"""
-        if current_green is None:
-            return 0
-            
-        max_direction = max([NORTH, EAST, SOUTH, WEST], key=lambda d: vehicle_counts[d])
-        max_count = vehicle_counts[max_direction]
-        current_count = vehicle_counts[current_green]
-        
-        if max_count == 0:
-            return 0
-            
-        # Efficiency is higher when we're giving green to the highest density direction
-        if current_green == max_direction:
-            return 100 * (current_count / max_count)
-        else:
-            return -50 * (1 - (current_count / max_count))
+    def check_intersection_clear(self, vehicles=None):
+        """True when no vehicle from a direction other than the green one is in the box"""
+        return not any(count for direction, count in enumerate(intersection_occupancy)
+                       if direction != self.current_green)
 
     def update(self, vehicles):
-        current_time = pygame.time.get_ticks()
+        current_time = sim_clock.now()
         time_since_change = current_time - self.last_change_time
         vehicle_counts = defaultdict(int)
         wait_times = defaultdict(int)
@@ -453,14 +407,13 @@ class TrafficLightSystem:
                 wait_times[direction] /= vehicle_counts[direction]
         
         self.avg_wait_before = sum(wait_times.values()) / 4 if len(wait_times) > 0 else 0
-        self.data_collector.record_state(vehicle_counts, wait_times, self.current_green)
 
         # Calculate current efficiency metrics
         cleared = sum(1 for v in vehicles if v.has_exited_intersection and v.entry_time > self.last_change_time)
         avg_wait = sum(wait_times.values()) / 4 if len(wait_times) > 0 else 0
         
         # Calculate density-based efficiency
-        density_efficiency = self.calculate_density_efficiency(vehicle_counts, self.current_green)
+        density_efficiency = controllers.density_efficiency(vehicle_counts, self.current_green)
         
         # Combined efficiency metric (50% density efficiency, 30% wait time reduction, 20% throughput)
         efficiency_percentage = (0.5 * density_efficiency) +  0.3 * (100 * (1 - avg_wait/max(1, self.avg_wait_before))) +  0.2 * (cleared * 100 / max(1, sum(vehicle_counts.values())))
@@ -484,40 +437,32 @@ class TrafficLightSystem:
         
         # Check if it's time to change traffic light
         if time_since_change > self.green_duration + self.yellow_duration:
-            # When cycle completes, record the outcome and efficiency data
-            self.data_collector.record_outcome(cleared, avg_wait, density_efficiency)
-            self.efficiency_tracker.record_cycle(cycle_data)
+            # Traffic state at the end of the cycle, in the controllers' layout
+            state = {'current_light': self.current_green}
+            for direction, name in enumerate(DIRECTION_NAMES):
+                state[f"{name}_count"] = vehicle_counts[direction]
+                state[f"{name}_wait"] = wait_times.get(direction, 0)
+
+            # When a cycle completes, the controller learns from its outcome and may retrain
+            if self.current_green is not None:
+                self.controller.record_outcome(state, cleared, avg_wait, density_efficiency)
+            with profiler.stage('efficiency'):
+                self.efficiency_tracker.record_cycle(cycle_data)
             self.cycle_count += 1
-            
-            # Train KNN model with collected data
-            self.knn_controller.train(self.data_collector.features, self.data_collector.labels)
-            
-            # Switch to next light in sequence
-            if self.current_green is None:
-                self.current_green = self.sequence[0]
-            else:
-                current_index = self.sequence.index(self.current_green)
-                self.current_green = self.sequence[(current_index + 1) % 4]
-            
-            # Get current traffic state for KNN prediction
-            current_state = {
-                'north_count': vehicle_counts[NORTH],
-                'east_count': vehicle_counts[EAST],
-                'south_count': vehicle_counts[SOUTH],
-                'west_count': vehicle_counts[WEST],
-                'north_wait': wait_times.get(NORTH, 0),
-                'east_wait': wait_times.get(EAST, 0),
-                'south_wait': wait_times.get(SOUTH, 0),
-                'west_wait': wait_times.get(WEST, 0),
-                'current_light': self.current_green
-            }
-            
-            # Predict optimal green duration based on current state
-            self.green_duration = self.knn_controller.predict_best_duration(current_state)
+            if telemetry is not None:
+                telemetry.publish(dict(cycle_data, cycle=self.cycle_count, trained=int(self.controller.is_trained),
+                                       samples=len(self.controller.data_collector.features),
+                                       retrains=len(self.controller.retrain_scheduler.retrains)))
+
+            next_green, self.green_duration = self.controller.decide(state)
+            self.current_green = int(next_green)
+            if event_recorder is not None:
+                event_recorder.decision(sim_clock.step, self.current_green, self.green_duration)
             self.last_change_time = current_time
             self.last_cycle_vehicles_crossed = cleared
 
         # Update traffic light states
+        previous_states = list(self.states)
         for i in range(4):
             if i == self.current_green:
                 if time_since_change > self.green_duration:
@@ -529,6 +474,10 @@ class TrafficLightSystem:
             else:
                 self.states[i] = RED
                 self.yellow_states[i] = False
+        if event_recorder is not None:
+            for i in range(4):
+                if self.states[i] != previous_states[i]:
+                    event_recorder.phase(sim_clock.step, i, (RED, YELLOW, GREEN).index(self.states[i]))
 
     def draw(self):
         light_positions = [
@@ -543,124 +492,292 @@ class TrafficLightSystem:
             pygame.draw.circle(screen, YELLOW if self.states[i] == YELLOW else (50, 50, 0), (pos[0], pos[1]), 10)
             pygame.draw.circle(screen, GREEN if self.states[i] == GREEN else (0, 50, 0), (pos[0], pos[1] + 30), 10)
 
+def capture_state(vehicles, traffic_light_system, spawn_timer, vehicle_counters, total_crossed):
+    """The simulation as a STATE_DTYPE record and VEHICLE_DTYPE rows, for the rewind history"""
+    lights = traffic_light_system
+    state = np.zeros((), dtype=STATE_DTYPE)
+    state['step'] = sim_clock.step
+    state['spawn_timer'] = spawn_timer
+    state['total_crossed'] = total_crossed
+    state['spawned'] = [vehicle_counters[d] for d in (NORTH, EAST, SOUTH, WEST)]
+    state['current_green'] = -1 if lights.current_green is None else lights.current_green
+    state['lights'] = [LIGHT_COLORS.index(color) for color in lights.states]
+    state['yellow'] = lights.yellow_states
+    state['green_duration'] = lights.green_duration
+    state['last_change_time'] = lights.last_change_time
+    state['cycle_count'] = lights.cycle_count
+    state['avg_wait_before'] = lights.avg_wait_before
+    state['last_cycle_crossed'] = lights.last_cycle_vehicles_crossed
+    state['log_offset'] = event_recorder.tell() if event_recorder is not None else 0
+    state['rng'] = random.getstate()[1]
+    rows = np.array([(v.x, v.y, v.speed, v.direction, v.has_entered_intersection, v.has_exited_intersection,
+                      v.waiting, v.wait_time, v.total_wait_time, v.entry_time, v.creation_time) for v in vehicles],
+                    dtype=VEHICLE_DTYPE)
+    return state, rows
+
+def restore_state(state, rows, traffic_light_system, vehicle_counters):
+    """Put the clock, lights and random generator back as in a snapshot; returns (vehicles, spawn timer, crossed)"""
+    vehicles = []
+    intersection_occupancy[:] = [0] * 4
+    for row in rows.tolist():
+        x, y, speed, direction, entered, exited, waiting, wait_time, total_wait_time, entry_time, creation_time = row
+        vehicle = Vehicle(x, y, direction)
+        vehicle.speed = speed
+        vehicle.has_entered_intersection = entered
+        vehicle.has_exited_intersection = exited
+        vehicle.waiting = waiting
+        vehicle.wait_time = wait_time
+        vehicle.total_wait_time = total_wait_time
+        vehicle.entry_time = entry_time
+        vehicle.creation_time = creation_time
+        if waiting or exited:
+            vehicle.update_color()
+        if entered and not exited:
+            intersection_occupancy[direction] += 1
+        vehicles.append(vehicle)
+    lights = traffic_light_system
+    lights.current_green = None if state['current_green'] < 0 else int(state['current_green'])
+    lights.states = [LIGHT_COLORS[i] for i in state['lights'].tolist()]
+    lights.yellow_states = state['yellow'].tolist()
+    lights.green_duration = float(state['green_duration'])
+    lights.last_change_time = float(state['last_change_time'])
+    lights.cycle_count = int(state['cycle_count'])
+    lights.avg_wait_before = float(state['avg_wait_before'])
+    lights.last_cycle_vehicles_crossed = int(state['last_cycle_crossed'])
+    for d, count in zip((NORTH, EAST, SOUTH, WEST), state['spawned'].tolist()):
+        vehicle_counters[d] = count
+    # Last, as making the vehicles above drew random speeds
+    random.setstate((random.Random.VERSION, tuple(state['rng'].tolist()), None))
+    sim_clock.seek(int(state['step']))
+    return vehicles, int(state['spawn_timer']), int(state['total_crossed'])
+
 def main():
+    global sim_clock, event_recorder, profiler, telemetry
+    parser = argparse.ArgumentParser(description=pygame.display.get_caption()[0])
+    SimulationClock.add_arguments(parser)
+    FrameProfiler.add_arguments(parser)
+    MemoryMonitor.add_arguments(parser)
+    TelemetryServer.add_arguments(parser)
+    SnapshotRing.add_arguments(parser)
+    retention.add_arguments(parser)
+    parser.add_argument('--retrain', choices=['drift', 'always'], default='drift',
+                        help="refit the model on drift or after enough new samples, or after every cycle")
+    parser.add_argument('--dataset', metavar='CSV', help="save the collected training rows here on exit")
+    parser.add_argument('--seed', type=int, help="seed the vehicle generator for a reproducible run")
+    parser.add_argument('--record', metavar='LOG', help="write spawns, phase changes and decisions to an event log")
+    parser.add_argument('--replay', metavar='LOG', help="take vehicles from an event log instead of the generator")
+    args = parser.parse_args()
+    sim_clock = SimulationClock.from_args(args)
+    profiler = FrameProfiler(enabled=args.profile or bool(args.profile_export))
+    memory_monitor = MemoryMonitor.from_args(args)
+    memory_monitor.start()
+    telemetry = TelemetryServer.from_args(args, os.path.splitext(os.path.basename(__file__))[0])
+    rewind = SnapshotRing.from_args(args, STATE_DTYPE, VEHICLE_DTYPE)
+    if rewind is not None:
+        print(f"Rewind: {rewind.capacity} snapshots {args.rewind_interval:g} s apart, "
+              f"{len(rewind.rows)} vehicle rows, {rewind.nbytes() / MB:.1f} MB")
+    if args.seed is not None:
+        random.seed(args.seed)
+    replay = EventLog(args.replay) if args.replay else None
+    if args.record:
+        event_recorder = EventLogWriter(args.record, source=os.path.basename(__file__), seed=args.seed,
+                                        tick_ms=sim_clock.dt_ms)
+
     running = True
-    clock = pygame.time.Clock()
     vehicles = []
     spawn_timer = 0
-    traffic_light_system = TrafficLightSystem()
+    traffic_light_system = TrafficLightSystem(
+        retention.make_retention(args.retention, args.max_samples, args.seed or 0),
+        RetrainScheduler(feature_names=FEATURE_NAMES) if args.retrain == 'drift' else AlwaysRetrain())
     font = pygame.font.SysFont('Arial', 24)
     small_font = pygame.font.SysFont('Arial', 18)
     vehicle_counters = {NORTH: 0, EAST: 0, SOUTH: 0, WEST: 0}
     total_crossed = 0
     
     # Start time for simulation
-    start_time = pygame.time.get_ticks()
+    start_time = sim_clock.now()
     
-    while running:
+    while running and not sim_clock.finished():
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 running = False
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_t:
+                    sim_clock.toggle_turbo()
+                elif event.key in (pygame.K_PLUS, pygame.K_EQUALS, pygame.K_KP_PLUS):
+                    sim_clock.faster()
+                elif event.key in (pygame.K_MINUS, pygame.K_KP_MINUS):
+                    sim_clock.slower()
+                elif event.key == pygame.K_p:
+                    profiler.toggle()
+                elif rewind is not None and event.key == pygame.K_SPACE:
+                    if not rewind.paused:
+                        rewind.pause(sim_clock.now(), *capture_state(vehicles, traffic_light_system, spawn_timer,
+                                                                     vehicle_counters, total_crossed))
+                    else:
+                        # The run takes another course from here, so the log loses what came after too
+                        state, _ = rewind.shown()
+                        if event_recorder is not None:
+                            event_recorder.truncate(int(state['log_offset']))
+                        rewind.resume()
+                        sim_clock.seek(int(state['step']))
+                elif rewind is not None and rewind.paused and event.key in (pygame.K_LEFT, pygame.K_RIGHT,
+                                                                            pygame.K_HOME, pygame.K_END):
+                    if event.key in (pygame.K_HOME, pygame.K_END):
+                        delta = (-1 if event.key == pygame.K_HOME else 1) * rewind.capacity
+                    else:
+                        delta = (-1 if event.key == pygame.K_LEFT else 1) * (
+                            SCRUB_STEP if event.mod & pygame.KMOD_SHIFT else 1)
+                    if rewind.scrub(delta):
+                        vehicles, spawn_timer, total_crossed = restore_state(*rewind.shown(), traffic_light_system,
+                                                                             vehicle_counters)
                 
-        # Vehicle spawning logic
-        spawn_timer += 1
-        if spawn_timer >= 30:
-            direction = random.randint(0, 3)
-            if direction == NORTH:
-                x = random.randint(INTERSECTION_LEFT + 50, INTERSECTION_RIGHT - 50)
-                y = HEIGHT + 30
-            elif direction == EAST:
-                x = -30
-                y = random.randint(INTERSECTION_TOP + 50, INTERSECTION_BOTTOM - 50)
-            elif direction == SOUTH:
-                x = random.randint(INTERSECTION_LEFT + 50, INTERSECTION_RIGHT - 50)
-                y = -30
-            else:
-                x = WIDTH + 30
-                y = random.randint(INTERSECTION_TOP + 50, INTERSECTION_BOTTOM - 50)
-            vehicles.append(Vehicle(x, y, direction))
-            vehicle_counters[direction] += 1
-            spawn_timer = 0
+        # Fixed-step physics; how many steps run per frame depends on speed/turbo only
+        for _ in () if rewind is not None and rewind.paused else sim_clock.physics_steps():
+            if rewind is not None and rewind.due(sim_clock.now()):
+                rewind.push(sim_clock.now(), *capture_state(vehicles, traffic_light_system, spawn_timer,
+                                                            vehicle_counters, total_crossed))
+
+            # Vehicle spawning logic
+            with profiler.stage('spawn'):
+                spawn_timer += 1
+                if replay is not None:
+                    for spawn in replay.spawns_at(sim_clock.step):
+                        vehicle = Vehicle(*spawn_position(spawn.direction, spawn.offset), spawn.direction)
+                        vehicle.speed = spawn.speed
+                        vehicles.append(vehicle)
+                        if event_recorder is not None:
+                            event_recorder.spawn(sim_clock.step, spawn.direction, spawn.lane, spawn.vclass,
+                                                 spawn.turn, spawn.speed, spawn.offset)
+                        vehicle_counters[spawn.direction] += 1
+                elif spawn_timer >= 30:
+                    direction = random.randint(0, 3)
+                    if direction == NORTH:
+                        x = random.randint(INTERSECTION_LEFT + 50, INTERSECTION_RIGHT - 50)
+                        y = HEIGHT + 30
+                    elif direction == EAST:
+                        x = -30
+                        y = random.randint(INTERSECTION_TOP + 50, INTERSECTION_BOTTOM - 50)
+                    elif direction == SOUTH:
+                        x = random.randint(INTERSECTION_LEFT + 50, INTERSECTION_RIGHT - 50)
+                        y = -30
+                    else:
+                        x = WIDTH + 30
+                        y = random.randint(INTERSECTION_TOP + 50, INTERSECTION_BOTTOM - 50)
+                    vehicle = Vehicle(x, y, direction)
+                    vehicles.append(vehicle)
+                    if event_recorder is not None:
+                        event_recorder.spawn(sim_clock.step, direction, 0, 0, 0, vehicle.speed,
+                                             x if direction in (NORTH, SOUTH) else y)
+                    vehicle_counters[direction] += 1
+                    spawn_timer = 0
             
-        # Update traffic light system
-        traffic_light_system.update(vehicles)
+            # Update traffic light system
+            if sim_clock.control_due():
+                with profiler.stage('lights'):
+                    traffic_light_system.update(vehicles)
         
-        # Update and remove vehicles
-        vehicles_to_remove = []
-        for vehicle in vehicles:
-            vehicle.move(traffic_light_system.states, traffic_light_system.yellow_states)
-            if vehicle.is_off_screen():
-                vehicles_to_remove.append(vehicle)
-                if vehicle.has_exited_intersection:
-                    total_crossed += 1
+            # Update and remove vehicles
+            with profiler.stage('move'):
+                vehicles_to_remove = []
+                for vehicle in vehicles:
+                    vehicle.move(traffic_light_system.states, traffic_light_system.yellow_states)
+                    if vehicle.is_off_screen():
+                        vehicles_to_remove.append(vehicle)
+                        if vehicle.has_exited_intersection:
+                            total_crossed += 1
         
-        for vehicle in vehicles_to_remove:
-            vehicles.remove(vehicle)
-            
-        # Draw everything
-        screen.blit(road_img, (0, 0))
+                for vehicle in vehicles_to_remove:
+                    vehicles.remove(vehicle)
+
+        if sim_clock.render_due():
+            # Draw everything
+            with profiler.stage('draw'):
+                screen.blit(road_img, (0, 0))
         
-        # Sort vehicles to ensure proper drawing order
-        vehicles_sorted = sorted(vehicles, key=lambda v: (-v.y if v.direction == NORTH else v.x if v.direction == EAST else v.y if v.direction == SOUTH else -v.x))
-        for vehicle in vehicles_sorted:
-            vehicle.draw()
+                # Sort vehicles to ensure proper drawing order
+                vehicles_sorted = sorted(vehicles, key=lambda v: (-v.y if v.direction == NORTH else v.x if v.direction == EAST else v.y if v.direction == SOUTH else -v.x))
+                for vehicle in vehicles_sorted:
+                    vehicle.draw()
             
-        traffic_light_system.draw()
+                traffic_light_system.draw()
         
-        # Calculate current traffic stats
-        current_counts = {
-            NORTH: len([v for v in vehicles if v.direction == NORTH]), 
-            EAST: len([v for v in vehicles if v.direction == EAST]), 
-            SOUTH: len([v for v in vehicles if v.direction == SOUTH]), 
-            WEST: len([v for v in vehicles if v.direction == WEST])
-        }
+            # Calculate current traffic stats
+            with profiler.stage('hud'):
+                current_counts = {
+                    NORTH: len([v for v in vehicles if v.direction == NORTH]), 
+                    EAST: len([v for v in vehicles if v.direction == EAST]), 
+                    SOUTH: len([v for v in vehicles if v.direction == SOUTH]), 
+                    WEST: len([v for v in vehicles if v.direction == WEST])
+                }
         
-        wait_times = defaultdict(int)
-        for vehicle in vehicles:
-            wait_times[vehicle.direction] += vehicle.wait_time
+                wait_times = defaultdict(int)
+                for vehicle in vehicles:
+                    wait_times[vehicle.direction] += vehicle.wait_time
             
-        for direction in wait_times:
-            if current_counts[direction] > 0:
-                wait_times[direction] /= current_counts[direction]
+                for direction in wait_times:
+                    if current_counts[direction] > 0:
+                        wait_times[direction] /= current_counts[direction]
                 
-        current_green = traffic_light_system.current_green if traffic_light_system.current_green is not None else -1
-        green_text = ["NORTH", "EAST", "SOUTH", "WEST"][current_green] if current_green != -1 else "NONE"
+                current_green = traffic_light_system.current_green if traffic_light_system.current_green is not None else -1
+                green_text = ["NORTH", "EAST", "SOUTH", "WEST"][current_green] if current_green != -1 else "NONE"
         
-        # Calculate average efficiency
-        avg_efficiency = traffic_light_system.efficiency_tracker.calculate_average_efficiency()
-        avg_wait = traffic_light_system.efficiency_tracker.calculate_average_wait()
-        throughput = traffic_light_system.efficiency_tracker.calculate_throughput()
+                # Calculate average efficiency
+                avg_efficiency = traffic_light_system.efficiency_tracker.calculate_average_efficiency()
+                avg_wait = traffic_light_system.efficiency_tracker.calculate_average_wait()
+                throughput = traffic_light_system.efficiency_tracker.calculate_throughput()
         
-        # Running time in minutes and seconds
-        runtime = (pygame.time.get_ticks() - start_time) / 1000  # seconds
-        minutes = int(runtime // 60)
-        seconds = int(runtime % 60)
+                # Running time in minutes and seconds
+                runtime = (sim_clock.now() - start_time) / 1000  # seconds
+                minutes = int(runtime // 60)
+                seconds = int(runtime % 60)
         
-        # Display stats
-        stats = [
-            f"Simulation Time: {minutes:02d}:{seconds:02d} | Cycle: {traffic_light_system.cycle_count}",
-            f"Vehicles: {len(vehicles)} | Crossed: {total_crossed} | Last Cycle: {traffic_light_system.last_cycle_vehicles_crossed}",
-            f"Green Light: {green_text} | Duration: {traffic_light_system.green_duration / 1000:.1f}s",
-            f"North: {current_counts[NORTH]} (Wait: {wait_times.get(NORTH, 0):.1f})",
-            f"East: {current_counts[EAST]} (Wait: {wait_times.get(EAST, 0):.1f})",
-            f"South: {current_counts[SOUTH]} (Wait: {wait_times.get(SOUTH, 0):.1f})",
-            f"West: {current_counts[WEST]} (Wait: {wait_times.get(WEST, 0):.1f})",
-            f"KNN Model: {'Trained' if traffic_light_system.knn_controller.is_trained else 'Training...'}",
-            f"Data Samples: {len(traffic_light_system.data_collector.features)}",
-            f"Efficiency: {avg_efficiency:.2f}% | Avg Wait: {avg_wait:.1f}",
-            f"Throughput: {throughput:.1f} vehicles/min"
-        ]
+                # Display stats
+                stats = [
+                    f"Simulation Time: {minutes:02d}:{seconds:02d} ({sim_clock.describe()}) | Cycle: {traffic_light_system.cycle_count}",
+                    f"Vehicles: {len(vehicles)} | Crossed: {total_crossed} | Last Cycle: {traffic_light_system.last_cycle_vehicles_crossed}",
+                    f"Green Light: {green_text} | Duration: {traffic_light_system.green_duration / 1000:.1f}s",
+                    f"North: {current_counts[NORTH]} (Wait: {wait_times.get(NORTH, 0):.1f})",
+                    f"East: {current_counts[EAST]} (Wait: {wait_times.get(EAST, 0):.1f})",
+                    f"South: {current_counts[SOUTH]} (Wait: {wait_times.get(SOUTH, 0):.1f})",
+                    f"West: {current_counts[WEST]} (Wait: {wait_times.get(WEST, 0):.1f})",
+                    f"KNN Model: {'Trained' if traffic_light_system.controller.is_trained else 'Training...'}",
+                    f"Data Samples: {len(traffic_light_system.controller.data_collector.features)} kept of {traffic_light_system.controller.data_collector.samples_seen}",
+                    f"Prediction cache: {traffic_light_system.controller.prediction_cache.hit_rate:.0%} hits",
+                    f"Efficiency: {avg_efficiency:.2f}% | Avg Wait: {avg_wait:.1f}",
+                    f"Throughput: {throughput:.1f} vehicles/min"
+                ]
+                if rewind is not None:
+                    stats.append(rewind.describe() + " (SPACE pauses)")
         
-        # Draw stats on screen
-        for i, stat in enumerate(stats):
-            text = font.render(stat, True, WHITE) if i < 3 else small_font.render(stat, True, WHITE)
-            screen.blit(text, (10, 10 + i * 25))
+                # Draw stats on screen
+                for i, stat in enumerate(stats):
+                    text = font.render(stat, True, WHITE) if i < 3 else small_font.render(stat, True, WHITE)
+                    screen.blit(text, (10, 10 + i * 25))
             
-        pygame.display.flip()
-        clock.tick(60)
+            profiler.draw_overlay(screen)
+            if rewind is not None:
+                rewind.draw_overlay(screen)
+            with profiler.stage('flip'):
+                pygame.display.flip()
+        with profiler.stage('wait'):
+            sim_clock.wait_frame()
+        profiler.end_frame()
+        memory_monitor.sample(sim_clock.now() / 1000)
     
     # Before exiting, save final data
     traffic_light_system.efficiency_tracker.save_to_csv()
+    if args.dataset:
+        traffic_light_system.controller.data_collector.save_csv(args.dataset)
+    if event_recorder is not None:
+        event_recorder.close()
+    if args.profile_export:
+        profiler.export(args.profile_export)
+    memory_monitor.stop()
+    if rewind is not None:
+        print(rewind.describe() + (f", {rewind.skipped} snapshots skipped" if rewind.skipped else ""))
+    if telemetry is not None:
+        telemetry.stop()
     plt.close('all')  # Close all matplotlib windows
     pygame.quit()
 
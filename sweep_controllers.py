@@ -0,0 +1,172 @@
+# Hyperparameter sweep for the learning controllers on headless simulations.
+#
+#   python sweep_controllers.py --controller knn --seconds 600 --seeds 0 1 2
+#   python sweep_controllers.py --controller tree --random 20 --workers 8
+#
+# Each (setting, seed) run is cached as JSON under sweep_cache/, named by a hash
+# of its configuration, so rerunning a sweep only simulates the missing points.
+# The configuration includes a hash of the source of the modules a run goes
+# through, so any change to the controllers or the engine invalidates the cache.
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from controllers import KNNTrafficController, DecisionTreeTrafficController
+from benchmark_controllers import run_controller, format_table
+
+CONTROLLER_CLASSES = {
+    'knn': KNNTrafficController,
+    'tree': DecisionTreeTrafficController,
+}
+
+# The first value in each list is the controllers' default
+PARAMETER_GRIDS = {
+    'knn': {
+        'n_neighbors': [3, 1, 5, 7, 9],
+        'min_samples': [10, 5, 20, 40],
+        'min_duration': [3000, 2000, 4000],
+        'max_duration': [10000, 8000, 15000],
+    },
+    'tree': {
+        'max_depth': [5, 3, 4, 6, 8],
+        'min_samples': [10, 5, 20, 40],
+        'min_duration': [3000, 2000, 4000],
+        'max_duration': [10000, 8000, 15000],
+    },
+}
+
+CACHE_DIR = "sweep_cache"
+# Modules whose code decides a run's result
+CODE_MODULES = ['controllers.py', 'fast_predict.py', 'retention.py', 'retraining.py', 'simulation_headless.py',
+                'benchmark_controllers.py']
+
+
+def code_version(modules=CODE_MODULES):
+    """Hash of the source of the modules a run depends on"""
+    digest = hashlib.sha1()
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name in modules:
+        with open(os.path.join(here, name), 'rb') as f:
+            digest.update(name.encode() + b'\0' + f.read())
+    return digest.hexdigest()[:16]
+
+
+def config_hash(config):
+    """Stable hash of a run configuration, used as its cache key"""
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def grid_points(grid):
+    names = sorted(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def random_points(grid, count, seed=0):
+    """Sample distinct settings from the grid"""
+    points = grid_points(grid)
+    return random.Random(seed).sample(points, min(count, len(points)))
+
+
+def evaluate(config):
+    """Run one configuration; executed in a worker process"""
+    controller = CONTROLLER_CLASSES[config['controller']](verbose=False, **config['params'])
+    result = run_controller(controller, config['seconds'], config['seed'], config['interval'])
+    return {key: result[key] for key in ('throughput', 'mean_wait', 'p95_wait', 'decision_ms', 'crossed')}
+
+
+def load_cached(cache_dir, key):
+    path = os.path.join(cache_dir, key + ".json")
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            return json.load(f)['result']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def save_cached(cache_dir, key, config, result):
+    path = os.path.join(cache_dir, key + ".json")
+    with open(path + ".tmp", 'w') as f:
+        json.dump({'config': config, 'result': result}, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def sweep(controller, points, seconds=600, seeds=(0,), interval=750, workers=None, cache_dir=CACHE_DIR):
+    """Evaluate every setting on every seed and return per-setting averages"""
+    os.makedirs(cache_dir, exist_ok=True)
+    runs = {}
+    todo = []
+    code = code_version()
+    for index, params in enumerate(points):
+        for seed in seeds:
+            config = {'controller': controller, 'params': params, 'seconds': seconds,
+                      'seed': seed, 'interval': interval, 'code': code}
+            key = config_hash(config)
+            cached = load_cached(cache_dir, key)
+            if cached is not None:
+                runs[(index, seed)] = cached
+            else:
+                todo.append((index, seed, key, config))
+
+    print(f"{len(points) * len(seeds)} runs, {len(todo)} to simulate, {len(runs)} cached")
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(evaluate, config): (index, seed, key, config)
+                       for index, seed, key, config in todo}
+            for done, future in enumerate(as_completed(futures), 1):
+                index, seed, key, config = futures[future]
+                result = future.result()
+                save_cached(cache_dir, key, config, result)
+                runs[(index, seed)] = result
+                print(f"[{done}/{len(todo)}] {format_params(config['params'])} seed {seed}: "
+                      f"{result['throughput']:.1f} veh/min, {result['mean_wait']:.1f}s wait")
+
+    results = []
+    for index, params in enumerate(points):
+        per_seed = [runs[(index, seed)] for seed in seeds]
+        summary = {key: sum(run[key] for run in per_seed) / len(per_seed) for key in per_seed[0]}
+        summary['setting'] = format_params(params)
+        summary['params'] = params
+        results.append(summary)
+    # Most vehicles through first, shorter waits break ties
+    results.sort(key=lambda item: (-item['throughput'], item['mean_wait']))
+    for rank, item in enumerate(results, 1):
+        item['rank'] = rank
+    return results
+
+
+def format_params(params):
+    return ' '.join(f"{name}={value}" for name, value in sorted(params.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep learning-controller settings on headless simulations")
+    parser.add_argument('--controller', choices=list(CONTROLLER_CLASSES), default='knn')
+    parser.add_argument('--seconds', type=float, default=600, help="simulated seconds per run")
+    parser.add_argument('--seeds', type=int, nargs='+', default=[0], help="demand seeds averaged per setting")
+    parser.add_argument('--interval', type=float, default=750, help="milliseconds between generated vehicles")
+    parser.add_argument('--random', type=int, default=0, help="sample this many settings instead of the full grid")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--top', type=int, default=20, help="rows to print")
+    args = parser.parse_args()
+
+    grid = PARAMETER_GRIDS[args.controller]
+    points = random_points(grid, args.random) if args.random else grid_points(grid)
+    results = sweep(args.controller, points, args.seconds, args.seeds, args.interval, args.workers, args.cache_dir)
+    columns = [
+        ('rank', '#', 4, 'd'),
+        ('setting', 'Setting', 64, ''),
+        ('throughput', 'Veh/min', 9, '.1f'),
+        ('mean_wait', 'Mean wait s', 12, '.1f'),
+        ('p95_wait', 'P95 wait s', 11, '.1f'),
+    ]
+    print(format_table(results[:args.top], columns))
+
+
+if __name__ == "__main__":
+    main()
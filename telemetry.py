@@ -0,0 +1,240 @@
+# Live telemetry for the simulators: per-cycle records over WebSocket and an OpenMetrics endpoint.
+#
+#   python simulation_knn.py --telemetry              # serves on 127.0.0.1:8765
+#   python telemetry.py 127.0.0.1:8765                # print the records as they arrive
+#   curl http://127.0.0.1:8765/metrics                # what a Prometheus-style scraper sees
+#
+# The server runs an asyncio event loop on a daemon thread. publish() is called
+# from the simulation loop and never blocks: it updates the scrape values and
+# hands the record to the event loop. Every WebSocket client has its own
+# bounded queue; when a slow client's queue is full its oldest record is
+# dropped, so no client can hold up the simulation or the other clients.
+# The WebSocket side is a minimal RFC 6455 implementation (text frames out,
+# close and ping in) so no extra package is needed.
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import struct
+import sys
+import threading
+
+WEBSOCKET_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+OPENMETRICS_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+# Gauges taken from the latest record: (record key, metric name, help)
+GAUGES = [
+    ('cleared', 'traffic_cycle_cleared_vehicles', "Vehicles that crossed during the last cycle"),
+    ('avg_wait', 'traffic_cycle_avg_wait_frames', "Mean wait of queued vehicles at the end of the last cycle"),
+    ('green_duration', 'traffic_cycle_green_milliseconds', "Green time of the last cycle"),
+    ('efficiency', 'traffic_cycle_efficiency', "Efficiency score of the last cycle"),
+    ('throughput', 'traffic_throughput_vehicles_per_minute', "Vehicles per minute over the last cycle"),
+    ('total_vehicles', 'traffic_vehicles', "Vehicles on the road at the end of the last cycle"),
+    ('trained', 'traffic_model_trained', "1 once the controller's model has been fitted"),
+    ('samples', 'traffic_model_samples', "Training samples the controller keeps"),
+    ('retrains', 'traffic_model_retrains', "Times the controller's model has been refitted"),
+]
+
+
+def websocket_frame(payload, opcode=0x1):
+    """Unmasked server-to-client frame"""
+    header = bytes([0x80 | opcode])
+    if len(payload) < 126:
+        header += bytes([len(payload)])
+    elif len(payload) < 1 << 16:
+        header += bytes([126]) + struct.pack('>H', len(payload))
+    else:
+        header += bytes([127]) + struct.pack('>Q', len(payload))
+    return header + payload
+
+
+async def read_frame(reader):
+    """Read one frame and return (opcode, payload), unmasking it if needed"""
+    first, second = await reader.readexactly(2)
+    length = second & 0x7f
+    if length == 126:
+        length, = struct.unpack('>H', await reader.readexactly(2))
+    elif length == 127:
+        length, = struct.unpack('>Q', await reader.readexactly(8))
+    mask = await reader.readexactly(4) if second & 0x80 else None
+    payload = await reader.readexactly(length)
+    if mask:
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+    return first & 0x0f, payload
+
+
+class TelemetryServer:
+    def __init__(self, host='127.0.0.1', port=8765, queue_size=64, name='intersection'):
+        self.host = host
+        self.port = port
+        self.queue_size = queue_size
+        self.name = name
+        self.clients = set()  # one asyncio.Queue per WebSocket client
+        self.latest = {}
+        self.cycles = 0
+        self.cleared_total = 0
+        self.dropped = 0
+        self.loop = None
+        self.thread = None
+        self.ready = threading.Event()
+
+    @classmethod
+    def add_arguments(cls, parser):
+        parser.add_argument('--telemetry', type=int, nargs='?', const=8765, metavar='PORT',
+                            help="stream per-cycle metrics over WebSocket and /metrics (default port 8765)")
+        parser.add_argument('--telemetry-host', default='127.0.0.1')
+        parser.add_argument('--telemetry-queue', type=int, default=64,
+                            help="records buffered per client before the oldest are dropped")
+
+    @classmethod
+    def from_args(cls, args, name):
+        """A started server, or None when --telemetry was not given"""
+        if args.telemetry is None:
+            return None
+        server = cls(args.telemetry_host, args.telemetry, args.telemetry_queue, name)
+        server.start()
+        return server
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='telemetry', daemon=True)
+        self.thread.start()
+        self.ready.wait()
+        print(f"Telemetry: ws://{self.host}:{self.port}/stream and http://{self.host}:{self.port}/metrics")
+
+    def run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        server = self.loop.run_until_complete(asyncio.start_server(self.handle, self.host, self.port))
+        self.ready.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            server.close()
+            self.loop.run_until_complete(server.wait_closed())
+            self.loop.close()
+
+    def stop(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(timeout=1)
+
+    def publish(self, record):
+        """Called from the simulation loop once per cycle; returns immediately"""
+        self.cycles += 1
+        self.cleared_total += record.get('cleared', 0)
+        self.latest = record
+        if self.clients:
+            self.loop.call_soon_threadsafe(self.fan_out, json.dumps(record).encode())
+
+    def fan_out(self, message):
+        for queue in self.clients:
+            if queue.full():
+                queue.get_nowait()
+                self.dropped += 1
+            queue.put_nowait(message)
+
+    def metrics(self):
+        """Current values in the OpenMetrics text format"""
+        label = f'{{intersection="{self.name}"}}'
+        lines = ["# TYPE traffic_cycles counter", "# HELP traffic_cycles Completed signal cycles",
+                 f"traffic_cycles_total{label} {self.cycles}",
+                 "# TYPE traffic_cleared_vehicles counter", "# HELP traffic_cleared_vehicles Vehicles cleared",
+                 f"traffic_cleared_vehicles_total{label} {self.cleared_total}"]
+        for key, metric, description in GAUGES:
+            if key in self.latest:
+                lines += [f"# TYPE {metric} gauge", f"# HELP {metric} {description}",
+                          f"{metric}{label} {float(self.latest[key]):g}"]
+        lines += ["# TYPE telemetry_clients gauge", f"telemetry_clients{label} {len(self.clients)}",
+                  "# TYPE telemetry_dropped_records counter",
+                  "# HELP telemetry_dropped_records Records dropped because a client fell behind",
+                  f"telemetry_dropped_records_total{label} {self.dropped}", "# EOF"]
+        return '\n'.join(lines) + '\n'
+
+    async def handle(self, reader, writer):
+        try:
+            request = await reader.readuntil(b'\r\n\r\n')
+            lines = request.decode('latin-1').split('\r\n')
+            path = lines[0].split(' ')[1] if len(lines[0].split(' ')) > 1 else '/'
+            headers = {k.strip().lower(): v.strip() for k, _, v in (line.partition(':') for line in lines[1:] if line)}
+            if headers.get('upgrade', '').lower() == 'websocket' and path in ('/', '/stream'):
+                await self.stream(reader, writer, headers['sec-websocket-key'])
+            elif path == '/metrics':
+                await self.respond(writer, '200 OK', OPENMETRICS_TYPE, self.metrics())
+            else:
+                await self.respond(writer, '404 Not Found', 'text/plain', "try /metrics or a WebSocket on /stream\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, KeyError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, content_type, body):
+        body = body.encode()
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+                     f"Connection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+
+    async def stream(self, reader, writer, key):
+        accept = base64.b64encode(hashlib.sha1(key.encode() + WEBSOCKET_GUID).digest()).decode()
+        writer.write(f"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                     f"Sec-WebSocket-Accept: {accept}\r\n\r\n".encode())
+        await writer.drain()
+        queue = asyncio.Queue(self.queue_size)
+        self.clients.add(queue)
+        listener = asyncio.ensure_future(self.listen(reader, writer))
+        try:
+            while not listener.done():
+                getter = asyncio.ensure_future(queue.get())
+                await asyncio.wait([getter, listener], return_when=asyncio.FIRST_COMPLETED)
+                if not getter.done():
+                    getter.cancel()
+                    break
+                writer.write(websocket_frame(getter.result()))
+                await writer.drain()
+        finally:
+            self.clients.discard(queue)
+            listener.cancel()
+
+    async def listen(self, reader, writer):
+        """Answer pings until the client closes"""
+        while True:
+            opcode, payload = await read_frame(reader)
+            if opcode == 0x8:
+                writer.write(websocket_frame(payload[:2], 0x8))
+                return
+            if opcode == 0x9:
+                writer.write(websocket_frame(payload, 0xA))
+
+
+async def watch(host, port):
+    """Minimal client: print every record the server streams"""
+    reader, writer = await asyncio.open_connection(host, port)
+    key = base64.b64encode(os.urandom(16)).decode()
+    writer.write(f"GET /stream HTTP/1.1\r\nHost: {host}:{port}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                 f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n".encode())
+    await writer.drain()
+    status = (await reader.readuntil(b'\r\n\r\n')).split(b'\r\n')[0].decode()
+    if ' 101 ' not in status:
+        sys.exit(f"no WebSocket at {host}:{port}: {status}")
+    while True:
+        opcode, payload = await read_frame(reader)
+        if opcode == 0x8:
+            return
+        if opcode == 0x1:
+            print(payload.decode(), flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print the records streamed by a simulator started with --telemetry")
+    parser.add_argument('address', nargs='?', default='127.0.0.1:8765', help="HOST:PORT")
+    args = parser.parse_args()
+    host, _, port = args.address.rpartition(':')
+    try:
+        asyncio.run(watch(host or '127.0.0.1', int(port)))
+    except (KeyboardInterrupt, asyncio.IncompleteReadError, ConnectionError):
+        pass
+
+
+if __name__ == "__main__":
+    main()
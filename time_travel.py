@@ -0,0 +1,178 @@
+# Rewindable history of a pygame simulation, for seeing how a jam formed.
+#
+#   python simulation_knn.py --rewind 600 --rewind-interval 1 --rewind-mb 16
+#
+#   SPACE        pause, or resume from the snapshot shown
+#   LEFT/RIGHT   one snapshot back/forward (with SHIFT, ten)
+#   HOME/END     oldest/newest snapshot
+#
+# Every `interval` simulated seconds the simulation packs its state into one
+# record of a structured array (clock, counters, lights, random generator) and
+# one row per vehicle. Records live in a fixed ring of slots; vehicle rows in a
+# circular buffer shared by all slots, each slot pointing at its own run of
+# rows. Both are allocated once and sized from the memory cap: the slots take
+# what the history length needs, the rest holds vehicle rows. When a new
+# snapshot does not fit, the oldest ones go, so heavy traffic shortens the
+# history kept rather than raising the memory use. Pausing takes one more
+# snapshot of the moment itself; resuming from an earlier one drops those after
+# it, since the run goes on from there on another course.
+import math
+import numpy as np
+
+MB = 1024 * 1024
+SCRUB_STEP = 10  # snapshots skipped per key press with SHIFT held
+
+
+def format_clock(ms):
+    seconds = int(ms // 1000)
+    return f"{seconds // 60:02d}:{seconds % 60:02d}"
+
+
+class SnapshotRing:
+    def __init__(self, state_dtype, row_dtype, seconds=600, interval=1.0, max_mb=16):
+        self.interval_ms = interval * 1000
+        slot_bytes = state_dtype.itemsize + 8 + 8 + 4  # plus the time, first row and row count
+        budget = int(max_mb * MB)
+        capacity = max(1, math.ceil(seconds / interval))
+        # Keep at least half the cap for vehicles; past that the history is shortened instead
+        capacity = min(capacity, max(1, budget // 2 // slot_bytes))
+        self.states = np.zeros(capacity, dtype=state_dtype)
+        self.times = np.zeros(capacity, dtype=np.float64)
+        self.first_rows = np.zeros(capacity, dtype=np.int64)  # absolute index into the row buffer
+        self.row_counts = np.zeros(capacity, dtype=np.int32)
+        self.rows = np.zeros(max(1, (budget - capacity * slot_bytes) // row_dtype.itemsize), dtype=row_dtype)
+        # Snapshots and rows are counted from the start of the run; modulo the array sizes gives their place
+        self.start = 0  # oldest snapshot kept
+        self.end = 0  # one past the newest
+        self.row_end = 0
+        self.next_due = 0.0
+        self.paused = False
+        self.cursor = 0  # snapshot shown while paused
+        self.skipped = 0  # snapshots with more vehicles than the whole row buffer holds
+        self.font = None
+
+    @classmethod
+    def add_arguments(cls, parser):
+        parser.add_argument('--rewind', type=float, default=600, metavar='SECONDS',
+                            help="simulated seconds of history to keep for rewinding (0: none)")
+        parser.add_argument('--rewind-interval', type=float, default=1.0, metavar='SECONDS',
+                            help="simulated seconds between rewind snapshots")
+        parser.add_argument('--rewind-mb', type=float, default=16, metavar='MB', help="memory cap of the history")
+
+    @classmethod
+    def from_args(cls, args, state_dtype, row_dtype):
+        if not args.rewind:
+            return None
+        return cls(state_dtype, row_dtype, args.rewind, args.rewind_interval, args.rewind_mb)
+
+    @property
+    def capacity(self):
+        return len(self.states)
+
+    def __len__(self):
+        return self.end - self.start
+
+    def nbytes(self):
+        """Bytes allocated for the history, the most it will ever use"""
+        return self.states.nbytes + self.times.nbytes + self.first_rows.nbytes + self.row_counts.nbytes + \
+            self.rows.nbytes
+
+    def used_bytes(self):
+        """Bytes taken by the snapshots held now"""
+        slot_bytes = self.states.itemsize + 8 + 8 + 4
+        rows = self.row_end - self.first_rows[self.start % self.capacity] if len(self) else 0
+        return len(self) * slot_bytes + rows * self.rows.itemsize
+
+    def span_ms(self):
+        """Simulated time between the oldest and the newest snapshot"""
+        if not len(self):
+            return 0.0
+        return self.times[(self.end - 1) % self.capacity] - self.times[self.start % self.capacity]
+
+    def due(self, time_ms):
+        return not self.paused and time_ms >= self.next_due
+
+    def push(self, time_ms, state, rows):
+        """Store a snapshot, dropping the oldest ones as needed to make room"""
+        self.next_due = time_ms + self.interval_ms
+        if len(rows) > len(self.rows):
+            self.skipped += 1
+            return False
+        if len(self) == self.capacity:
+            self.start += 1
+        while len(self) and self.row_end + len(rows) - self.first_rows[self.start % self.capacity] > len(self.rows):
+            self.start += 1
+        slot = self.end % self.capacity
+        self.states[slot] = state
+        self.times[slot] = time_ms
+        self.first_rows[slot] = self.row_end
+        self.row_counts[slot] = len(rows)
+        self.rows[(self.row_end + np.arange(len(rows))) % len(self.rows)] = rows
+        self.row_end += len(rows)
+        self.end += 1
+        return True
+
+    def get(self, index):
+        """The state record and vehicle rows of the snapshot with absolute index `index`"""
+        slot = index % self.capacity
+        rows = self.rows[(self.first_rows[slot] + np.arange(self.row_counts[slot])) % len(self.rows)]
+        return self.states[slot].copy(), rows
+
+    def shown(self):
+        return self.get(self.cursor)
+
+    def pause(self, time_ms, state, rows):
+        """Stop at a snapshot of the present moment; False when it could not be stored"""
+        if not self.push(time_ms, state, rows):
+            return False
+        self.paused = True
+        self.cursor = self.end - 1
+        return True
+
+    def scrub(self, delta):
+        """Move the snapshot shown by `delta`; False when it is already at that end"""
+        cursor = min(max(self.cursor + delta, self.start), self.end - 1)
+        if cursor == self.cursor:
+            return False
+        self.cursor = cursor
+        return True
+
+    def resume(self):
+        """Go on from the snapshot shown, forgetting the ones after it"""
+        slot = self.cursor % self.capacity
+        self.end = self.cursor + 1
+        self.row_end = self.first_rows[slot] + self.row_counts[slot]
+        self.next_due = self.times[slot] + self.interval_ms
+        self.paused = False
+
+    def describe(self):
+        """One line on how much history is held and the memory it takes"""
+        return (f"Rewind: {format_clock(self.span_ms())} kept, {self.used_bytes() / MB:.1f} of "
+                f"{self.nbytes() / MB:.1f} MB")
+
+    def draw_overlay(self, surface):
+        """Timeline along the bottom of the window while paused, with the snapshot shown marked"""
+        import pygame
+        if not self.paused:
+            return
+        if self.font is None:
+            self.font = pygame.font.SysFont('monospace', 14)
+        font = self.font
+        line_height = font.get_linesize()
+        width = surface.get_width() - 20
+        panel = pygame.Surface((width, 2 * line_height + 22), pygame.SRCALPHA)
+        panel.fill((0, 0, 0, 180))
+        newest = self.times[(self.end - 1) % self.capacity]
+        shown = self.times[self.cursor % self.capacity]
+        text = (f"PAUSED {format_clock(shown)} (-{format_clock(newest - shown)})  "
+                f"snapshot {self.cursor - self.start + 1} of {len(self)}  "
+                f"{self.used_bytes() / MB:.1f} of {self.nbytes() / MB:.1f} MB")
+        panel.blit(font.render(text, True, (255, 255, 255)), (5, 5))
+        panel.blit(font.render("LEFT/RIGHT scrub (SHIFT x10)  HOME/END ends  SPACE resume from here", True,
+                               (200, 200, 200)), (5, 5 + line_height))
+        bar_y = 10 + 2 * line_height
+        pygame.draw.rect(panel, (80, 80, 80), (5, bar_y, width - 10, 6))
+        span = self.span_ms()
+        marker = 5 + int((width - 10) * ((shown - self.times[self.start % self.capacity]) / span if span else 1.0))
+        pygame.draw.rect(panel, (255, 200, 0), (marker - 2, bar_y - 3, 4, 12))
+        surface.blit(panel, (10, surface.get_height() - panel.get_height() - 10))